@@ -0,0 +1,226 @@
+import datetime
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from sqlalchemy import literal, or_, select, union_all
+import models
+import pagination
+import search
+import serialization
+
+# Hot/cold split of job_requests.
+#
+# Jobs that reached a final status (completed, cancelled, rejected) more than
+# ARCHIVE_AFTER_DAYS ago (by creation date) are moved, with their
+# applications, into job_requests_archive / job_candidates_archive, so the
+# live table and its indexes only hold the jobs the app still works with.
+# With ARCHIVE_DATABASE_PATH set (SQLite) the archive tables live in that
+# file instead of the main database, see database.py; when switching an
+# existing install to it, run `python archive.py` once before the app so the
+# file gets its tables. Only the CLI creates them: the app never runs DDL.
+#
+# Each batch of ARCHIVE_BATCH_SIZE jobs is copied and then deleted in one
+# transaction, with a pause between batches so app writes get the lock in
+# between. A run first takes the "archive" row of the leases table (migration
+# 14) and renews it every batch, so with several app processes and a cron
+# job only one archives at a time; the others skip that round. A crashed
+# holder's lease runs out after ARCHIVE_LEASE_SECONDS. Rows already in the archive are not copied again, which keeps a
+# rerun after a crash between the two files harmless. Archiving goes around
+# the ORM on purpose: it must not count as completing or deleting the jobs
+# (see stats.py), and nothing is published to /job-requests/stream.
+#
+# GET /job-requests/{job_id}, the batch read and /users/{user_id}/requests
+# fall back to the archive, so clients can't tell where a job lives.
+# Archived jobs are read-only: the routes that change a job answer 404.
+#
+#   python archive.py               # archive everything due, in batches
+#   ARCHIVE_INTERVAL_SECONDS=3600   # or let the app do it in a background thread
+
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_PAUSE_SECONDS = float(os.getenv("ARCHIVE_PAUSE_SECONDS", "0.2"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "0"))  # 0: only the CLI archives
+ARCHIVE_LEASE_SECONDS = float(os.getenv("ARCHIVE_LEASE_SECONDS", "600"))  # Longer than any one batch
+LEASE_NAME = "archive"
+
+FINISHED_STATUSES = ("completed", "cancelled", "rejected")
+REQUEST_TYPES = ("open", "direct")
+
+logger = logging.getLogger(__name__)
+
+jobs = models.JobRequest.__table__
+candidates = models.JobCandidate.__table__
+archived_jobs = models.ArchivedJobRequest.__table__
+archived_candidates = models.ArchivedJobCandidate.__table__
+leases = models.Lease.__table__
+
+
+def create_tables(conn):
+    # Migration 10 does this for the main database; a new archive file gets
+    # its tables from `python archive.py`
+    archived_jobs.create(conn, checkfirst=True)
+    archived_candidates.create(conn, checkfirst=True)
+
+
+def cutoff(now=None):
+    return (now or datetime.datetime.utcnow()) - datetime.timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+def archive_batch(conn, before, limit=ARCHIVE_BATCH_SIZE):
+    """Move up to ``limit`` finished jobs created before ``before``; returns how many."""
+    # request_type and status are spelled out so the lookup seeks
+    # ix_job_requests_open_created instead of scanning the table
+    rows = conn.execute(select(jobs).where(
+        jobs.c.request_type.in_(REQUEST_TYPES),
+        jobs.c.status.in_(FINISHED_STATUSES),
+        jobs.c.createdAt < before,
+    ).limit(limit)).mappings().all()
+    if not rows:
+        return 0
+    ids = [row["id"] for row in rows]
+    done = set(conn.execute(select(archived_jobs.c.id).where(archived_jobs.c.id.in_(ids))).scalars())
+    now = datetime.datetime.utcnow()
+    new_rows = [{**row, "archivedAt": now} for row in rows if row["id"] not in done]
+    if new_rows:
+        conn.execute(archived_jobs.insert(), new_rows)
+        links = conn.execute(select(candidates).where(candidates.c.jobId.in_([r["id"] for r in new_rows]))).mappings().all()
+        if links:
+            conn.execute(archived_candidates.insert(), [dict(link) for link in links])
+
+    backend = search.backend_for(conn)
+    if backend is not None:
+        backend.remove_jobs(conn, ids)
+    conn.execute(candidates.delete().where(candidates.c.jobId.in_(ids)))
+    conn.execute(jobs.delete().where(jobs.c.id.in_(ids)))
+    return len(ids)
+
+
+def _take_lease(conn, holder):
+    """Take or renew the archive lease for ``holder``; False while someone else holds it."""
+    now = datetime.datetime.utcnow()
+    return conn.execute(leases.update().where(
+        leases.c.name == LEASE_NAME,
+        or_(leases.c.holder == holder, leases.c.expiresAt < now),
+    ).values(holder=holder, expiresAt=now + datetime.timedelta(seconds=ARCHIVE_LEASE_SECONDS))).rowcount == 1
+
+
+def _release_lease(conn, holder):
+    conn.execute(leases.update().where(leases.c.name == LEASE_NAME, leases.c.holder == holder).values(
+        holder=None, expiresAt=datetime.datetime.utcnow()
+    ))
+
+
+def run(engine, before=None, batch_size=ARCHIVE_BATCH_SIZE, pause=ARCHIVE_PAUSE_SECONDS):
+    """Archive every job due, one transaction per batch; returns how many were moved.
+
+    Returns 0 without archiving while another process holds the lease.
+    """
+    before = before or cutoff()
+    holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    total = 0
+    try:
+        while True:
+            with engine.begin() as conn:
+                # Renewed in the batch's transaction, so a batch never runs without it
+                if not _take_lease(conn, holder):
+                    if not total:
+                        logger.info("Archiver lease held by another process, skipping")
+                    break
+                moved = archive_batch(conn, before, batch_size)
+            total += moved
+            if moved < batch_size:
+                break
+            time.sleep(pause)
+    finally:
+        with engine.begin() as conn:
+            _release_lease(conn, holder)
+    if total:
+        logger.info("Archived %d finished jobs created before %s", total, before.date())
+    return total
+
+
+def start_background(engine, interval=ARCHIVE_INTERVAL_SECONDS):
+    """Archive every ``interval`` seconds in a daemon thread (no-op when 0).
+
+    Every app process may start one; the lease in ``run`` lets one archive.
+    """
+    if interval <= 0:
+        return None
+
+    def loop():
+        while True:
+            try:
+                run(engine)
+            except Exception:
+                logger.exception("Archiving finished jobs failed")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="job-archiver", daemon=True)
+    thread.start()
+    return thread
+
+
+def load_jobs(db, job_ids, fields=None):
+    """{job_id: JobRequestResponse dict} for the archived jobs among ``job_ids``."""
+    rows = serialization.job_rows(db, fields, archived=True).filter(
+        models.ArchivedJobRequest.id.in_(job_ids)
+    ).all()
+    return {row.id: item for row, item in zip(rows, serialization.job_dicts(db, rows, fields, archived=True))}
+
+
+def _history_filter(job_model, candidate_model, user_id):
+    # Jobs the user posted, was assigned or applied to
+    applied = select(candidate_model.jobId).where(candidate_model.providerId == user_id)
+    return or_(job_model.clientId == user_id, job_model.providerId == user_id, job_model.id.in_(applied))
+
+
+def history_page(db, user_id, cursor, limit, response, fields=None):
+    """A page of ``user_id``'s jobs, live and archived, newest first.
+
+    One statement: each table's page, read with the same keyset condition
+    from its own index, is merged with UNION ALL, so the cursor works across
+    them like on a single table and the archive costs no extra round trip.
+    """
+    sort_keys = [models.JobRequest.createdAt, models.JobRequest.id]
+    after = pagination.decode_cursor(cursor, 2, sort_keys) if cursor else None
+    parts = []
+    for archived, job_model, candidate_model in (
+        (False, models.JobRequest, models.JobCandidate),
+        (True, models.ArchivedJobRequest, models.ArchivedJobCandidate),
+    ):
+        columns = [job_model.createdAt, job_model.id]
+        query = serialization.job_rows(db, fields, archived).add_columns(literal(archived).label("archived")).filter(
+            _history_filter(job_model, candidate_model, user_id)
+        )
+        if after:
+            query = query.filter(pagination.after_cursor(columns, after, descending=True))
+        # Each part limited on its own so it stays an index range scan
+        part = query.order_by(*[c.desc() for c in columns]).limit(limit + 1).subquery()
+        parts.append(select(part))
+    merged = union_all(*parts).subquery()
+    rows = pagination.paginate(db.query(merged), [merged.c.createdAt, merged.c.id], None, limit, response, descending=True)
+
+    # A job caught between the copy and the delete of an interrupted run shows once
+    seen = set()
+    rows = [row for row in rows if not (row.id in seen or seen.add(row.id))]
+    items = {}
+    for archived in (False, True):
+        part = [row for row in rows if bool(row.archived) == archived]
+        items.update((row.id, item) for row, item in zip(part, serialization.job_dicts(db, part, fields, archived=archived)))
+    return [items[row.id] for row in rows]
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if sys.argv[1:]:
+        print("usage: python archive.py")
+        sys.exit(1)
+    with engine.begin() as conn:
+        create_tables(conn)
+    print(f"Archived {run(engine)} jobs")
@@ -0,0 +1,169 @@
+import asyncio
+import functools
+import logging
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import JWTError, jwt
+from passlib.context import CryptContext
+import cache
+
+# Password hashing and access tokens.
+#
+# Passwords are stored as bcrypt hashes. Rows still holding the plaintext
+# the old login compared against are accepted once and replaced with a hash
+# on that login, as are hashes with fewer rounds than BCRYPT_ROUNDS.
+#
+# bcrypt is slow on purpose (about a quarter of a second at 12 rounds) and
+# releases the GIL, so hashing runs on its own small pool: never on the event
+# loop, and never tying up the threadpool that serves database work. At most
+# HASH_QUEUE_LIMIT operations wait for it; past that login answers 503 with
+# Retry-After instead of queueing without bound.
+#
+# Access tokens are short-lived HS256 JWTs, checked without touching the
+# database. Decoded claims are cached per token until they expire, so a
+# client's follow-up requests skip the signature check too. Every request
+# that sends a token has it verified; with AUTH_REQUIRED=1 requests without
+# one are rejected on every route but PUBLIC_ROUTES. Routes that write on
+# behalf of a user answer 403 when the token's subject isn't that user (or
+# a party to the job), see check_owner.
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "64"))
+ACCESS_TOKEN_MINUTES = int(os.getenv("ACCESS_TOKEN_MINUTES", "15"))
+CLAIMS_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "0") == "1"
+ALGORITHM = "HS256"
+
+PUBLIC_ROUTES = {
+    ("GET", "/"),
+    ("GET", "/health"),
+    ("GET", "/metrics"),
+    ("POST", "/auth/login"),
+    ("GET", "/badges"),
+    ("GET", "/services"),
+    # Loaded by image tags, which can't send headers
+    ("GET", "/images/{digest}"),
+    ("GET", "/images/{digest}/thumbnail"),
+}
+
+logger = logging.getLogger(__name__)
+
+# Listing plaintext as a deprecated scheme makes verify_and_update() accept
+# the legacy rows and hand back their bcrypt replacement
+pwd_context = CryptContext(
+    schemes=["bcrypt", "plaintext"],
+    deprecated=["plaintext"],
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
+
+_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+_claims = cache.LRUCache(CLAIMS_CACHE_SIZE)
+_bearer = HTTPBearer(auto_error=False)
+
+
+async def _offload(fn, *args):
+    global _in_flight
+    with _in_flight_lock:
+        if _in_flight >= HASH_QUEUE_LIMIT:
+            raise HTTPException(status_code=503, detail="Too many logins in progress", headers={"Retry-After": "1"})
+        _in_flight += 1
+    try:
+        return await asyncio.wrap_future(_pool.submit(fn, *args))
+    finally:
+        with _in_flight_lock:
+            _in_flight -= 1
+
+
+def hash_password(password):
+    return pwd_context.hash(password)
+
+
+@functools.lru_cache(maxsize=None)
+def fixture_hash(password):
+    """One hash per distinct password, for seeding thousands of users at one bcrypt call."""
+    return hash_password(password)
+
+
+def _verify(password, stored):
+    if not stored:
+        # Same cost as a real check, so timing doesn't reveal unknown emails
+        pwd_context.dummy_verify()
+        return False, None
+    return pwd_context.verify_and_update(password, stored)
+
+
+async def verify_password(password, stored):
+    """(matches, new_hash) off the event loop; new_hash is set when ``stored`` needs replacing."""
+    return await _offload(_verify, password, stored)
+
+
+@functools.lru_cache(maxsize=None)
+def _secret_key():
+    # Every worker must share JWT_SECRET for tokens to work across them
+    key = os.getenv("JWT_SECRET")
+    if not key:
+        key = secrets.token_urlsafe(32)
+        logger.warning("JWT_SECRET is not set; tokens are only valid in this process until it restarts")
+    return key
+
+
+def create_access_token(user):
+    """(token, seconds until it expires) for a User."""
+    now = int(time.time())
+    lifetime = ACCESS_TOKEN_MINUTES * 60
+    claims = {"sub": user.id, "role": user.role, "iat": now, "exp": now + lifetime}
+    return jwt.encode(claims, _secret_key(), algorithm=ALGORITHM), lifetime
+
+
+def decode_token(token):
+    claims = _claims.get(token)
+    if claims is not None:
+        return claims
+    try:
+        claims = jwt.decode(token, _secret_key(), algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid or expired token", headers={"WWW-Authenticate": "Bearer"})
+    # The cache entry expires with the token, so a cached token is never stale
+    _claims.set(token, claims, max(0, claims["exp"] - time.time()))
+    return claims
+
+
+async def authenticate(request: Request, credentials: HTTPAuthorizationCredentials = Depends(_bearer)):
+    """App-wide dependency: the token's claims (also on ``request.state.user``) or None."""
+    if credentials is not None:
+        claims = decode_token(credentials.credentials)
+        request.state.user = claims
+        return claims
+    route = request.scope.get("route")
+    if AUTH_REQUIRED and (request.method, getattr(route, "path", None)) not in PUBLIC_ROUTES:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    request.state.user = None
+    return None
+
+
+def check_owner(claims, *user_ids):
+    """403 unless the caller is one of ``user_ids`` or an admin.
+
+    Without a token there is nobody to compare; that only gets this far with
+    AUTH_REQUIRED off, where the API stays open as before.
+    """
+    if claims is None or claims.get("role") == "admin" or claims["sub"] in user_ids:
+        return
+    raise HTTPException(status_code=403, detail="Not allowed to act for this user")
+
+
+def owner(param):
+    """Route dependency: check_owner against the path or query parameter ``param``."""
+    async def dependency(request: Request, claims=Depends(authenticate)):
+        check_owner(claims, request.path_params.get(param, request.query_params.get(param)))
+    return dependency
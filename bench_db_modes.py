@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+# Compares requests/sec of DB_MODE=sync and DB_MODE=async at a fixed
+# concurrency. The app runs in-process behind httpx's ASGI transport against
+# a seeded SQLite file; each mode runs in its own interpreter because the mode
+# is read when database.py is imported.
+#
+#   python bench_db_modes.py --concurrency 64 --requests 2000
+
+ENDPOINTS = [
+    "/job-requests?limit=50",
+    "/providers?limit=20",
+    "/users/c1/requests?limit=20",
+    "/providers/nearby?lat=10.344&lng=-67.042&radius_km=3",
+]
+
+
+def prepare(db_path, jobs):
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    import seed
+    import models
+    from database import SessionLocal
+
+    seed.seed_db()
+    db = SessionLocal()
+    rng = random.Random(7)
+    for i in range(jobs):
+        db.add(models.JobRequest(
+            id=f"bench-{i}",
+            clientId="c1",
+            title=f"Trabajo {i}",
+            description="Carga de prueba",
+            type=rng.choice(["electric", "plumbing", "mechanic", "construction"]),
+            budget_min=10,
+            budget_max=80,
+            latitude=10.30 + rng.random() * 0.08,
+            longitude=-67.08 + rng.random() * 0.08,
+        ))
+    db.commit()
+    db.close()
+
+
+async def drive(concurrency, total):
+    import httpx
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                started = time.perf_counter()
+                r = await client.get(ENDPOINTS[i % len(ENDPOINTS)])
+                latencies.append(time.perf_counter() - started)
+                errors += r.status_code >= 400
+
+        # Warm up caches and connections before timing
+        await asyncio.gather(*[client.get(url) for url in ENDPOINTS])
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def run_child(args):
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db}"
+    os.environ["DB_MODE"] = args.mode
+    result = asyncio.run(drive(args.concurrency, args.requests))
+    print(json.dumps(result))
+
+
+def run_parent(args):
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    prepare(db_path, args.jobs)
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {args.jobs} jobs")
+    print(f"{'mode':6} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for mode in ("sync", "async"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", "--mode", mode, "--db", db_path,
+             "--concurrency", str(args.concurrency), "--requests", str(args.requests)],
+            capture_output=True, text=True, check=True
+        )
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{mode:6} {result['rps']:9.1f} {result['p50_ms']:8.1f} {result['p99_ms']:8.1f} {result['errors']:7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--mode", choices=["sync", "async"])
+    parser.add_argument("--db")
+    parser.add_argument("--child", action="store_true")
+    args = parser.parse_args()
+    if args.child:
+        run_child(args)
+    else:
+        run_parent(args)
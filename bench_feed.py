@@ -0,0 +1,83 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+# Latency of the provider feed (feed.py) over a synthetic dataset:
+#   snapshot   loading the open jobs into arrays (once per refresh)
+#   score      scoring every open job and picking the page, per request
+#   endpoint   GET /providers/{provider_id}/feed end to end, snapshot warm
+#
+#   python bench_feed.py --jobs 100000 --rounds 200
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_feed.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ.setdefault("BLOB_DIR", os.path.join(os.path.dirname(DB_PATH), "blobs"))
+
+from database import SessionLocal
+import feed
+import models
+import synthetic
+
+
+def percentiles(values):
+    values = sorted(values)
+    return {p: values[min(len(values) - 1, int(p / 100 * len(values)))] for p in (50, 95, 99)}
+
+
+def report(name, seconds):
+    p = percentiles([s * 1000 for s in seconds])
+    print(f"{name:9} p50 {p[50]:7.2f} ms   p95 {p[95]:7.2f} ms   p99 {p[99]:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=100000)
+    parser.add_argument("--providers", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--page", type=int, default=20)
+    args = parser.parse_args()
+
+    # Every synthetic job is open until the load test or the app moves it on
+    synthetic.load(clients=5000, providers=args.providers, jobs=args.jobs, candidates=2, reviews=0, run="bf")
+    rng = random.Random(19)
+    db = SessionLocal()
+    try:
+        providers = db.query(models.User).filter(models.User.role == "provider").all()
+
+        timings = []
+        for _ in range(5):
+            started = time.perf_counter()
+            snapshot = feed.Snapshot.load(db)
+            timings.append(time.perf_counter() - started)
+        print(f"{len(snapshot)} open jobs")
+        report("snapshot", timings)
+
+        timings = []
+        for _ in range(args.rounds):
+            provider = rng.choice(providers)
+            started = time.perf_counter()
+            snapshot.top(snapshot.scores(provider, feed.WEIGHTS), args.page)
+            timings.append(time.perf_counter() - started)
+        report("score", timings)
+        sample = [p.id for p in rng.sample(providers, min(args.rounds, len(providers)))]
+    finally:
+        db.close()
+
+    from fastapi.testclient import TestClient
+    import main as app_main
+
+    client = TestClient(app_main.app)
+    client.get(f"/providers/{sample[0]}/feed")  # builds the shared snapshot
+    timings = []
+    for provider_id in sample:
+        started = time.perf_counter()
+        r = client.get(f"/providers/{provider_id}/feed", params={"limit": args.page})
+        timings.append(time.perf_counter() - started)
+        assert r.status_code == 200, r.text
+    report("endpoint", timings)
+
+
+if __name__ == "__main__":
+    main()
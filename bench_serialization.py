@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Per-item cost of turning a page of job requests into JSON bytes, comparing
+# the paths the list endpoints have used:
+#   orm+encoder   ORM objects -> jsonable_encoder -> json.dumps (older FastAPI)
+#   orm+pydantic  ORM objects -> JobRequestResponse -> dump_json (response_model)
+#   columns       column tuples -> dicts -> orjson (serialization.py fast path)
+# Query time is included, since skipping ORM materialization is part of the
+# saving. Also checks that the fast path returns exactly the same JSON.
+#
+#   python bench_serialization.py --jobs 2000 --page 200 --rounds 50
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_serialization.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from typing import List
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from database import SessionLocal
+import loaders
+import models
+import schemas
+import seed
+import serialization
+
+LIST_ADAPTER = TypeAdapter(List[schemas.JobRequestResponse])
+
+
+def prepare(jobs):
+    seed.seed_db()
+    db = SessionLocal()
+    rng = random.Random(13)
+    providers = [u.id for u in db.query(models.User).filter(models.User.role == "provider")]
+    for i in range(jobs):
+        job = models.JobRequest(
+            id=f"bench-{i:06d}",
+            clientId="c1",
+            providerId=rng.choice(providers) if i % 4 == 0 else None,
+            title=f"Trabajo {i}",
+            description="Instalación de tomacorrientes y revisión del tablero principal",
+            type=rng.choice(["electric", "plumbing", "mechanic", "construction"]),
+            budget_min=10,
+            budget_max=80.5,
+            latitude=10.30 + rng.random() * 0.08,
+            longitude=-67.08 + rng.random() * 0.08,
+            images=[f"/images/{i:064x}"],
+        )
+        db.add(job)
+        for provider_id in rng.sample(providers, k=min(len(providers), i % 3)):
+            db.add(models.JobCandidate(jobId=job.id, providerId=provider_id))
+    db.commit()
+    db.close()
+
+
+def page_query(db, query):
+    return query.filter(models.JobRequest.clientId == "c1").order_by(
+        models.JobRequest.createdAt.desc(), models.JobRequest.id.desc()
+    )
+
+
+def orm_jobs(db, page):
+    return page_query(db, db.query(models.JobRequest).options(*loaders.job_options())).limit(page).all()
+
+
+def orm_encoder(db, page):
+    jobs = LIST_ADAPTER.validate_python(orm_jobs(db, page), from_attributes=True)
+    return json.dumps(jsonable_encoder(jobs)).encode()
+
+
+def orm_pydantic(db, page):
+    return LIST_ADAPTER.dump_json(LIST_ADAPTER.validate_python(orm_jobs(db, page), from_attributes=True))
+
+
+def columns(db, page):
+    rows = page_query(db, serialization.job_rows(db)).limit(page).all()
+    return serialization.dumps(serialization.job_dicts(db, rows))
+
+
+PATHS = [("orm+encoder", orm_encoder), ("orm+pydantic", orm_pydantic), ("columns", columns)]
+
+
+def measure(fn, page, rounds):
+    timings = []
+    for _ in range(rounds):
+        db = SessionLocal()
+        started = time.perf_counter()
+        fn(db, page)
+        timings.append(time.perf_counter() - started)
+        db.close()
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--page", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    prepare(args.jobs)
+
+    db = SessionLocal()
+    expected = json.loads(orm_pydantic(db, args.page))
+    actual = json.loads(columns(db, args.page))
+    db.close()
+    if expected != actual:
+        print("FAIL column path output differs from the response_model output")
+        sys.exit(1)
+
+    encoder = "orjson" if serialization.orjson is not None else "json (orjson not installed)"
+    print(f"{args.page} items per page, median of {args.rounds} rounds, encoder: {encoder}")
+    baseline = None
+    for name, fn in PATHS:
+        fn(SessionLocal(), args.page)  # warm up caches / adapters
+        seconds = measure(fn, args.page, args.rounds)
+        per_item = seconds / args.page * 1e6
+        baseline = baseline or per_item
+        print(f"{name:14} {seconds * 1000:8.2f} ms/page {per_item:8.1f} us/item  {baseline / per_item:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
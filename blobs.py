@@ -0,0 +1,150 @@
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+
+# Content-addressed image store. Images are saved once under their SHA-256
+# (blobs/ab/cd/abcd...), rows only keep a short "/images/<digest>" reference,
+# and identical uploads are deduplicated for free. A fixed-size JPEG thumbnail
+# is written next to each original when Pillow is available.
+
+BLOB_DIR = os.path.abspath(os.getenv("BLOB_DIR", os.path.join(os.path.dirname(__file__), "blobs")))
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+THUMBNAIL_SIZE = (256, 256)
+URL_PREFIX = "/images/"
+
+logger = logging.getLogger(__name__)
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+_DATA_URI_RE = re.compile(r"^data:(image/[\w.+-]+)?(;[\w=-]+)*;base64,", re.IGNORECASE)
+
+# Leading bytes of the formats the app uploads
+_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+def content_type(data):
+    for signature, mime in _SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def is_digest(value):
+    return bool(_DIGEST_RE.match(value or ""))
+
+
+def blob_path(digest):
+    return os.path.join(BLOB_DIR, digest[:2], digest[2:4], digest)
+
+
+def thumbnail_path(digest):
+    return blob_path(digest) + ".thumb.jpg"
+
+
+def url_for(digest):
+    return URL_PREFIX + digest
+
+
+def thumbnail_url_for(digest):
+    return URL_PREFIX + digest + "/thumbnail"
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def make_thumbnail(digest):
+    """Write the thumbnail for ``digest``; returns its path.
+
+    None without Pillow, or when Pillow can't decode the stored blob.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    path = thumbnail_path(digest)
+    if os.path.exists(path):
+        return path
+    try:
+        with Image.open(blob_path(digest)) as img:
+            img = img.convert("RGB")
+            img.thumbnail(THUMBNAIL_SIZE)
+            out = io.BytesIO()
+            img.save(out, "JPEG", quality=80, optimize=True)
+    except (OSError, Image.DecompressionBombError) as e:
+        # UnidentifiedImageError is an OSError too: corrupt or unsupported data
+        logger.warning("Can't make a thumbnail of %s: %s", digest, e)
+        return None
+    _write_atomic(path, out.getvalue())
+    return path
+
+
+def store(data):
+    """Save image bytes and return their digest. Raises ValueError if not an image."""
+    if len(data) > MAX_IMAGE_BYTES:
+        raise ValueError("Image too large")
+    if content_type(data) is None:
+        raise ValueError("Unsupported image format")
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    try:
+        make_thumbnail(digest)
+    except Exception as e:
+        # The original is still usable; the thumbnail is retried when requested
+        logger.warning("Thumbnail failed for %s: %s", digest, e)
+    return digest
+
+
+def _decode_inline(value):
+    match = _DATA_URI_RE.match(value)
+    payload = value[match.end():] if match else value
+    # Bare base64 is only considered for long strings; JPEG base64 starts with
+    # "/9j/", so a leading slash alone doesn't mean it's a path
+    if not match and (len(value) < 256 or value.startswith(("http://", "https://", URL_PREFIX))):
+        return None
+    try:
+        data = base64.b64decode(payload, validate=False)
+    except (binascii.Error, ValueError):
+        return None
+    return data if content_type(data) else None
+
+
+def externalize(value):
+    """Replace an inline (data URI / base64) image with a store reference.
+
+    URLs and existing references are returned untouched.
+    """
+    if not value or not isinstance(value, str):
+        return value
+    data = _decode_inline(value)
+    if data is None:
+        return value
+    return url_for(store(data))
+
+
+def externalize_list(values):
+    if not values:
+        return values
+    return [externalize(v) for v in values]
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from fastapi import Response
+
+# Read-through response cache for the catalog and profile endpoints.
+#
+# Entries hold the already-serialized body plus its ETag, so a hit (and in
+# particular a matching If-None-Match, answered with 304) costs no database
+# work and no serialization. Write paths call ``invalidate`` after commit.
+#
+# Entries are stored under the key's current generation. ``invalidate``
+# moves the generation on instead of deleting, so a miss that read the
+# database before a write but stores after its invalidation puts its stale
+# body where no later read looks.
+#
+# The backend is picked from the environment:
+#   CACHE_BACKEND=memory (default)   in-process LRU with TTL
+#   CACHE_BACKEND=redis              shared cache at REDIS_URL (needs `redis`)
+
+CATALOG_TTL = int(os.getenv("CACHE_CATALOG_TTL", "3600"))  # /services, /badges
+PROFILE_TTL = int(os.getenv("CACHE_PROFILE_TTL", "300"))  # /providers/{provider_id}
+MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+# Generations outlive every entry stored under them
+GENERATION_TTL = 2 * max(CATALOG_TTL, PROFILE_TTL)
+
+
+class CachedResponse:
+    __slots__ = ("etag", "body", "headers")
+
+    def __init__(self, body, headers=None, etag=None):
+        self.body = body
+        self.headers = headers or {}
+        self.etag = etag or '"%s"' % hashlib.sha1(body).hexdigest()
+
+    def to_json(self):
+        return json.dumps({"etag": self.etag, "body": self.body.decode(), "headers": self.headers})
+
+    @classmethod
+    def from_json(cls, raw):
+        data = json.loads(raw)
+        return cls(data["body"].encode(), data["headers"], data["etag"])
+
+
+class CacheBackend(ABC):
+    """Interface shared by the cache backends."""
+
+    @abstractmethod
+    def get(self, key):
+        ...
+
+    @abstractmethod
+    def set(self, key, value, ttl):
+        ...
+
+    @abstractmethod
+    def delete(self, key):
+        ...
+
+    @abstractmethod
+    def delete_prefix(self, prefix):
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+
+class LRUCache(CacheBackend):
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisCache(CacheBackend):
+    def __init__(self, url, namespace="truber:"):
+        import redis  # optional dependency, only needed for the shared backend
+        self._redis = redis.Redis.from_url(url)
+        self.namespace = namespace
+
+    def get(self, key):
+        raw = self._redis.get(self.namespace + key)
+        return CachedResponse.from_json(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self._redis.set(self.namespace + key, value.to_json(), ex=ttl)
+
+    def delete(self, key):
+        self._redis.delete(self.namespace + key)
+
+    def delete_prefix(self, prefix):
+        keys = list(self._redis.scan_iter(match=self.namespace + prefix + "*"))
+        if keys:
+            self._redis.delete(*keys)
+
+    def clear(self):
+        self.delete_prefix("")
+
+
+def _make_backend():
+    if os.getenv("CACHE_BACKEND", "memory") == "redis":
+        return RedisCache(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    return LRUCache()
+
+
+backend = _make_backend()
+# Redis calls wait on the network: handlers that use the cache then stay off
+# the event loop in async mode (see database.db_handler)
+BLOCKING = isinstance(backend, RedisCache)
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in candidates or "W/" + etag in candidates
+
+
+def cached_response(request, key, build, ttl):
+    """Serve ``key`` from the cache, building it with ``build()`` on a miss.
+
+    ``build`` returns ``(body_bytes, headers)``. Responses carry an ETag and
+    a matching ``If-None-Match`` gets an empty 304.
+    """
+    key = f"{key}#{_generation(key)}"
+    entry = backend.get(key)
+    if entry is None:
+        body, headers = build()
+        entry = CachedResponse(body, headers)
+        backend.set(key, entry, ttl)
+
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    headers.update(entry.headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+def _generation_key(key):
+    return f"gen:{key}"
+
+
+def _generation(key):
+    entry = backend.get(_generation_key(key))
+    return entry.body.decode() if entry is not None else "0"
+
+
+def invalidate(key):
+    # A new random generation; stored as a CachedResponse like every value
+    backend.set(_generation_key(key), CachedResponse(uuid.uuid4().hex.encode()), GENERATION_TTL)
+
+
+def invalidate_prefix(prefix):
+    backend.delete_prefix(prefix)
+
+
+def provider_key(provider_id):
+    return f"provider:{provider_id}"
@@ -0,0 +1,63 @@
+import sys
+
+# Geometry cases the map queries and the job feed must agree on, chiefly
+# viewports across the antimeridian (min_lng > max_lng). Pure functions, no
+# database needed; exits non-zero on the first mismatch.
+#
+#   python check_geo.py
+
+import asyncio
+import events
+import geo
+
+# (min_lng, max_lng, segments)
+SEGMENTS = [
+    (-10.0, 10.0, [(-10.0, 10.0)]),
+    (170.0, -170.0, [(170.0, 180.0), (-180.0, -170.0)]),
+    (175.0, 185.0, [(175.0, 180.0), (-180.0, -175.0)]),
+    (-185.0, -175.0, [(175.0, 180.0), (-180.0, -175.0)]),
+    (-200.0, 200.0, [(-180.0, 180.0)]),
+]
+
+# (bbox, latitude, longitude, matches)
+FEED = [
+    ((-10.0, 170.0, 10.0, -170.0), 0.0, 179.9, True),
+    ((-10.0, 170.0, 10.0, -170.0), 0.0, -179.9, True),
+    ((-10.0, 170.0, 10.0, -170.0), 0.0, 0.0, False),
+    ((-10.0, 170.0, 10.0, -170.0), 20.0, 179.9, False),
+    ((-10.0, -10.0, 10.0, 10.0), 0.0, 5.0, True),
+    ((-10.0, -10.0, 10.0, 10.0), 0.0, 179.9, False),
+]
+
+
+def main_check():
+    failures = 0
+    for min_lng, max_lng, expected in SEGMENTS:
+        got = geo.lng_segments(min_lng, max_lng)
+        ok = got == expected
+        failures += not ok
+        print(f"{'ok' if ok else 'FAIL':4} lng_segments({min_lng}, {max_lng}) = {got}")
+
+    # A wrapped viewport's cells cover both sides of the antimeridian
+    cells = geo.covering_cells(-10.0, 170.0, 10.0, -170.0)
+    for lat, lng in ((0.0, 179.9), (0.0, -179.9)):
+        ok = any(geo.encode(lat, lng).startswith(cell) for cell in cells)
+        failures += not ok
+        print(f"{'ok' if ok else 'FAIL':4} covering_cells across the antimeridian holds ({lat}, {lng})")
+
+    loop = asyncio.new_event_loop()
+    for bbox, lat, lng, expected in FEED:
+        event = events.Event(1, "job.created", {"latitude": lat, "longitude": lng})
+        ok = events.Subscription(loop, bbox=bbox).matches(event) == expected
+        failures += not ok
+        print(f"{'ok' if ok else 'FAIL':4} feed bbox {bbox} {'takes' if expected else 'skips'} ({lat}, {lng})")
+    loop.close()
+
+    if failures:
+        print(f"{failures} geometry check(s) failed")
+        sys.exit(1)
+    print("All geometry checks pass")
+
+
+if __name__ == "__main__":
+    main_check()
@@ -0,0 +1,117 @@
+import os
+import sys
+import tempfile
+
+# Counts the SQL statements each endpoint issues against a freshly seeded
+# throwaway database and exits non-zero when one goes over its budget, so an
+# accidental N+1 (e.g. a relationship left to lazy-load) fails loudly.
+#
+#   python check_query_budget.py
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "query_budget.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from sqlalchemy import event
+from fastapi.testclient import TestClient
+from database import engine
+import seed
+import main
+
+# (method, path, params/body, max statements)
+BUDGETS = [
+    ("POST", "/auth/login", {"email": "carlos.r@truber.com", "password": "1234"}, 4),
+    ("GET", "/providers", {}, 4),
+    ("GET", "/providers", {"limit": 5}, 4),
+    ("GET", "/providers", {"fields": "id,name,rating"}, 1),
+    ("GET", "/providers/p1", {}, 4),
+    ("GET", "/providers/batch", {"ids": "p1,p2,p3,p4,p5"}, 4),
+    ("GET", "/providers/p1/feed", {}, 5),
+    ("GET", "/providers/nearby", {"lat": 10.344, "lng": -67.042, "radius_km": 5}, 12),
+    ("GET", "/badges", {}, 1),
+    ("GET", "/services", {}, 1),
+    ("GET", "/job-requests", {}, 2),
+    ("GET", "/job-requests", {"lat": 10.344, "lng": -67.042, "radius_km": 5}, 3),
+    ("GET", "/users/c1/requests", {}, 2),  # live + archived jobs in one UNION, candidates
+    ("GET", "/users/p1/requests", {}, 2),
+    ("GET", "/search/jobs", {"q": "reparacion"}, 3),
+    ("GET", "/search/providers", {"q": "fontaneria"}, 5),
+    ("GET", "/job-requests/{job_id}", {}, 2),
+    ("GET", "/job-requests/batch", {"ids": "{job_ids}"}, 2),
+    ("POST", "/job-requests/batch", {"operations": [
+        {"job_id": "{job_id}", "action": "assign", "provider_id": "p1"},
+        {"job_id": "{job_id}", "action": "status", "status": "in_process"},
+    ]}, 5),  # + the sync sequence number (sync.py)
+    ("GET", "/sync", {}, 8),  # watermark, jobs, candidates, users, badges, portfolio, services, badges
+    ("GET", "/sync", {"since": "WzBd", "user_id": "c1"}, 9),  # token of seq 0, plus tombstones
+]
+
+JOB_COUNT = 40
+
+
+def fill(value, **ids):
+    """``value`` with ``{job_id}``-style placeholders replaced, inside dicts and lists too."""
+    if isinstance(value, str):
+        return value.format(**ids)
+    if isinstance(value, dict):
+        return {k: fill(v, **ids) for k, v in value.items()}
+    if isinstance(value, list):
+        return [fill(v, **ids) for v in value]
+    return value
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def prepare(client):
+    seed.seed_db()
+    job_ids = []
+    for i in range(JOB_COUNT):
+        r = client.post("/job-requests", params={"userId": "c1"}, json={
+            "title": f"Trabajo {i}",
+            "description": "Prueba de presupuesto de consultas",
+            "type": "electric",
+            "budget_min": 10,
+            "budget_max": 50,
+            "latitude": 10.33 + (i % 10) * 0.003,
+            "longitude": -67.05 + (i // 10) * 0.003,
+        })
+        job_ids.append(r.json()["id"])
+    for job_id in job_ids[:10]:
+        client.put(f"/job-requests/{job_id}/apply", params={"provider_id": "p1"})
+    return job_ids
+
+
+def main_check():
+    client = TestClient(main.app)
+    job_ids = prepare(client)
+    counter = StatementCounter()
+    event.listen(engine, "before_cursor_execute", counter)
+
+    failures = 0
+    for method, path, params, budget in BUDGETS:
+        ids = {"job_id": job_ids[0], "job_ids": ",".join(job_ids[:20])}
+        url, params = fill(path, **ids), fill(params, **ids)
+        counter.count = 0
+        if method == "GET":
+            r = client.get(url, params=params)
+        else:
+            r = client.request(method, url, json=params)
+        over = r.status_code >= 400 or counter.count > budget
+        failures += over
+        label = "FAIL" if over else "ok"
+        print(f"{label:4} {method:4} {url:45} {str(params)[:40]:40} {counter.count:3} / {budget} (HTTP {r.status_code})")
+
+    event.remove(engine, "before_cursor_execute", counter)
+    if failures:
+        print(f"{failures} endpoint(s) over their query budget")
+        sys.exit(1)
+    print("All endpoints within their query budget")
+
+
+if __name__ == "__main__":
+    main_check()
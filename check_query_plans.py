@@ -0,0 +1,144 @@
+import os
+import sys
+import tempfile
+
+# Runs each endpoint against a throwaway synthetic database, EXPLAINs every
+# SELECT it issues and exits non-zero when one reads a table without an
+# index or the endpoint's main query doesn't use the index designed for it,
+# so a filter or sort that drifts away from the indexes in models.py
+# fails here instead of as a slow page in production.
+#
+#   python check_query_plans.py                     # SQLite temp database
+#   DATABASE_URL=postgresql://... python check_query_plans.py
+#
+# On Postgres the planner would rightly pick sequential scans on a small test
+# database, so the check runs with enable_seqscan off: a Seq Scan that is
+# still chosen means no index can serve the query at all.
+
+if not os.getenv("DATABASE_URL"):
+    DB_PATH = os.path.join(tempfile.mkdtemp(), "query_plans.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+    os.environ.setdefault("BLOB_DIR", os.path.join(os.path.dirname(DB_PATH), "blobs"))
+
+from sqlalchemy import event
+from fastapi.testclient import TestClient
+from database import engine
+import synthetic
+import main
+
+# Catalogs small enough that reading them whole is the right plan
+SMALL_TABLES = {"services", "badges"}
+
+# (method, path, params/body, index the main query must use or None)
+ENDPOINTS = [
+    ("POST", "/auth/login", {"email": "carlos.r@truber.com", "password": "1234"}, "ix_users_email"),
+    ("GET", "/providers", {}, "ix_users_role_created"),
+    ("GET", "/providers", {"sort": "rating", "min_rating": 4}, "ix_users_role_rating"),
+    ("GET", "/providers", {"sort": "jobs"}, "ix_users_role_jobs"),
+    ("GET", "/providers/{provider_id}", {}, None),
+    ("GET", "/providers/batch", {"ids": "sqpp0,sqpp1,sqpp2"}, None),
+    ("GET", "/providers/{provider_id}/feed", {}, None),
+    ("GET", "/providers/nearby", {"lat": 10.344, "lng": -67.042, "radius_km": 5, "type": "electric"},
+     "ix_users_role_geohash"),
+    ("GET", "/badges", {}, None),
+    ("GET", "/services", {}, None),
+    ("GET", "/job-requests", {}, "ix_job_requests_open_created"),
+    ("GET", "/job-requests", {"type": "plumbing"}, "ix_job_requests_open_type_created"),
+    ("GET", "/job-requests", {"lat": 10.344, "lng": -67.042, "radius_km": 5}, "ix_job_requests_open_geohash"),
+    ("GET", "/job-requests", {"min_lat": 10.3, "min_lng": -67.1, "max_lat": 10.4, "max_lng": -67.0, "type": "electric"},
+     "ix_job_requests_open_geohash"),
+    ("GET", "/job-requests/{job_id}", {}, None),
+    ("GET", "/job-requests/batch", {"ids": "sqpj0,sqpj1,sqpj2"}, None),
+    ("GET", "/users/{client_id}/requests", {}, "ix_job_requests_client_created"),
+    ("GET", "/users/{provider_id}/requests", {}, "ix_job_requests_provider_created"),
+    ("GET", "/search/jobs", {"q": "instalacion"}, None),
+    ("GET", "/search/providers", {"q": "electricista"}, None),
+    ("GET", "/sync", {"limit": 100}, "ix_job_requests_open_seq"),
+    ("GET", "/sync", {"since": "WzBd", "user_id": "sqpc0"}, "ix_job_requests_open_seq"),  # token of seq 0
+]
+
+
+class PlanRecorder:
+    """Collects (statement, plan lines) for every SELECT while enabled."""
+
+    def __init__(self, dialect):
+        self.dialect = dialect
+        self.plans = []
+        self.enabled = False
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if not self.enabled or executemany or not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            return
+        explain = conn.connection.dbapi_connection.cursor()
+        try:
+            if self.dialect == "postgresql":
+                explain.execute("SET LOCAL enable_seqscan = off")
+                explain.execute("EXPLAIN " + statement, parameters)
+            else:
+                explain.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            lines = [str(row[-1]) for row in explain.fetchall()]
+        finally:
+            explain.close()
+        self.plans.append((statement, lines))
+
+
+def full_scans(lines, dialect):
+    """Tables the plan reads without an index."""
+    scanned = []
+    for line in lines:
+        words = line.replace("->", "").split()
+        if dialect == "postgresql":
+            if "Seq Scan on" in line:
+                scanned.append(words[words.index("on") + 1])
+        elif words[:1] == ["SCAN"] and len(words) > 1:
+            # "SCAN t" reads every row; "SCAN t USING [COVERING] INDEX ..." walks an index in
+            # order, FTS5 tables answer MATCH from their own index, subqueries are reported apart
+            if "INDEX" not in words and "VIRTUAL" not in words and not words[1].startswith(("(", "anon_")):
+                scanned.append(words[1])
+    return [table for table in scanned if table not in SMALL_TABLES]
+
+
+def prepare():
+    synthetic.load(clients=300, providers=100, jobs=3000, candidates=2, reviews=500, run="qp", seed_value=20)
+    return {"provider_id": "sqpp0", "client_id": "sqpc0", "job_id": "sqpj0"}
+
+
+def main_check():
+    ids = prepare()
+    client = TestClient(main.app)
+    recorder = PlanRecorder(engine.dialect.name)
+    event.listen(engine, "before_cursor_execute", recorder)
+
+    failures = 0
+    for method, path, params, expected in ENDPOINTS:
+        url = path.format(**ids)
+        recorder.plans = []
+        recorder.enabled = True
+        if method == "GET":
+            r = client.get(url, params=params)
+        else:
+            r = client.request(method, url, json=params)
+        recorder.enabled = False
+
+        bad = [(statement, full_scans(lines, recorder.dialect)) for statement, lines in recorder.plans]
+        bad = [(statement, tables) for statement, tables in bad if tables]
+        # Index names show up in SQLite and Postgres plans alike
+        missing = expected and not any(expected in line for _, lines in recorder.plans for line in lines)
+        failed = bad or missing or r.status_code >= 400
+        failures += bool(failed)
+        label = "FAIL" if failed else "ok"
+        print(f"{label:4} {method:4} {url:34} {str(params)[:50]:50} {len(recorder.plans):2} selects (HTTP {r.status_code})")
+        for statement, tables in bad:
+            print(f"       full scan of {', '.join(tables)}: {' '.join(statement.split())[:150]}")
+        if missing:
+            print(f"       {expected} not used")
+
+    event.remove(engine, "before_cursor_execute", recorder)
+    if failures:
+        print(f"{failures} endpoint(s) with queries that don't use an index")
+        sys.exit(1)
+    print("Every endpoint query uses an index")
+
+
+if __name__ == "__main__":
+    main_check()
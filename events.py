@@ -0,0 +1,168 @@
+import asyncio
+import datetime
+import itertools
+import json
+import threading
+from abc import ABC, abstractmethod
+import geo
+
+# Job feed pub/sub. Write handlers publish small delta events after commit;
+# each connected client holds a Subscription filtered by map area and service
+# type. Delivery never blocks the publisher: every subscriber has a bounded
+# queue and, when a slow client lets it fill up, the oldest events are
+# dropped and the client is told to resync with a plain GET.
+#
+# The in-process broker only reaches clients of this worker. Multi-worker
+# deployments plug in another Broker (e.g. backed by Redis pub/sub) that
+# forwards to a local InProcessBroker.
+
+SUBSCRIBER_QUEUE_SIZE = 100
+HEARTBEAT_SECONDS = 15
+
+
+def _json_default(value):
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+class Event:
+    __slots__ = ("seq", "kind", "data", "at")
+
+    def __init__(self, seq, kind, data):
+        self.seq = seq
+        self.kind = kind
+        self.data = data
+        self.at = datetime.datetime.utcnow().isoformat()
+
+    def to_sse(self):
+        payload = json.dumps({"seq": self.seq, "at": self.at, **self.data}, default=_json_default)
+        return f"id: {self.seq}\nevent: {self.kind}\ndata: {payload}\n\n"
+
+
+class Subscription:
+    def __init__(self, loop, bbox=None, types=None, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.loop = loop
+        self.bbox = bbox  # (min_lat, min_lng, max_lat, max_lng) or None
+        # min_lng > max_lng: a viewport across the antimeridian, as on /job-requests
+        self.lng_segments = geo.lng_segments(bbox[1], bbox[3]) if bbox is not None else None
+        self.types = types  # set of job types or None for all
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def matches(self, event):
+        data = event.data
+        if self.types is not None and data.get("type") not in self.types:
+            return False
+        if self.bbox is not None:
+            lat, lng = data.get("latitude"), data.get("longitude")
+            if lat is None or lng is None:
+                return False
+            min_lat, _, max_lat, _ = self.bbox
+            if not min_lat <= lat <= max_lat:
+                return False
+            if not any(low <= lng <= high for low, high in self.lng_segments):
+                return False
+        return True
+
+    def offer(self, event):
+        """Enqueue without blocking; runs on the subscriber's event loop."""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def next(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Broker(ABC):
+    """Interface for job feed brokers."""
+
+    @abstractmethod
+    def publish(self, kind, data):
+        ...
+
+    @abstractmethod
+    def subscribe(self, bbox=None, types=None):
+        ...
+
+    @abstractmethod
+    def unsubscribe(self, subscription):
+        ...
+
+
+class InProcessBroker(Broker):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._seq = itertools.count(1)
+
+    def publish(self, kind, data):
+        """Fan out an event. Safe to call from any thread."""
+        with self._lock:
+            event = Event(next(self._seq), kind, data)
+            targets = [s for s in self._subscriptions if s.matches(event)]
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # The subscriber's loop is gone; it will be unsubscribed on exit
+                pass
+        return event
+
+    def subscribe(self, bbox=None, types=None):
+        subscription = Subscription(asyncio.get_running_loop(), bbox, types)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+
+broker = InProcessBroker()
+
+
+def set_broker(new_broker):
+    global broker
+    broker = new_broker
+
+
+def job_event(job, **changes):
+    """Delta payload for a job: routing fields plus whatever changed."""
+    return {
+        "id": job.id,
+        "type": job.type,
+        "latitude": job.latitude,
+        "longitude": job.longitude,
+        **changes,
+    }
+
+
+def publish(kind, data):
+    if data is not None:
+        broker.publish(kind, data)
+
+
+async def stream(subscription, request):
+    """Server-Sent Events for ``subscription`` until the client disconnects."""
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            if await request.is_disconnected():
+                break
+            try:
+                event = await subscription.next(HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if subscription.dropped:
+                yield f"event: resync\ndata: {json.dumps({'dropped': subscription.dropped})}\n\n"
+                subscription.dropped = 0
+            yield event.to_sse()
+    finally:
+        broker.unsubscribe(subscription)
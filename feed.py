@@ -0,0 +1,249 @@
+import datetime
+import logging
+import math
+import os
+import threading
+import time
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+from database import SessionLocal
+import geo
+import models
+
+# Ranked job feed for providers (/providers/{provider_id}/feed).
+#
+# Open, unassigned jobs are kept in memory as a column snapshot of NumPy
+# arrays, so a feed request scores every job in a handful of vector
+# operations instead of a query per filter:
+#
+#   distance     exp(-km / DISTANCE_SCALE_KM) from the provider's location
+#   type         1 when the job type is the provider's service type
+#   budget       how far the job's budget_max reaches into the provider's
+#                hourly_rate range: 0 below its min, 1 at or above its max
+#   recency      halves every RECENCY_HALF_LIFE_HOURS
+#   competition  1 / (1 + candidates), favouring jobs few providers applied to
+#
+# and the score is the weighted sum. A component the provider has no data
+# for (no location, no hourly_rate) is left out, which doesn't change the
+# order. Weights come from FEED_WEIGHTS ("distance=3,type=2,...") and can be
+# overridden per request with the same syntax.
+#
+# The snapshot is rebuilt in a background thread, while requests keep being
+# served from the previous one, when a feed request finds that a commit has
+# touched a job or an application since (at most every MIN_REFRESH_SECONDS)
+# or that it is older than SNAPSHOT_TTL, which also covers writes made by
+# other workers. The page itself is re-read from the
+# database, so jobs closed since the snapshot never show up.
+
+DISTANCE_SCALE_KM = float(os.getenv("FEED_DISTANCE_SCALE_KM", "10"))
+RECENCY_HALF_LIFE_HOURS = float(os.getenv("FEED_RECENCY_HALF_LIFE_HOURS", "48"))
+SNAPSHOT_TTL = float(os.getenv("FEED_SNAPSHOT_TTL", "60"))
+MIN_REFRESH_SECONDS = float(os.getenv("FEED_MIN_REFRESH_SECONDS", "1"))
+
+logger = logging.getLogger(__name__)
+
+COMPONENTS = ("distance", "type", "budget", "recency", "competition")
+DEFAULT_WEIGHTS = {"distance": 3.0, "type": 2.0, "budget": 1.0, "recency": 1.0, "competition": 0.5}
+
+
+def parse_weights(spec, base=None):
+    """``"distance=3,type=2"`` -> weights dict, starting from ``base``."""
+    weights = dict(base or DEFAULT_WEIGHTS)
+    if not spec:
+        return weights
+    for part in spec.split(","):
+        name, sep, value = part.partition("=")
+        name = name.strip()
+        if not sep or name not in COMPONENTS:
+            raise ValueError(f"Unknown feed weight '{part.strip()}', expected one of {', '.join(COMPONENTS)}")
+        try:
+            weights[name] = float(value)
+        except ValueError:
+            raise ValueError(f"Feed weight '{name}' must be a number") from None
+        # float() takes "nan" and "inf", which would scramble the whole ranking
+        if not math.isfinite(weights[name]):
+            raise ValueError(f"Feed weight '{name}' must be a finite number")
+    return weights
+
+
+WEIGHTS = parse_weights(os.getenv("FEED_WEIGHTS"))
+
+
+class Snapshot:
+    """Open jobs as parallel arrays, one entry per job."""
+
+    def __init__(self, ids, latitude, longitude, types, budget_max, created, candidates):
+        self.ids = ids  # list of job ids
+        self.index = {job_id: i for i, job_id in enumerate(ids)}
+        self.lat = np.radians(np.asarray(latitude, dtype=np.float64))
+        self.lng = np.radians(np.asarray(longitude, dtype=np.float64))
+        self.type_codes = {}
+        self.types = np.asarray([self.type_codes.setdefault(t, len(self.type_codes)) for t in types], dtype=np.int32)
+        self.budget_max = np.asarray(budget_max, dtype=np.float64)
+        self.created = np.asarray(created, dtype=np.float64)  # epoch seconds
+        self.candidates = np.asarray(candidates, dtype=np.float64)
+        self.built_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, db):
+        counts = select(
+            models.JobCandidate.jobId, func.count().label("n")
+        ).group_by(models.JobCandidate.jobId).subquery()
+        rows = db.execute(select(
+            models.JobRequest.id, models.JobRequest.latitude, models.JobRequest.longitude,
+            models.JobRequest.type, models.JobRequest.budget_max, models.JobRequest.createdAt,
+            func.coalesce(counts.c.n, 0)
+        ).outerjoin(counts, counts.c.jobId == models.JobRequest.id).where(
+            models.JobRequest.request_type == "open",
+            models.JobRequest.status == "pending",
+            models.JobRequest.providerId.is_(None),
+            models.JobRequest.latitude.is_not(None),
+            models.JobRequest.longitude.is_not(None),
+        )).all()
+        epoch = datetime.datetime(1970, 1, 1)
+        return cls(
+            [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows], [r[3] for r in rows],
+            [r[4] if r[4] is not None else np.nan for r in rows],
+            [(r[5] - epoch).total_seconds() if r[5] else 0.0 for r in rows],
+            [r[6] for r in rows],
+        )
+
+    def scores(self, provider, weights, now=None):
+        """Weighted score of every job for ``provider`` (a User)."""
+        total = np.zeros(len(self.ids))
+        if not len(self.ids):
+            return total
+
+        if weights["distance"] and provider.latitude is not None and provider.longitude is not None:
+            # Haversine against every job at once, same formula as geo.haversine_km
+            lat, lng = np.radians(provider.latitude), np.radians(provider.longitude)
+            a = np.sin((self.lat - lat) / 2) ** 2 + np.cos(lat) * np.cos(self.lat) * np.sin((self.lng - lng) / 2) ** 2
+            km = 2 * geo.EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+            total += weights["distance"] * np.exp(-km / DISTANCE_SCALE_KM)
+
+        code = self.type_codes.get(provider.type)
+        if weights["type"] and code is not None:
+            total += weights["type"] * (self.types == code)
+
+        rate = provider.hourly_rate or {}
+        low, high = rate.get("min"), rate.get("max")
+        if weights["budget"] and low is not None:
+            span = max((high if high is not None else low) - low, 1.0)
+            fit = np.clip((self.budget_max - low) / span, 0.0, 1.0)
+            total += weights["budget"] * np.nan_to_num(fit)
+
+        if weights["recency"]:
+            now = time.time() if now is None else now
+            age_hours = np.maximum(now - self.created, 0.0) / 3600
+            total += weights["recency"] * np.exp2(-age_hours / RECENCY_HALF_LIFE_HOURS)
+
+        if weights["competition"]:
+            total += weights["competition"] / (1.0 + self.candidates)
+        return total
+
+    def top(self, scores, limit, offset=0, exclude=()):
+        """[(job_id, score)] of the best jobs, skipping the ids in ``exclude``."""
+        skip = [self.index[job_id] for job_id in exclude if job_id in self.index]
+        if skip:
+            scores = scores.copy()
+            scores[skip] = -np.inf
+        wanted = min(offset + limit, len(scores) - len(skip))
+        if wanted <= offset:
+            return []
+        # Partial selection first; only the requested prefix gets fully sorted
+        best = np.argpartition(-scores, wanted - 1)[:wanted] if wanted < len(scores) else np.arange(len(scores))
+        best = best[np.lexsort((best, -scores[best]))][offset:wanted]
+        return [(self.ids[i], float(scores[i])) for i in best]
+
+
+_snapshot = None
+_stale = False
+_lock = threading.Lock()
+
+
+def snapshot(db):
+    """The current snapshot, refreshing it in the background when stale or expired.
+
+    Only the very first call (nothing to serve yet) loads it inline.
+    """
+    global _snapshot
+    current = _snapshot
+    if current is None:
+        with _lock:
+            if _snapshot is None:
+                _snapshot = Snapshot.load(db)
+            return _snapshot
+    age = time.monotonic() - current.built_at
+    if age >= SNAPSHOT_TTL or (_stale and age >= MIN_REFRESH_SECONDS):
+        _refresh_in_background()
+    return current
+
+
+def _refresh_in_background():
+    if not _lock.acquire(blocking=False):
+        return  # already refreshing
+
+    def run():
+        global _snapshot, _stale
+        try:
+            # Cleared first, so a commit landing during the load triggers another one
+            _stale = False
+            db = SessionLocal()
+            try:
+                _snapshot = Snapshot.load(db)
+            finally:
+                db.close()
+        except Exception:
+            _stale = True
+            logger.exception("Refreshing the feed snapshot failed")
+        finally:
+            _lock.release()
+
+    threading.Thread(target=run, name="feed-snapshot", daemon=True).start()
+
+
+def invalidate():
+    global _stale
+    _stale = True
+
+
+def provider_feed(db, provider, weights, limit, offset=0):
+    """[(job_id, score)] for ``provider``, leaving out jobs it applied to."""
+    applied = db.execute(
+        select(models.JobCandidate.jobId).where(models.JobCandidate.providerId == provider.id)
+    ).scalars().all()
+    current = snapshot(db)
+    return current.top(current.scores(provider, weights), limit, offset, exclude=applied)
+
+
+def parse_request_weights(spec):
+    try:
+        return parse_weights(spec, WEIGHTS)
+    except ValueError as e:
+        # Same status FastAPI gives other malformed query parameters
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@event.listens_for(Session, "after_flush")
+def _note_job_changes(session, flush_context):
+    for objects in (session.new, session.dirty, session.deleted):
+        if any(isinstance(obj, (models.JobRequest, models.JobCandidate)) for obj in objects):
+            session.info["feed_changed"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    # After commit, not flush, so a rebuild can't run before the change is visible
+    if session.info.pop("feed_changed", False):
+        invalidate()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_on_rollback(session, previous_transaction):
+    session.info.pop("feed_changed", None)
@@ -0,0 +1,175 @@
+import math
+from sqlalchemy import and_, or_, true
+
+# Geohash helpers used to index coordinates. Each row stores a fixed-precision
+# geohash string; an area query is turned into a handful of prefix ranges over
+# that indexed column, so it only touches rows near the requested area.
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 9  # ~5m cells, stored on every row
+MAX_QUERY_CELLS = 16  # upper bound of prefix ranges per area query
+EARTH_RADIUS_KM = 6371.0088
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    if latitude is None or longitude is None:
+        return None
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits = bits << 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def cell_size(precision):
+    """Return (lat_height, lng_width) in degrees of a geohash cell."""
+    total_bits = precision * 5
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def _cell_span(min_lat, min_lng, max_lat, max_lng, precision):
+    height, width = cell_size(precision)
+    i0 = int(math.floor((min_lat + 90.0) / height))
+    i1 = int(math.floor((min(max_lat, 89.999999) + 90.0) / height))
+    j0 = int(math.floor((min_lng + 180.0) / width))
+    j1 = int(math.floor((min(max_lng, 179.999999) + 180.0) / width))
+    return height, width, i0, i1, j0, j1
+
+
+def lng_segments(min_lng, max_lng):
+    """Longitude ranges within ±180 that cover ``min_lng``..``max_lng``.
+
+    Ranges running past ±180 (from ``bbox_for_radius``) or with
+    ``min_lng > max_lng`` (a viewport across the antimeridian) wrap around
+    and come back as two segments.
+    """
+    if max_lng < min_lng:
+        max_lng += 360.0
+    if max_lng - min_lng >= 360.0:
+        return [(-180.0, 180.0)]
+    shift = math.floor((min_lng + 180.0) / 360.0) * 360.0
+    min_lng, max_lng = min_lng - shift, max_lng - shift
+    if max_lng <= 180.0:
+        return [(min_lng, max_lng)]
+    return [(min_lng, 180.0), (-180.0, max_lng - 360.0)]
+
+
+def covering_cells(min_lat, min_lng, max_lat, max_lng, max_cells=MAX_QUERY_CELLS):
+    """Geohash prefixes whose union covers the bounding box.
+
+    Picks the finest precision that needs at most ``max_cells`` prefixes, so
+    small map viewports resolve to tight ranges and large ones stay bounded.
+    Boxes crossing the antimeridian are covered on both sides.
+    """
+    min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0)
+    if min_lat > max_lat:
+        return []
+    segments = lng_segments(min_lng, max_lng)
+
+    chosen = None
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        spans = [_cell_span(min_lat, lo, max_lat, hi, precision) for lo, hi in segments]
+        if sum((i1 - i0 + 1) * (j1 - j0 + 1) for _, _, i0, i1, j0, j1 in spans) > max_cells:
+            break
+        chosen = (precision, spans)
+    if chosen is None:
+        # Even single-character cells are too many; the whole world it is.
+        return [""]
+
+    precision, spans = chosen
+    cells = set()
+    for height, width, i0, i1, j0, j1 in spans:
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                lat = -90.0 + (i + 0.5) * height
+                lng = -180.0 + (j + 0.5) * width
+                cells.add(encode(lat, lng, precision))
+    return sorted(cells)
+
+
+def prefix_filter(column, cells, *conditions):
+    """SQL condition matching rows whose geohash starts with any of ``cells``.
+
+    Expressed as ``column >= prefix AND column < prefix + '{'`` ranges ('{'
+    sorts right after 'z') so the database can use the column's index.
+    ``conditions`` are repeated inside every range: pass the equality filters
+    that lead a composite index on the column, so each range can seek it.
+    """
+    if "" in cells:
+        return and_(column.isnot(None), *conditions)
+    if not cells:
+        return ~true()
+    return or_(*[and_(*conditions, column >= cell, column < cell + "{") for cell in cells])
+
+
+def bbox_filter(lat_column, lng_column, bbox):
+    """SQL condition for points inside ``bbox``, wrapping at the antimeridian."""
+    min_lat, min_lng, max_lat, max_lng = bbox
+    return and_(
+        lat_column.between(min_lat, max_lat),
+        or_(*[lng_column.between(lo, hi) for lo, hi in lng_segments(min_lng, max_lng)]),
+    )
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bbox_for_radius(latitude, longitude, radius_km):
+    """Bounding box (min_lat, min_lng, max_lat, max_lng) enclosing a circle.
+
+    Near the antimeridian the longitudes run past ±180; ``covering_cells``
+    and ``bbox_filter`` wrap them.
+    """
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(latitude))
+    if cos_lat < 1e-6:
+        dlng = 180.0
+    else:
+        dlng = min(180.0, math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat)))
+    return latitude - dlat, longitude - dlng, latitude + dlat, longitude + dlng
+
+
+def nearest(find_in_bbox, latitude, longitude, radius_km, limit, initial_km=0.5):
+    """k-nearest search within ``radius_km`` using an expanding search ring.
+
+    ``find_in_bbox(bbox)`` returns ``(id, lat, lng)`` rows inside a bounding
+    box. The ring starts small and doubles until it holds ``limit`` hits or
+    reaches ``radius_km``; every point within the ring has been seen, so the
+    closest ``limit`` of them are the true nearest neighbours.
+    Returns ``[(distance_km, id), ...]`` sorted by distance.
+    """
+    ring = min(initial_km, radius_km)
+    while True:
+        hits = []
+        for row_id, row_lat, row_lng in find_in_bbox(bbox_for_radius(latitude, longitude, ring)):
+            distance = haversine_km(latitude, longitude, row_lat, row_lng)
+            if distance <= ring:
+                hits.append((distance, row_id))
+        if len(hits) >= limit or ring >= radius_km:
+            hits.sort()
+            return hits[:limit]
+        ring = min(ring * 2, radius_km)
@@ -0,0 +1,79 @@
+from fastapi import HTTPException
+from sqlalchemy.orm.exc import StaleDataError
+
+# Allowed transitions for JobRequest.status and JobRequest.proposal_status.
+#
+# Writes are race-free through the optimistic version column on JobRequest
+# (see models.JobRequest.version): every UPDATE the ORM emits carries
+# "WHERE id = :id AND version = :read_version", so when two requests act on
+# the same job at once only the first commit lands and the other gets a 409
+# instead of silently overwriting it. The checks below therefore always run
+# against the state the winning write was based on.
+
+STATUSES = {"pending", "accepted", "rejected", "in_process", "completed", "cancelled"}
+
+STATUS_TRANSITIONS = {
+    "pending": {"accepted", "rejected", "in_process", "cancelled"},
+    "accepted": {"in_process", "cancelled"},
+    "in_process": {"completed", "cancelled"},
+    "rejected": set(),
+    "completed": set(),
+    "cancelled": set(),
+}
+
+PROPOSAL_STATUSES = {"none", "sent", "rejected", "accepted"}
+
+PROPOSAL_TRANSITIONS = {
+    "none": {"sent"},
+    "sent": {"sent", "accepted", "rejected"},
+    "rejected": {"sent"},
+    "accepted": set(),
+}
+
+
+def conflict(detail):
+    return HTTPException(status_code=409, detail=detail)
+
+
+def check_status(job, target):
+    if target not in STATUSES:
+        raise HTTPException(status_code=400, detail=f"Unknown status '{target}'")
+    current = job.status or "pending"
+    if target != current and target not in STATUS_TRANSITIONS.get(current, set()):
+        raise conflict(f"Cannot move job from '{current}' to '{target}'")
+
+
+def check_proposal(job, target):
+    if target not in PROPOSAL_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Unknown proposal status '{target}'")
+    current = job.proposal_status or "none"
+    if target not in PROPOSAL_TRANSITIONS.get(current, set()):
+        raise conflict(f"Cannot move proposal from '{current}' to '{target}'")
+    if job.status not in ("pending", "accepted"):
+        raise conflict(f"Proposals can't change once the job is '{job.status}'")
+
+
+def check_open_for_candidates(job):
+    if job.status != "pending" or job.request_type != "open":
+        raise conflict("Job is no longer taking applications")
+
+
+def check_assignable(job):
+    if job.status != "pending":
+        raise conflict(f"Can't assign a provider to a '{job.status}' job")
+
+
+def check_acceptable(job, provider_id):
+    if job.providerId and job.providerId != provider_id:
+        raise conflict("Job already taken by another provider")
+    if job.status != "pending":
+        raise conflict(f"Can't accept a '{job.status}' job")
+
+
+def commit(db):
+    """Commit, turning a lost optimistic-lock race into a 409."""
+    try:
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise conflict("Job was modified by another request, reload and retry")
@@ -0,0 +1,61 @@
+from sqlalchemy.orm import joinedload, selectinload
+import models
+import projection
+
+# Shared eager-loading strategy for every endpoint that returns ORM rows.
+# Many-to-one relations (a job's client/provider) are joined into the main
+# query; one-to-many and many-to-many collections (portfolio, badges, reviews,
+# candidates) use selectinload, i.e. one extra "WHERE id IN (...)" query per
+# collection instead of one query per row or a cartesian join of collections.
+
+PROFILE_COLLECTIONS = ("portfolio", "badges", "reviews")
+
+# Most ids one batch request may ask for; bounds the IN list and the response
+MAX_BATCH = 100
+
+
+def profile_options(fields=None):
+    """Loader options for schemas.UserProfile, limited to requested ``fields``."""
+    return [
+        selectinload(getattr(models.User, rel))
+        for rel in PROFILE_COLLECTIONS
+        if projection.wants(fields, rel)
+    ]
+
+
+def job_options(fields=None):
+    """Loader options for schemas.JobRequestResponse, limited to requested ``fields``."""
+    options = [
+        joinedload(getattr(models.JobRequest, rel))
+        for rel in ("client", "provider")
+        if projection.wants(fields, rel)
+    ]
+    if projection.wants(fields, "candidates"):
+        options.append(selectinload(models.JobRequest.candidate_links))
+    return options
+
+
+def load_profile(db, user_id):
+    return db.query(models.User).options(*profile_options()).filter(models.User.id == user_id).first()
+
+
+def load_job(db, job_id):
+    return db.query(models.JobRequest).options(*job_options()).filter(models.JobRequest.id == job_id).first()
+
+
+def _in_order(rows, ids):
+    # Requested order, dropping ids that don't exist
+    by_id = {row.id: row for row in rows}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def load_profiles(db, user_ids, fields=None):
+    """Users for ``user_ids`` in that order, in one ``IN`` query plus one per collection."""
+    rows = db.query(models.User).options(*profile_options(fields)).filter(models.User.id.in_(user_ids)).all()
+    return _in_order(rows, user_ids)
+
+
+def load_jobs(db, job_ids, fields=None):
+    """Jobs for ``job_ids`` in that order, in one ``IN`` query plus the candidates one."""
+    rows = db.query(models.JobRequest).options(*job_options(fields)).filter(models.JobRequest.id.in_(job_ids)).all()
+    return _in_order(rows, job_ids)
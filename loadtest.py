@@ -0,0 +1,283 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+# End-to-end load test. Boots the app in-process (httpx ASGI transport, no
+# network) against a synthetic dataset, drives a weighted mix of what the
+# mobile app does at a fixed concurrency and reports, per scenario, latency
+# percentiles and the SQL statements each request issued.
+#
+#   python loadtest.py                                   # default dataset and mix
+#   python loadtest.py --jobs 200000 --concurrency 128 --requests 20000
+#   python loadtest.py --save default                    # write loadtest_baselines/default.json
+#   python loadtest.py --compare default                 # diff against it, exit 1 on regressions
+#
+# The dataset and the request sequence are seeded, so statement counts are
+# reproducible and any change to them is a real change in main.py. Latency
+# is compared against the baseline with a tolerance since it depends on the
+# machine. 409s from applies/accepts that lost a race are expected and counted
+# as conflicts, not errors.
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadtest_baselines")
+
+# scenario -> weight in the mix
+MIX = {
+    "map": 40,
+    "map_area": 15,
+    "profile": 20,
+    "inbox": 15,
+    "apply": 7,
+    "accept": 3,
+}
+
+PERCENTILES = (50, 95, 99)
+
+_statements = contextvars.ContextVar("loadtest_statements", default=None)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    counter = _statements.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def prepare(args):
+    import synthetic
+
+    synthetic.load(
+        clients=args.clients, providers=args.providers, jobs=args.jobs,
+        candidates=args.candidates, reviews=args.reviews, run="lt", seed_value=args.seed,
+    )
+
+
+class Workload:
+    """Picks the next request of the mix from pools sampled out of the dataset."""
+
+    def __init__(self, seed_value, sample=5000):
+        from sqlalchemy import select
+        from database import SessionLocal
+        import models
+        import synthetic
+
+        self.rng = random.Random(seed_value)
+        self.cities = synthetic.load_cities()
+        self.types = synthetic.TYPES
+        db = SessionLocal()
+        try:
+            def ids(query):
+                # Sampled with the seeded rng (not ORDER BY random()) so runs repeat
+                found = sorted(db.execute(query).scalars())
+                return self.rng.sample(found, min(sample, len(found)))
+
+            self.providers = ids(select(models.User.id).where(models.User.role == "provider"))
+            self.clients = ids(select(models.User.id).where(models.User.role == "client"))
+            open_jobs = ids(select(models.JobRequest.id).where(
+                models.JobRequest.request_type == "open", models.JobRequest.status == "pending",
+                models.JobRequest.providerId.is_(None)
+            ))
+        finally:
+            db.close()
+        # Accepts consume their jobs so most of them land; applies share the rest
+        split = max(1, len(open_jobs) // 3)
+        self.accept_jobs = open_jobs[:split]
+        self.apply_jobs = open_jobs[split:] or open_jobs
+        self.scenarios = list(MIX)
+        self.weights = [MIX[s] for s in self.scenarios]
+
+    def next(self):
+        """(scenario, method, url, params)"""
+        scenario = self.rng.choices(self.scenarios, weights=self.weights)[0]
+        rng = self.rng
+        if scenario == "map":
+            params = {"limit": 50}
+            if rng.random() < 0.5:
+                params["type"] = rng.choice(self.types)
+            return scenario, "GET", "/job-requests", params
+        if scenario == "map_area":
+            lat, lng, spread, _ = rng.choice(self.cities)
+            return scenario, "GET", "/job-requests", {
+                "lat": round(rng.gauss(lat, spread), 5), "lng": round(rng.gauss(lng, spread), 5),
+                "radius_km": rng.choice([1, 2, 5]), "limit": 50,
+            }
+        if scenario == "profile":
+            return scenario, "GET", f"/providers/{rng.choice(self.providers)}", {}
+        if scenario == "inbox":
+            user_id = rng.choice(self.clients) if rng.random() < 0.7 else rng.choice(self.providers)
+            return scenario, "GET", f"/users/{user_id}/requests", {"limit": 20}
+        if scenario == "apply":
+            job_id = rng.choice(self.apply_jobs)
+            return scenario, "PUT", f"/job-requests/{job_id}/apply", {"provider_id": rng.choice(self.providers)}
+        job_id = self.accept_jobs.pop() if len(self.accept_jobs) > 1 else self.accept_jobs[0]
+        return scenario, "PUT", f"/job-requests/{job_id}/accept", {"provider_id": rng.choice(self.providers)}
+
+
+async def drive(workload, concurrency, total, warmup):
+    import httpx
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    samples = defaultdict(list)  # scenario -> [(seconds, statements, status)]
+    plan = [workload.next() for _ in range(warmup + total)]
+    warm, timed = plan[:warmup], iter(plan[warmup:])
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+        async def call(method, url, params):
+            counter = [0]
+            token = _statements.set(counter)
+            try:
+                started = time.perf_counter()
+                r = await client.request(method, url, params=params)
+                return time.perf_counter() - started, counter[0], r.status_code
+            finally:
+                _statements.reset(token)
+
+        async def worker():
+            for scenario, method, url, params in timed:
+                samples[scenario].append(await call(method, url, params))
+
+        for _, method, url, params in warm:
+            await call(method, url, params)
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    return samples, elapsed
+
+
+def summarize(samples, elapsed):
+    scenarios = {}
+    total = 0
+    for scenario in MIX:
+        rows = samples.get(scenario, [])
+        if not rows:
+            continue
+        total += len(rows)
+        latencies = sorted(r[0] * 1000 for r in rows)
+        result = {
+            "requests": len(rows),
+            "errors": sum(1 for r in rows if r[2] >= 400 and r[2] != 409),
+            "conflicts": sum(1 for r in rows if r[2] == 409),
+            "statements": round(sum(r[1] for r in rows) / len(rows), 2),
+        }
+        for p in PERCENTILES:
+            result[f"p{p}_ms"] = round(percentile(latencies, p), 2)
+        scenarios[scenario] = result
+    return {"requests": total, "seconds": round(elapsed, 3), "rps": round(total / elapsed, 1), "scenarios": scenarios}
+
+
+def print_report(report):
+    print(f"{'scenario':10} {'reqs':>6} {'err':>5} {'409':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'stmts':>6}")
+    for name, s in report["scenarios"].items():
+        print(f"{name:10} {s['requests']:6} {s['errors']:5} {s['conflicts']:5} "
+              f"{s['p50_ms']:8.2f} {s['p95_ms']:8.2f} {s['p99_ms']:8.2f} {s['statements']:6.2f}")
+    print(f"total      {report['requests']:6} requests in {report['seconds']:.2f}s, {report['rps']:.1f} req/s")
+
+
+def compare(report, baseline, tolerance):
+    """Print the differences against ``baseline``; returns the regressions."""
+    regressions = []
+    print(f"\nvs baseline ({baseline['config']})")
+    for name, s in report["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            print(f"{name:10} (not in baseline)")
+            continue
+        parts = []
+        if s["statements"] != base["statements"]:
+            parts.append(f"stmts {base['statements']} -> {s['statements']}")
+            if s["statements"] > base["statements"]:
+                regressions.append(f"{name}: statements {base['statements']} -> {s['statements']}")
+        for p in PERCENTILES:
+            key = f"p{p}_ms"
+            if base[key]:
+                change = s[key] / base[key] - 1
+                parts.append(f"{key} {change:+.0%}")
+                if p == 95 and change > tolerance:
+                    regressions.append(f"{name}: p95 {base[key]}ms -> {s[key]}ms")
+        if s["errors"] > base["errors"]:
+            regressions.append(f"{name}: errors {base['errors']} -> {s['errors']}")
+        print(f"{name:10} " + ", ".join(parts))
+    change = report["rps"] / baseline["rps"] - 1 if baseline["rps"] else 0.0
+    print(f"{'throughput':10} {baseline['rps']} -> {report['rps']} req/s ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process load test of the Truber API")
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--providers", type=int, default=500)
+    parser.add_argument("--jobs", type=int, default=20000)
+    parser.add_argument("--candidates", type=int, default=2)
+    parser.add_argument("--reviews", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=15)
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--db", help="reuse this SQLite file instead of generating a new dataset")
+    parser.add_argument("--save", metavar="NAME", help="save the result as a baseline")
+    parser.add_argument("--compare", metavar="NAME", help="compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed p95 slowdown vs the baseline")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), "loadtest.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ["DB_MODE"] = args.mode
+    os.environ.setdefault("BLOB_DIR", os.path.join(os.path.dirname(db_path), "blobs"))
+
+    from sqlalchemy import event
+    from database import engine
+    import main  # configures logging
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # one INFO line per request otherwise
+
+    if not args.db:
+        prepare(args)
+    workload = Workload(args.seed)
+    event.listen(engine, "before_cursor_execute", count_statement)
+    samples, elapsed = asyncio.run(drive(workload, args.concurrency, args.requests, args.warmup))
+    event.remove(engine, "before_cursor_execute", count_statement)
+
+    report = summarize(samples, elapsed)
+    report["config"] = {
+        "clients": args.clients, "providers": args.providers, "jobs": args.jobs, "reviews": args.reviews,
+        "concurrency": args.concurrency, "requests": args.requests, "seed": args.seed, "mode": args.mode,
+    }
+    print_report(report)
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save}.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Saved baseline {path}")
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,26 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, File, HTTPException, Query, Request, Response, UploadFile, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import flag_modified
 from typing import List, Optional
-import models, schemas, database, uuid
-from database import engine, get_db
+import logging
+import models, schemas, database, uuid, datetime, os, archive, auth, blobs, cache, events, feed, geo, job_states, loaders, metrics, migrations, pagination, projection, replicas, search, serialization, stats, sync
+from database import engine, get_db, db_handler, run_db
 
-# Create tables
-models.Base.metadata.create_all(bind=engine)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("truber")
 
-app = FastAPI(title="Truber API")
+# Schema changes are applied by `python migrations.py`, never at startup
+_pending = migrations.pending(engine)
+if _pending:
+    logger.warning("Database is %d migration(s) behind; run `python migrations.py`", len(_pending))
+
+# Verifies the bearer token wherever one is sent (see auth.AUTH_REQUIRED),
+# then names the client for read-your-writes (see replicas.py)
+app = FastAPI(title="Truber API", dependencies=[Depends(auth.authenticate), Depends(replicas.track_client)])
 
 # Enable CORS for the mobile app
 app.add_middleware(
@@ -19,221 +31,841 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+# Off unless ARCHIVE_INTERVAL_SECONDS is set; `python archive.py` from cron works too.
+# Runs share a lease, so only one process archives at a time
+archive.start_background(engine)
+
+def _externalize(value):
+    # Inline base64 images go to the blob store; rows keep the reference only.
+    # Decoding and thumbnailing is slow, so callers use db_handler(blocking=True)
+    try:
+        if isinstance(value, list):
+            return blobs.externalize_list(value)
+        return blobs.externalize(value)
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+def _job_delta(job, **changes):
+    # Only open requests are broadcast; direct requests stay private
+    if job.request_type != "open":
+        return None
+    return events.job_event(job, **changes)
+
+def _batch_ids(ids):
+    # Comma separated, duplicates dropped, order kept
+    wanted = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+    if not wanted:
+        raise HTTPException(status_code=400, detail="No ids given")
+    if len(wanted) > loaders.MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {loaders.MAX_BATCH} ids per request")
+    return wanted
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to Truber API"}
 
-@app.post("/auth/login", response_model=schemas.UserProfile)
-def login(user_auth: schemas.UserAuth, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == user_auth.email).first()
-    if not user or user.password != user_auth.password: # Plain text for demo, use hashing in prod
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+@app.get("/health")
+def health():
+    return {"status": "ok", "db_mode": database.DB_MODE, "pool": database.pool_status(), "replicas": replicas.status()}
+
+if metrics.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def get_metrics():
+        pool = metrics.gauges("db_pool", "Connection pool state, see database.pool_status().", database.pool_status())
+        return PlainTextResponse(metrics.render(pool), media_type="text/plain; version=0.0.4")
+
+def _load_login_user(email, db):
+    user = db.query(models.User).options(
+        *loaders.profile_options()
+    ).filter(models.User.email == email).first()
+    # Detached, so committing a rehash can't expire what gets serialized
+    db.expunge_all()
     return user
 
-from sqlalchemy.orm import joinedload
+def _store_rehash(user_id, old_hash, new_hash, db):
+    # Only if unchanged since it was read, so a concurrent password change wins
+    db.execute(update(models.User).where(
+        models.User.id == user_id, models.User.password == old_hash
+    ).values(password=new_hash))
+    db.commit()
+
+@app.post("/auth/login", response_model=schemas.LoginResponse)
+async def login(user_auth: schemas.UserAuth, db: Session = Depends(get_db)):
+    user = await run_db(db, _load_login_user, user_auth.email)
+    # bcrypt runs on auth's own pool; no database connection work waits on it
+    ok, new_hash = await auth.verify_password(user_auth.password, user.password if user else None)
+    if not ok:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Plaintext rows from before hashing, or hashes with fewer rounds
+        await run_db(db, _store_rehash, user.id, user.password, new_hash)
+    user.access_token, user.expires_in = auth.create_access_token(user)
+    user.token_type = "bearer"
+    return user
 
 @app.get("/providers", response_model=List[schemas.UserProfile])
-def get_providers(db: Session = Depends(get_db)):
-    return db.query(models.User).options(
-        joinedload(models.User.portfolio),
-        joinedload(models.User.badges)
-    ).filter(models.User.role == "provider").all()
+@replicas.read_handler
+def get_providers(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    sort: str = Query("newest", pattern="^(newest|rating|jobs)$"),
+    min_rating: Optional[float] = Query(None, ge=0, le=5),
+    min_jobs: Optional[int] = Query(None, ge=0),
+    db: Session = Depends(replicas.get_read_db)
+):
+    selected = projection.parse_fields(fields, schemas.UserProfile)
+    query = db.query(models.User).options(
+        *loaders.profile_options(selected)
+    ).filter(models.User.role == "provider")
+    if min_rating is not None:
+        query = query.filter(models.User.rating >= min_rating)
+    if min_jobs is not None:
+        query = query.filter(models.User.jobs >= min_jobs)
+
+    if sort == "rating":
+        providers = pagination.paginate(
+            query, [models.User.rating, models.User.id], cursor, limit, response, descending=True
+        )
+    elif sort == "jobs":
+        providers = pagination.paginate(
+            query, [models.User.jobs, models.User.id], cursor, limit, response, descending=True
+        )
+    else:
+        providers = pagination.paginate(query, [models.User.createdAt, models.User.id], cursor, limit, response)
+    if selected:
+        return projection.project(providers, schemas.UserProfile, selected, response)
+    return providers
+
+@app.get("/providers/nearby", response_model=List[schemas.NearbyProvider])
+@db_handler
+def get_nearby_providers(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(10, gt=0, le=100),
+    type: Optional[str] = None,
+    rating: Optional[float] = Query(None, ge=0, le=5),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    filters = [models.User.role == "provider"]
+    if type and type != 'all':
+        filters.append(models.User.type == type)
+    if rating is not None:
+        filters.append(models.User.rating >= rating)
+
+    def find_in_bbox(bbox):
+        return db.query(
+            models.User.id, models.User.latitude, models.User.longitude
+        ).filter(
+            geo.prefix_filter(models.User.geohash, geo.covering_cells(*bbox), *filters),
+            geo.bbox_filter(models.User.latitude, models.User.longitude, bbox),
+        ).all()
+
+    hits = geo.nearest(find_in_bbox, lat, lng, radius_km, limit)
+    if not hits:
+        return []
+
+    distances = {user_id: distance for distance, user_id in hits}
+    providers = db.query(models.User).options(
+        *loaders.profile_options()
+    ).filter(models.User.id.in_(distances)).all()
+    for provider in providers:
+        provider.distance_km = distances[provider.id]
+    providers.sort(key=lambda p: (p.distance_km, p.id))
+    return providers
+
+@app.get("/search/providers", response_model=List[schemas.UserProfile])
+@db_handler
+def search_providers(
+    q: str = Query(..., min_length=1, max_length=200),
+    type: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=pagination.MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db)
+):
+    hits = search.search(db, "providers", q, type if type != "all" else None, limit, offset)
+    if not hits:
+        return []
+    order = {user_id: i for i, (user_id, _) in enumerate(hits)}
+    providers = db.query(models.User).options(
+        *loaders.profile_options()
+    ).filter(models.User.id.in_(order)).all()
+    providers.sort(key=lambda p: order[p.id])
+    return providers
+
+@app.get("/providers/batch", response_model=List[schemas.UserProfile])
+@replicas.read_handler
+def get_providers_batch(ids: str, fields: Optional[str] = None, db: Session = Depends(replicas.get_read_db)):
+    """Several profiles by id in one round trip; unknown ids are left out."""
+    selected = projection.parse_fields(fields, schemas.UserProfile)
+    users = loaders.load_profiles(db, _batch_ids(ids), selected)
+    if selected:
+        return projection.project(users, schemas.UserProfile, selected)
+    return users
 
 @app.get("/providers/{provider_id}", response_model=schemas.UserProfile)
-def get_provider(provider_id: str, db: Session = Depends(get_db)):
-    user = db.query(models.User).options(
-        joinedload(models.User.portfolio),
-        joinedload(models.User.badges)
-    ).filter(models.User.id == provider_id).first()
-    if not user:
+@db_handler(blocking=cache.BLOCKING)
+def get_provider(provider_id: str, request: Request, db: Session = Depends(get_db)):
+    def build():
+        user = loaders.load_profile(db, provider_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="Provider not found")
+        return schemas.UserProfile.model_validate(user).model_dump_json().encode(), {}
+
+    return cache.cached_response(request, cache.provider_key(provider_id), build, cache.PROFILE_TTL)
+
+@app.get("/providers/{provider_id}/feed", response_model=List[schemas.JobRequestResponse])
+@db_handler
+def get_provider_feed(
+    provider_id: str,
+    limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    weights: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    # Scored in memory (see feed.py), so like the geo mode the feed pages by offset
+    provider = db.query(models.User).filter(
+        models.User.id == provider_id, models.User.role == "provider"
+    ).first()
+    if not provider:
         raise HTTPException(status_code=404, detail="Provider not found")
-    return user
 
-@app.put("/users/{user_id}/profile", response_model=schemas.UserProfile)
+    ranked = feed.provider_feed(db, provider, feed.parse_request_weights(weights), limit, offset)
+    order = {job_id: i for i, (job_id, _) in enumerate(ranked)}
+    jobs = []
+    if order:
+        # Re-check the rows (in Python, so the lookup stays on the primary key):
+        # the snapshot may predate an accept or a cancel
+        jobs = [
+            j for j in serialization.job_rows(db).filter(models.JobRequest.id.in_(order))
+            if j.status == "pending" and j.providerId is None
+        ]
+    jobs.sort(key=lambda j: order[j.id])
+    distances = None
+    if provider.latitude is not None and provider.longitude is not None:
+        distances = {
+            j.id: geo.haversine_km(provider.latitude, provider.longitude, j.latitude, j.longitude) for j in jobs
+        }
+    return serialization.jobs_response(db, jobs, distances=distances)
+
+@app.post("/providers/{provider_id}/reviews", response_model=schemas.ReviewBase)
+@db_handler(blocking=cache.BLOCKING)
+def create_review(provider_id: str, review: schemas.ReviewCreate, claims: Optional[dict] = Depends(auth.authenticate), db: Session = Depends(get_db)):
+    auth.check_owner(claims, review.userId)
+    provider = db.query(models.User.id).filter(
+        models.User.id == provider_id, models.User.role == "provider"
+    ).first()
+    if not provider:
+        raise HTTPException(status_code=404, detail="Provider not found")
+
+    # provider_stats and users.rating are updated in the same transaction (see stats.py)
+    new_review = models.Review(
+        id=str(uuid.uuid4()),
+        providerId=provider_id,
+        date=datetime.date.today().isoformat(),
+        **review.dict()
+    )
+    db.add(new_review)
+    db.commit()
+    cache.invalidate(cache.provider_key(provider_id))
+    db.refresh(new_review)
+    return new_review
+
+@app.put("/users/{user_id}/profile", response_model=schemas.UserProfile, dependencies=[Depends(auth.owner("user_id"))])
+@db_handler(blocking=True)
 def update_profile(user_id: str, updates: schemas.ProviderUpdate, db: Session = Depends(get_db)):
-    print(f"Updating profile for user: {user_id}")
+    logger.info("Updating profile for user %s", user_id)
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     update_data = updates.dict(exclude_unset=True)
+    if update_data.get("image"):
+        update_data["image"] = _externalize(update_data["image"])
     for key, value in update_data.items():
         setattr(user, key, value)
     
     db.commit()
-    db.refresh(user)
-    return user
+    cache.invalidate(cache.provider_key(user_id))
+    return loaders.load_profile(db, user_id)
 
-@app.put("/users/{user_id}/portfolio")
+@app.put("/users/{user_id}/portfolio", dependencies=[Depends(auth.owner("user_id"))])
+@db_handler(blocking=True)
 def update_portfolio(user_id: str, portfolio: List[schemas.PortfolioBase], db: Session = Depends(get_db)):
-    print(f"Updating portfolio for user: {user_id}")
-    print(f"Items received: {len(portfolio)}")
-    # Delete existing portfolio items
-    db.query(models.PortfolioItem).filter(models.PortfolioItem.providerId == user_id).delete()
-    
-    # Add new ones
-    for item in portfolio:
-        item_id = item.id if item.id else str(uuid.uuid4())
-        new_item = models.PortfolioItem(
-            id=item_id,
-            providerId=user_id,
-            imageUrl=item.imageUrl,
-            title=item.title,
-            description=item.description
+    logger.info("Updating portfolio for user %s (%d items)", user_id, len(portfolio))
+    ids = [item.id for item in portfolio if item.id]
+    if len(ids) != len(set(ids)):
+        raise HTTPException(status_code=400, detail="Duplicate portfolio item id")
+
+    # Diff against what is stored so only changed rows are written
+    item_table = models.PortfolioItem.__table__
+    existing = {
+        row.id: row for row in db.execute(
+            select(item_table.c.id, item_table.c.imageUrl, item_table.c.title, item_table.c.description)
+            .where(item_table.c.providerId == user_id)
         )
-        db.add(new_item)
-    
+    }
+    inserts, updates = [], []
+    for item in portfolio:
+        current = existing.get(item.id)
+        if current is None:
+            inserts.append({
+                "id": item.id or str(uuid.uuid4()),
+                "providerId": user_id,
+                "imageUrl": _externalize(item.imageUrl),
+                "title": item.title,
+                "description": item.description
+            })
+            continue
+        values = {"title": item.title, "description": item.description}
+        if item.imageUrl != current.imageUrl:
+            values["imageUrl"] = _externalize(item.imageUrl)
+        if any(getattr(current, key) != value for key, value in values.items()):
+            updates.append({"id": item.id, **values})
+    kept = set(ids)
+    deleted = [item_id for item_id in existing if item_id not in kept]
+
+    try:
+        if deleted:
+            db.query(models.PortfolioItem).filter(
+                models.PortfolioItem.id.in_(deleted)
+            ).delete(synchronize_session=False)
+            sync.record_deletes(db, "portfolio", deleted)
+        if inserts or updates:
+            # Core statements skip the flush hooks that stamp rows for /sync
+            stamp = sync.stamp(db)
+            if updates:
+                db.execute(update(models.PortfolioItem), [{**row, **stamp} for row in updates])
+            if inserts:
+                db.execute(insert(models.PortfolioItem), [{**row, **stamp} for row in inserts])
+        if inserts or updates or deleted:
+            search.index_providers(db, [user_id])
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Portfolio item id already in use")
+    if inserts or updates or deleted:
+        cache.invalidate(cache.provider_key(user_id))
+    return {
+        "message": "Portfolio updated successfully",
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "deleted": len(deleted)
+    }
+
+@app.patch("/users/{user_id}/portfolio/{item_id}", response_model=schemas.PortfolioBase, dependencies=[Depends(auth.owner("user_id"))])
+@db_handler(blocking=True)
+def patch_portfolio_item(user_id: str, item_id: str, changes: schemas.PortfolioPatch, db: Session = Depends(get_db)):
+    item = db.query(models.PortfolioItem).filter(
+        models.PortfolioItem.id == item_id, models.PortfolioItem.providerId == user_id
+    ).first()
+    if not item:
+        raise HTTPException(status_code=404, detail="Portfolio item not found")
+    values = changes.model_dump(exclude_unset=True)
+    if any(values.get(key, "") is None for key in ("imageUrl", "title")):
+        raise HTTPException(status_code=400, detail="imageUrl and title can't be null")
+    if values.get("imageUrl"):
+        values["imageUrl"] = _externalize(values["imageUrl"])
+    changed = False
+    for key, value in values.items():
+        if getattr(item, key) != value:
+            setattr(item, key, value)
+            changed = True
+    if changed:
+        db.commit()
+        cache.invalidate(cache.provider_key(user_id))
+    return item
+
+@app.delete("/users/{user_id}/portfolio/{item_id}", dependencies=[Depends(auth.owner("user_id"))])
+@db_handler(blocking=cache.BLOCKING)
+def delete_portfolio_item(user_id: str, item_id: str, db: Session = Depends(get_db)):
+    deleted = db.query(models.PortfolioItem).filter(
+        models.PortfolioItem.id == item_id, models.PortfolioItem.providerId == user_id
+    ).delete(synchronize_session=False)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Portfolio item not found")
+    sync.record_deletes(db, "portfolio", [item_id])
+    search.index_providers(db, [user_id])
     db.commit()
-    return {"message": "Portfolio updated successfully"}
+    cache.invalidate(cache.provider_key(user_id))
+    return {"message": "Portfolio item deleted"}
+
+def _cached_catalog(request, name, model, schema, cursor, limit, fields, db):
+    selected = projection.parse_fields(fields, schema)
+    key = f"{name}:{cursor}:{limit}:{','.join(sorted(selected)) if selected else ''}"
+
+    def build():
+        sink = pagination.HeaderSink()
+        rows = pagination.paginate(db.query(model), [model.id], cursor, limit, sink)
+        return projection.dump(rows, schema, selected), sink.headers
+
+    return cache.cached_response(request, key, build, cache.CATALOG_TTL)
+
+IMAGE_CACHE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+@app.post("/images")
+def upload_image(file: UploadFile = File(...)):
+    data = file.file.read(blobs.MAX_IMAGE_BYTES + 1)
+    if len(data) > blobs.MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail="Image too large")
+    try:
+        digest = blobs.store(data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"id": digest, "url": blobs.url_for(digest), "thumbnail": blobs.thumbnail_url_for(digest)}
+
+@app.get("/images/{digest}")
+def get_image(digest: str):
+    if not blobs.is_digest(digest) or not os.path.exists(blobs.blob_path(digest)):
+        raise HTTPException(status_code=404, detail="Image not found")
+    path = blobs.blob_path(digest)
+    with open(path, "rb") as f:
+        media_type = blobs.content_type(f.read(16))
+    # Content never changes for a digest, so clients may keep it forever
+    return FileResponse(path, media_type=media_type, headers={**IMAGE_CACHE_HEADERS, "ETag": f'"{digest}"'})
+
+@app.get("/images/{digest}/thumbnail")
+def get_image_thumbnail(digest: str):
+    if not blobs.is_digest(digest) or not os.path.exists(blobs.blob_path(digest)):
+        raise HTTPException(status_code=404, detail="Image not found")
+    path = blobs.make_thumbnail(digest)
+    if path is None:
+        # No Pillow on this server, or a blob it can't decode: fall back to the original
+        return get_image(digest)
+    return FileResponse(path, media_type="image/jpeg", headers={**IMAGE_CACHE_HEADERS, "ETag": f'"{digest}-thumb"'})
 
 @app.get("/badges", response_model=List[schemas.BadgeBase])
-def get_badges(db: Session = Depends(get_db)):
-    return db.query(models.Badge).all()
+@db_handler(blocking=cache.BLOCKING)
+def get_badges(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(pagination.MAX_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    return _cached_catalog(request, "badges", models.Badge, schemas.BadgeBase, cursor, limit, fields, db)
 
 @app.get("/services", response_model=List[schemas.ServiceBase])
-def get_services(db: Session = Depends(get_db)):
-    return db.query(models.Service).all()
+@db_handler(blocking=cache.BLOCKING)
+def get_services(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(pagination.MAX_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    return _cached_catalog(request, "services", models.Service, schemas.ServiceBase, cursor, limit, fields, db)
+
+@app.get("/sync", response_model=schemas.SyncResponse)
+@db_handler
+def sync_changes(
+    since: Optional[str] = None,
+    user_id: Optional[str] = None,
+    limit: int = Query(sync.PAGE_SIZE, ge=1, le=sync.MAX_PAGE_SIZE),
+    claims: Optional[dict] = Depends(auth.authenticate),
+    db: Session = Depends(get_db)
+):
+    """What changed since the token of the last call, see sync.py.
 
-@app.post("/job-requests", response_model=schemas.JobRequestResponse)
+    Reads the primary: a lagging replica would hand out a token behind the
+    one the client already has.
+    """
+    # Private jobs and profile changes only go to their own user
+    if user_id is None:
+        user_id = claims["sub"] if claims else None
+    else:
+        auth.check_owner(claims, user_id)
+    return sync.changes(db, sync.decode_token(since) if since else None, user_id, limit)
+
+@app.post("/job-requests", response_model=schemas.JobRequestResponse, dependencies=[Depends(auth.owner("userId"))])
+@db_handler(blocking=True)
 def create_job_request(request: schemas.JobRequestCreate, userId: str, db: Session = Depends(get_db)):
     # Check if direct request has providerId
     if request.request_type == 'direct' and not request.providerId:
         raise HTTPException(status_code=400, detail="Direct request must have a providerId")
         
+    job_data = request.dict()
+    job_data["images"] = _externalize(job_data["images"])
     new_job = models.JobRequest(
         id=str(uuid.uuid4()),
         clientId=userId,
-        **request.dict()
+        **job_data
     )
     db.add(new_job)
     db.commit()
-    db.refresh(new_job)
-    return new_job
+    job = loaders.load_job(db, new_job.id)
+    events.publish("job.created", _job_delta(
+        job, title=job.title, status=job.status, budget_min=job.budget_min,
+        budget_max=job.budget_max, createdAt=job.createdAt
+    ))
+    return job
 
 @app.get("/job-requests", response_model=List[schemas.JobRequestResponse])
-def get_job_requests(type: Optional[str] = None, db: Session = Depends(get_db)):
-    query = db.query(models.JobRequest).options(
-        joinedload(models.JobRequest.client),
-        joinedload(models.JobRequest.provider)
-    )
-    
+@replicas.read_handler
+def get_job_requests(
+    response: Response,
+    type: Optional[str] = None,
+    min_lat: Optional[float] = Query(None, ge=-90, le=90),
+    min_lng: Optional[float] = Query(None, ge=-180, le=180),
+    max_lat: Optional[float] = Query(None, ge=-90, le=90),
+    max_lng: Optional[float] = Query(None, ge=-180, le=180),
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lng: Optional[float] = Query(None, ge=-180, le=180),
+    radius_km: Optional[float] = Query(None, gt=0, le=500),
+    cursor: Optional[str] = None,
+    limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    fields: Optional[str] = None,
+    db: Session = Depends(replicas.get_read_db)
+):
+    selected = projection.parse_fields(fields, schemas.JobRequestResponse)
     # Only show 'open' requests on the map
-    query = query.filter(models.JobRequest.request_type == "open")
-    
+    filters = [
+        models.JobRequest.request_type == "open",
+        models.JobRequest.status == "pending",
+    ]
     if type and type != 'all':
-        query = query.filter(models.JobRequest.type == type)
-    return query.filter(models.JobRequest.status == "pending").all()
+        filters.append(models.JobRequest.type == type)
+
+    bbox = (min_lat, min_lng, max_lat, max_lng)
+    has_bbox = all(v is not None for v in bbox)
+    if any(v is not None for v in bbox) and not has_bbox:
+        raise HTTPException(status_code=400, detail="Bounding box needs min_lat, min_lng, max_lat and max_lng")
+    if (lat is None) != (lng is None):
+        raise HTTPException(status_code=400, detail="lat and lng must be given together")
+    if lat is not None and radius_km is None and not has_bbox:
+        raise HTTPException(status_code=400, detail="lat and lng need radius_km or a bounding box")
+    if radius_km is not None and lat is None:
+        raise HTTPException(status_code=400, detail="radius_km requires lat and lng")
+
+    if radius_km is None and not has_bbox:
+        query = serialization.job_rows(db, selected).filter(*filters)
+        rows = pagination.paginate(
+            query, [models.JobRequest.createdAt, models.JobRequest.id], cursor, limit, response, descending=True
+        )
+        return serialization.jobs_response(db, rows, response, selected)
+
+    # Geo mode: narrow by indexed geohash prefixes first, then exact bounds
+    if radius_km is not None:
+        bbox = geo.bbox_for_radius(lat, lng, radius_km)
+        if has_bbox:
+            bbox = (max(bbox[0], min_lat), max(bbox[1], min_lng), min(bbox[2], max_lat), min(bbox[3], max_lng))
+    if lat is None:
+        # min_lng > max_lng is a viewport across the antimeridian
+        max_lng = bbox[3] + 360 if bbox[3] < bbox[1] else bbox[3]
+        lat, lng = (bbox[0] + bbox[2]) / 2, ((bbox[1] + max_lng) / 2 + 180) % 360 - 180
+
+    cells = geo.covering_cells(*bbox)
+    rows = db.query(
+        models.JobRequest.id, models.JobRequest.latitude, models.JobRequest.longitude
+    ).filter(
+        # Filters go inside every geohash range so each one seeks ix_job_requests_open_geohash
+        geo.prefix_filter(models.JobRequest.geohash, cells, *filters),
+        geo.bbox_filter(models.JobRequest.latitude, models.JobRequest.longitude, bbox),
+    ).all()
+
+    hits = []
+    for job_id, job_lat, job_lng in rows:
+        distance = geo.haversine_km(lat, lng, job_lat, job_lng)
+        if radius_km is None or distance <= radius_km:
+            hits.append((distance, job_id))
+    hits.sort()
+    # Distance ordering can't use a keyset on stored columns, so geo mode pages by offset
+    page = hits[offset:offset + limit]
+    distances = {job_id: distance for distance, job_id in page}
+    jobs = []
+    if distances:
+        jobs = serialization.job_rows(db, selected).filter(models.JobRequest.id.in_(distances)).all()
+    jobs.sort(key=lambda j: (distances[j.id], j.id))
+    return serialization.jobs_response(db, jobs, fields=selected, distances=distances)
+
+@app.get("/search/jobs", response_model=List[schemas.JobRequestResponse])
+@db_handler
+def search_job_requests(
+    q: str = Query(..., min_length=1, max_length=200),
+    type: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=pagination.MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db)
+):
+    # Ranked by relevance, so results page by offset like the geo mode
+    hits = search.search(db, "jobs", q, type if type != "all" else None, limit, offset)
+    order = {job_id: i for i, (job_id, _) in enumerate(hits)}
+    jobs = []
+    if order:
+        jobs = serialization.job_rows(db).filter(models.JobRequest.id.in_(order)).all()
+    jobs.sort(key=lambda j: order[j.id])
+    return serialization.jobs_response(db, jobs)
 
 @app.get("/users/{user_id}/requests", response_model=List[schemas.JobRequestResponse])
-def get_user_requests(user_id: str, db: Session = Depends(get_db)):
-    # Fetch all jobs to robustly check candidates JSON in Python (SQLite limitation workaround)
-    all_jobs = db.query(models.JobRequest).options(
-        joinedload(models.JobRequest.client),
-        joinedload(models.JobRequest.provider)
-    ).order_by(models.JobRequest.createdAt.desc()).all()
-    
-    relevant_jobs = []
-    for job in all_jobs:
-        is_client = job.clientId == user_id
-        is_provider = job.providerId == user_id
-        is_candidate = job.candidates and user_id in job.candidates
-        
-        if is_client or is_provider or is_candidate:
-            relevant_jobs.append(job)
-            
-    return relevant_jobs
+@replicas.read_handler
+def get_user_requests(
+    user_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    db: Session = Depends(replicas.get_read_db)
+):
+    selected = projection.parse_fields(fields, schemas.JobRequestResponse)
+    # Live and archived jobs in one keyset-paged list
+    items = archive.history_page(db, user_id, cursor, limit, response, selected)
+    return serialization.json_response(serialization.dumps(items), response)
+
+@app.get("/job-requests/stream")
+async def stream_job_requests(
+    request: Request,
+    type: Optional[str] = None,
+    min_lat: Optional[float] = Query(None, ge=-90, le=90),
+    min_lng: Optional[float] = Query(None, ge=-180, le=180),
+    max_lat: Optional[float] = Query(None, ge=-90, le=90),
+    max_lng: Optional[float] = Query(None, ge=-180, le=180),
+):
+    bbox = (min_lat, min_lng, max_lat, max_lng)
+    if any(v is not None for v in bbox) and not all(v is not None for v in bbox):
+        raise HTTPException(status_code=400, detail="Bounding box needs min_lat, min_lng, max_lat and max_lng")
+    types = {t for t in type.split(",") if t} if type and type != 'all' else None
+    subscription = events.broker.subscribe(bbox if min_lat is not None else None, types)
+    return StreamingResponse(
+        events.stream(subscription, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/job-requests/batch", response_model=List[schemas.JobRequestResponse])
+@replicas.read_handler
+def get_job_requests_batch(ids: str, fields: Optional[str] = None, db: Session = Depends(replicas.get_read_db)):
+    """Several jobs by id in one round trip; unknown ids are left out."""
+    selected = projection.parse_fields(fields, schemas.JobRequestResponse)
+    wanted = _batch_ids(ids)
+    jobs = loaders.load_jobs(db, wanted, selected)
+    if len(jobs) < len(wanted):
+        found = {job.id: job for job in jobs}
+        archived = archive.load_jobs(db, [i for i in wanted if i not in found], selected)
+        jobs = [found.get(i) or archived[i] for i in wanted if i in found or i in archived]
+    if selected:
+        return projection.project(jobs, schemas.JobRequestResponse, selected)
+    return jobs
 
 @app.get("/job-requests/{job_id}", response_model=schemas.JobRequestResponse)
+@db_handler
 def get_job_request(job_id: str, db: Session = Depends(get_db)):
-    job = db.query(models.JobRequest).options(
-        joinedload(models.JobRequest.client),
-        joinedload(models.JobRequest.provider)
-    ).filter(models.JobRequest.id == job_id).first()
+    job = loaders.load_job(db, job_id)
+    if not job:
+        job = archive.load_jobs(db, [job_id]).get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     return job
 
+def _set_job_status(job, status):
+    job_states.check_status(job, status)
+    job.status = status
+    return _job_delta(job, status=status)
+
+def _assign_job(job, provider_id):
+    job_states.check_assignable(job)
+    job.providerId = provider_id
+    # We don't change status to in_process yet, that happens after deposit
+    return _job_delta(job, providerId=provider_id)
+
+def _accept_job(job, provider_id):
+    job_states.check_acceptable(job, provider_id)
+    job.providerId = provider_id
+    job.status = "accepted"
+    return _job_delta(job, providerId=provider_id, status="accepted")
+
+def _apply_batch_operation(job, op, claims):
+    """Apply ``op`` to ``job`` in memory; (message, delta) or HTTPException."""
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # Same callers as the single-job routes
+    if op.action == "status":
+        auth.check_owner(claims, job.clientId, job.providerId)
+        if op.status is None:
+            raise HTTPException(status_code=400, detail="status is required")
+        return f"Job status updated to {op.status}", _set_job_status(job, op.status)
+    if op.provider_id is None:
+        raise HTTPException(status_code=400, detail="provider_id is required")
+    if op.action == "assign":
+        auth.check_owner(claims, job.clientId)
+        return "Provider assigned", _assign_job(job, op.provider_id)
+    auth.check_owner(claims, op.provider_id)
+    if job.providerId == op.provider_id and job.status == "accepted":
+        return "Job accepted successfully", None
+    return "Job accepted successfully", _accept_job(job, op.provider_id)
+
+@app.post("/job-requests/batch", response_model=List[schemas.JobBatchResult])
+@db_handler(blocking=cache.BLOCKING)
+def batch_update_jobs(batch: schemas.JobBatchUpdate, claims: Optional[dict] = Depends(auth.authenticate), db: Session = Depends(get_db)):
+    """Status, assign and accept changes for several jobs in one transaction.
+
+    Operations run in order against the jobs as left by the previous ones,
+    with the same checks as the single-job routes, and each gets its own
+    result. Failed ones change nothing; the rest commit together, or none do
+    when ``atomic`` is set. A job modified by another request meanwhile
+    fails the whole batch with 409, like the single routes.
+    """
+    job_ids = {op.job_id for op in batch.operations}
+    jobs = {job.id: job for job in db.query(models.JobRequest).filter(models.JobRequest.id.in_(job_ids))}
+    results, deltas, providers = [], [], set()
+    for op in batch.operations:
+        job = jobs.get(op.job_id)
+        try:
+            message, delta = _apply_batch_operation(job, op, claims)
+        except HTTPException as e:
+            results.append(schemas.JobBatchResult(job_id=op.job_id, action=op.action, status_code=e.status_code, detail=e.detail))
+            continue
+        results.append(schemas.JobBatchResult(job_id=op.job_id, action=op.action, status_code=200, detail=message))
+        deltas.append(delta)
+        if op.action == "status" and job.providerId:
+            # Completing a job changes the provider's job count (see stats.py)
+            providers.add(job.providerId)
+
+    if batch.atomic and any(r.status_code != 200 for r in results):
+        db.rollback()
+        for r in results:
+            if r.status_code == 200:
+                r.status_code, r.detail = 424, "Not applied, another operation in the batch failed"
+        return results
+
+    job_states.commit(db)
+    for delta in deltas:
+        events.publish("job.updated", delta)
+    for provider_id in providers:
+        cache.invalidate(cache.provider_key(provider_id))
+    return results
+
 @app.put("/job-requests/{job_id}/status")
-def update_job_status(job_id: str, status: str, db: Session = Depends(get_db)):
+@db_handler(blocking=cache.BLOCKING)
+def update_job_status(job_id: str, status: str, claims: Optional[dict] = Depends(auth.authenticate), db: Session = Depends(get_db)):
     job = db.query(models.JobRequest).filter(models.JobRequest.id == job_id).first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
+    auth.check_owner(claims, job.clientId, job.providerId)
     
-    job.status = status
-    db.commit()
+    provider_id = job.providerId
+    delta = _set_job_status(job, status)
+    job_states.commit(db)
+    events.publish("job.updated", delta)
+    if provider_id:
+        # Completing a job changes the provider's job count (see stats.py)
+        cache.invalidate(cache.provider_key(provider_id))
     return {"message": f"Job status updated to {status}"}
 
 @app.put("/job-requests/{job_id}/proposal")
-def update_proposal(job_id: str, proposal: schemas.ProposalUpdate, db: Session = Depends(get_db)):
+@db_handler
+def update_proposal(job_id: str, proposal: schemas.ProposalUpdate, claims: Optional[dict] = Depends(auth.authenticate), db: Session = Depends(get_db)):
     job = db.query(models.JobRequest).filter(models.JobRequest.id == job_id).first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
+    auth.check_owner(claims, job.clientId, job.providerId)
     
+    job_states.check_proposal(job, proposal.proposal_status)
     job.milestones = proposal.milestones
     job.budget_final = proposal.budget_final
     job.proposal_status = proposal.proposal_status
+    delta = _job_delta(job, proposal_status=job.proposal_status, budget_final=job.budget_final)
     
-    db.commit()
+    job_states.commit(db)
+    events.publish("job.updated", delta)
     return {"message": "Proposal updated"}
 
-@app.put("/job-requests/{job_id}/apply")
+@app.put("/job-requests/{job_id}/apply", dependencies=[Depends(auth.owner("provider_id"))])
+@db_handler
 def apply_to_job(job_id: str, provider_id: str, db: Session = Depends(get_db)):
     job = db.query(models.JobRequest).filter(models.JobRequest.id == job_id).first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    current_candidates = list(job.candidates) if job.candidates else []
-    if provider_id not in current_candidates:
-        current_candidates.append(provider_id)
-        job.candidates = current_candidates
-        db.commit()
+    if db.get(models.JobCandidate, (job_id, provider_id)) is None:
+        job_states.check_open_for_candidates(job)
+        delta = _job_delta(job, candidate=provider_id)
+        db.add(models.JobCandidate(jobId=job_id, providerId=provider_id))
+        # Bumps the job's version in the same flush, so an apply racing an
+        # accept or a status change loses with 409 instead of landing on it
+        flag_modified(job, "status")
+        try:
+            job_states.commit(db)
+            events.publish("job.updated", delta)
+        except IntegrityError:
+            # A concurrent apply by the same provider won the insert
+            db.rollback()
     
     return {"message": "Applied successfully"}
 
 @app.put("/job-requests/{job_id}/assign")
-def assign_provider(job_id: str, provider_id: str, db: Session = Depends(get_db)):
+@db_handler
+def assign_provider(job_id: str, provider_id: str, claims: Optional[dict] = Depends(auth.authenticate), db: Session = Depends(get_db)):
     job = db.query(models.JobRequest).filter(models.JobRequest.id == job_id).first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
+    auth.check_owner(claims, job.clientId)
     
-    job.providerId = provider_id
-    # We don't change status to in_process yet, that happens after deposit
-    db.commit()
+    delta = _assign_job(job, provider_id)
+    job_states.commit(db)
+    events.publish("job.updated", delta)
     return {"message": "Provider assigned"}
 
-@app.put("/job-requests/{job_id}/accept")
+@app.put("/job-requests/{job_id}/accept", dependencies=[Depends(auth.owner("provider_id"))])
+@db_handler
 def accept_job(job_id: str, provider_id: str, db: Session = Depends(get_db)):
     job = db.query(models.JobRequest).filter(models.JobRequest.id == job_id).first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    if job.providerId and job.providerId != provider_id:
-        raise HTTPException(status_code=400, detail="Job already taken by another provider")
-        
-    job.providerId = provider_id
-    job.status = "accepted"
-    db.commit()
+    if job.providerId == provider_id and job.status == "accepted":
+        # Retried accept by the winner
+        return {"message": "Job accepted successfully"}
+    delta = _accept_job(job, provider_id)
+    job_states.commit(db)
+    events.publish("job.updated", delta)
     return {"message": "Job accepted successfully"}
+
 @app.delete("/job-requests/{job_id}")
-def delete_job_request(job_id: str, db: Session = Depends(get_db)):
+@db_handler(blocking=cache.BLOCKING)
+def delete_job_request(job_id: str, claims: Optional[dict] = Depends(auth.authenticate), db: Session = Depends(get_db)):
     job = db.query(models.JobRequest).filter(models.JobRequest.id == job_id).first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
+    auth.check_owner(claims, job.clientId)
     
+    delta = _job_delta(job)
+    provider_id = job.providerId
     db.delete(job)
-    db.commit()
+    job_states.commit(db)
+    events.publish("job.deleted", delta)
+    if provider_id:
+        # Deleting a completed job changes the provider's job count (see stats.py)
+        cache.invalidate(cache.provider_key(provider_id))
     return {"message": "Job request deleted successfully"}
 
 @app.put("/job-requests/{job_id}", response_model=schemas.JobRequestResponse)
-def update_job_request(job_id: str, updates: schemas.JobRequestCreate, db: Session = Depends(get_db)):
+@db_handler(blocking=True)
+def update_job_request(job_id: str, updates: schemas.JobRequestCreate, claims: Optional[dict] = Depends(auth.authenticate), db: Session = Depends(get_db)):
     job = db.query(models.JobRequest).filter(models.JobRequest.id == job_id).first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
+    auth.check_owner(claims, job.clientId)
     
     update_data = updates.dict(exclude_unset=True)
+    if update_data.get("images"):
+        update_data["images"] = _externalize(update_data["images"])
+    was_open = job.request_type == "open"
     for key, value in update_data.items():
         setattr(job, key, value)
     
-    db.commit()
-    db.refresh(job)
+    job_states.commit(db)
+    job = loaders.load_job(db, job_id)
+    delta = _job_delta(job, **{k: getattr(job, k) for k in update_data if k != "images"})
+    if delta is None and was_open:
+        # Turned into a direct request: drop it from map feeds
+        delta = events.job_event(job)
+        events.publish("job.deleted", delta)
+    else:
+        events.publish("job.updated", delta)
     return job
@@ -0,0 +1,225 @@
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Request and query instrumentation, exposed at /metrics in the Prometheus
+# text format:
+#   - per-route latency histograms and request counts (ASGI middleware)
+#   - SQL statements and DB time per request, via cursor execute hooks on
+#     every Engine, attributed to the request through a context variable
+#   - a slow-query log with normalized statements
+#
+# METRICS_ENABLED=0 skips the middleware, the hooks and the endpoint
+# altogether, so the disabled cost is nothing at all. The slow-query log only
+# needs the hooks and stays on unless SLOW_QUERY_MS=0.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Long-lived or self-referential routes that would only skew the histograms
+EXCLUDED_ROUTES = {"/metrics", "/job-requests/stream"}
+
+logger = logging.getLogger("truber.sql")
+
+_request_stats = contextvars.ContextVar("request_db_stats", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a label tuple."""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            names = self.label_names + ("le",)
+            for bound, count in zip(self.buckets, series):
+                lines.append(_sample(f"{self.name}_bucket", names, labels + (bound,), count))
+            lines.append(_sample(f"{self.name}_bucket", names, labels + ("+Inf",), series[-1]))
+            lines.append(_sample(f"{self.name}_sum", self.label_names, labels, series[-2]))
+            lines.append(_sample(f"{self.name}_count", self.label_names, labels, series[-1]))
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values = defaultdict(int)
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.label_names:
+            items = [((), 0)]
+        for labels, value in items:
+            lines.append(_sample(self.name, self.label_names, labels, value))
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample(name, label_names, labels, value):
+    if not label_names:
+        return f"{name} {value}"
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(label_names, labels))
+    return f"{name}{{{pairs}}} {value}"
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route.", ("method", "route"), LATENCY_BUCKETS
+)
+REQUESTS = Counter("http_requests_total", "Requests by route and status code.", ("method", "route", "status"))
+REQUEST_QUERIES = Histogram(
+    "db_queries_per_request", "SQL statements issued per request.", ("method", "route"), QUERY_COUNT_BUCKETS
+)
+REQUEST_DB_TIME = Histogram(
+    "db_time_per_request_seconds", "Time spent in SQL statements per request.", ("method", "route"), LATENCY_BUCKETS
+)
+SLOW_QUERIES = Counter("db_slow_queries_total", "Statements slower than SLOW_QUERY_MS.", ())
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+_PARAMS = re.compile(r"%\(\w+\)s|%s|\$\d+")  # psycopg2 / asyncpg placeholders
+
+
+def normalize(statement):
+    """Statement with literals and IN lists collapsed, for grouping slow queries."""
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    statement = _LITERALS.sub("?", statement)
+    statement = _PARAMS.sub("?", statement)
+    return _IN_LISTS.sub("(?, ...)", statement)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc(())
+        logger.warning("slow query (%.1f ms): %s", elapsed * 1000, normalize(statement))
+
+
+def _handle_error(exception_context):
+    # The after hook doesn't run for failed statements; keep the stack balanced
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_started"):
+        conn.info["query_started"].pop()
+
+
+def install_query_hooks():
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+
+
+class MetricsMiddleware:
+    """Times each HTTP request and records its DB usage under the route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_stats.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            if path not in EXCLUDED_ROUTES:
+                labels = (scope["method"], path)
+                REQUEST_LATENCY.observe(labels, elapsed)
+                REQUESTS.inc(labels + (str(status[0]),))
+                REQUEST_QUERIES.observe(labels, stats.queries)
+                REQUEST_DB_TIME.observe(labels, stats.db_seconds)
+
+
+def render(extra=()):
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in (REQUEST_LATENCY, REQUESTS, REQUEST_QUERIES, REQUEST_DB_TIME, SLOW_QUERIES):
+        lines.extend(metric.render())
+    lines.extend(extra)
+    return "\n".join(lines) + "\n"
+
+
+def gauges(name, help_text, values):
+    """Lines for a set of unlabelled gauges, ``values`` being {suffix: number}."""
+    lines = []
+    for suffix, value in values.items():
+        metric = f"{name}_{suffix}"
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge", f"{metric} {value}"]
+    return lines
+
+
+if METRICS_ENABLED or SLOW_QUERY_MS:
+    install_query_hooks()
@@ -1,14 +0,0 @@
-from sqlalchemy import create_engine, text
-from database import DATABASE_URL
-
-def migrate():
-    engine = create_engine(DATABASE_URL)
-    with engine.connect() as conn:
-        try:
-            conn.execute(text("ALTER TABLE job_requests ADD COLUMN candidates JSON"))
-            print("Successfully added 'candidates' column to job_requests table")
-        except Exception as e:
-            print(f"Migration failed (might already exist): {e}")
-
-if __name__ == "__main__":
-    migrate()
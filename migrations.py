@@ -0,0 +1,338 @@
+import datetime
+import json
+import logging
+import sys
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, column, func, inspect, select, text
+from sqlalchemy.orm import Session, load_only
+import models
+
+# Versioned schema migrations, replacing the one-off migrate_*.py scripts.
+#
+# Each step is a function of a Connection, registered with @migration under
+# an increasing version number, and runs in its own transaction together
+# with the schema_migrations row that records it. Errors propagate and stop
+# the run, so a failed step is retried from the same point next time.
+#
+# Step 1 creates whatever tables of the current models are missing, so a
+# fresh database starts with the latest columns and indexes; the later steps
+# bring databases created by older versions of the app up to date and check
+# the schema before altering it. That also makes them safe to rerun on
+# SQLite, where pysqlite commits DDL on its own.
+#
+# The app never runs DDL at startup; deploys run this first.
+#
+#   python migrations.py            # upgrade to the latest version
+#   python migrations.py status     # applied and pending versions
+
+logger = logging.getLogger(__name__)
+
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+MIGRATIONS = []  # (version, name, fn), in version order
+
+
+def migration(version, name):
+    def register(fn):
+        if MIGRATIONS and version <= MIGRATIONS[-1][0]:
+            raise ValueError(f"Migration {version} registered out of order")
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return register
+
+
+def _columns(conn, table, schema=None):
+    return {c["name"] for c in inspect(conn).get_columns(table, schema=schema)}
+
+
+def _add_column(conn, table, name, ddl, schema=None):
+    if name not in _columns(conn, table, schema):
+        qualified = f"{schema}.{table}" if schema else table
+        conn.execute(text(f'ALTER TABLE {qualified} ADD COLUMN "{name}" {ddl}'))
+        logger.info("Added %s.%s", qualified, name)
+
+
+@migration(1, "create missing tables")
+def _create_tables(conn):
+    models.Base.metadata.create_all(conn)
+
+
+@migration(2, "job negotiation columns")
+def _negotiation_columns(conn):
+    _add_column(conn, "job_requests", "milestones", "JSON DEFAULT '[]'")
+    _add_column(conn, "job_requests", "proposal_status", "VARCHAR DEFAULT 'none'")
+    _add_column(conn, "job_requests", "budget_final", "FLOAT")
+
+
+@migration(3, "move job_requests.candidates into job_candidates")
+def _job_candidates(conn):
+    if "candidates" not in _columns(conn, "job_requests"):
+        return
+    rows = conn.execute(text(
+        'SELECT id, candidates, "createdAt" FROM job_requests WHERE candidates IS NOT NULL'
+    ).columns(column("id"), column("candidates"), column("createdAt", DateTime))).all()
+    existing = set(conn.execute(text('SELECT "jobId", "providerId" FROM job_candidates')).all())
+    moved = []
+    for job_id, candidates, created_at in rows:
+        if isinstance(candidates, str):
+            candidates = json.loads(candidates)
+        for provider_id in dict.fromkeys(candidates or []):
+            if (job_id, provider_id) not in existing:
+                # The JSON list never recorded when providers applied; use the job creation time
+                moved.append({"jobId": job_id, "providerId": provider_id, "appliedAt": created_at})
+    if moved:
+        conn.execute(models.JobCandidate.__table__.insert(), moved)
+    conn.execute(text("ALTER TABLE job_requests DROP COLUMN candidates"))
+    logger.info("Moved %d candidates into job_candidates", len(moved))
+
+
+@migration(4, "geohash columns")
+def _geohash(conn):
+    import geo
+
+    for table in ("job_requests", "users"):
+        _add_column(conn, table, "geohash", "VARCHAR")
+        rows = conn.execute(text(
+            f"SELECT id, latitude, longitude FROM {table} "
+            "WHERE geohash IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL"
+        )).all()
+        if rows:
+            conn.execute(
+                text(f"UPDATE {table} SET geohash = :g WHERE id = :id"),
+                [{"g": geo.encode(lat, lng), "id": row_id} for row_id, lat, lng in rows]
+            )
+            logger.info("Backfilled geohash for %d rows in %s", len(rows), table)
+
+
+@migration(5, "job optimistic lock version")
+def _job_versions(conn):
+    _add_column(conn, "job_requests", "version", "INTEGER NOT NULL DEFAULT 1")
+
+
+@migration(6, "backfill provider_stats")
+def _provider_stats(conn):
+    import stats
+
+    if not conn.execute(select(models.ProviderStats.providerId).limit(1)).first():
+        stats.rebuild(Session(bind=conn))
+
+
+@migration(7, "move inline images to the blob store")
+def _inline_images(conn):
+    import blobs
+
+    # Rows here predate the sync tables; migration 11 sequences them
+    db = Session(bind=conn, info={"sync": False})
+    moved = 0
+    for model, column in (
+        (models.JobRequest, "images"),
+        (models.PortfolioItem, "imageUrl"),
+        (models.User, "image"),
+    ):
+        last_id = ""
+        while True:
+            # Only the columns this step knows about; later ones don't exist yet
+            rows = db.query(model).options(load_only(getattr(model, column))).filter(
+                model.id > last_id
+            ).order_by(model.id).limit(200).all()
+            if not rows:
+                break
+            for row in rows:
+                value = getattr(row, column)
+                new_value = blobs.externalize_list(value) if isinstance(value, list) else blobs.externalize(value)
+                if new_value != value:
+                    setattr(row, column, new_value)
+                    moved += 1
+            last_id = rows[-1].id
+            db.flush()
+            db.expunge_all()
+    if moved:
+        logger.info("Moved inline images out of %d rows", moved)
+
+
+@migration(8, "full-text search index")
+def _search_index(conn):
+    import search
+
+    search.refill(conn)
+
+
+# Indexes replaced by the composite ones in models.py
+_SUPERSEDED_INDEXES = [
+    "ix_job_requests_clientId", "ix_job_requests_providerId", "ix_job_requests_geohash",
+    "ix_users_rating", "ix_users_jobs", "ix_users_geohash",
+]
+
+
+@migration(9, "indexes for the endpoint query shapes")
+def _query_indexes(conn):
+    for name in _SUPERSEDED_INDEXES:
+        conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+    for table in (models.User.__table__, models.JobRequest.__table__, models.PortfolioItem.__table__,
+                  models.Review.__table__, models.user_badges):
+        present = _columns(conn, table.name)
+        for index in table.indexes:
+            # Indexes on columns added by later migrations come with them
+            if all(c.name in present for c in index.columns):
+                index.create(conn, checkfirst=True)
+
+
+@migration(10, "archive tables for finished jobs")
+def _archive_tables(conn):
+    import archive
+
+    archive.create_tables(conn)
+
+
+@migration(11, "change sequence and tombstones for /sync")
+def _sync_columns(conn):
+    import sync
+
+    archive_table = models.ArchivedJobRequest.__table__
+    tables = [model.__table__ for model in sync.ENTITIES.values()]
+    if inspect(conn).has_table(archive_table.name, schema=archive_table.schema):
+        tables.append(archive_table)
+    for table in tables:
+        _add_column(conn, table.name, "seq", "INTEGER", table.schema)
+        _add_column(conn, table.name, "updatedAt", "TIMESTAMP", table.schema)
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+    models.SyncState.__table__.create(conn, checkfirst=True)
+    models.SyncSequence.__table__.create(conn, checkfirst=True)
+    models.Tombstone.__table__.create(conn, checkfirst=True)
+    count = sync.backfill(conn)
+    if count:
+        logger.info("Sequenced %d rows for sync", count)
+
+
+# Keyset pagination sort keys; a NULL in a cursor would end the listing early
+_SORT_KEYS = [
+    ("users", "rating", "0"),
+    ("users", "jobs", "0"),
+    ("users", "createdAt", "'1970-01-01 00:00:00'"),
+    ("job_requests", "createdAt", "'1970-01-01 00:00:00'"),
+]
+
+
+@migration(12, "non-null pagination sort keys")
+def _sort_keys_not_null(conn):
+    archive_table = models.ArchivedJobRequest.__table__
+    keys = list(_SORT_KEYS)
+    if inspect(conn).has_table(archive_table.name, schema=archive_table.schema):
+        qualified = f"{archive_table.schema}.{archive_table.name}" if archive_table.schema else archive_table.name
+        keys.append((qualified, "createdAt", "'1970-01-01 00:00:00'"))
+    for table, name, value in keys:
+        filled = conn.execute(text(f'UPDATE {table} SET "{name}" = {value} WHERE "{name}" IS NULL')).rowcount
+        if filled:
+            logger.info("Filled %d NULL %s.%s", filled, table, name)
+        # SQLite can't change a column's constraint in place; new databases
+        # get NOT NULL from the models and the ORM defaults cover the rest
+        if conn.dialect.name != "sqlite":
+            conn.execute(text(f'ALTER TABLE {table} ALTER COLUMN "{name}" SET NOT NULL'))
+
+
+@migration(13, "key the SQLite search index by entity id")
+def _search_index_ids(conn):
+    import search
+
+    # The old FTS5 tables were keyed by the base tables' rowids, which VACUUM
+    # can renumber; the new ones can't be altered into place
+    if conn.dialect.name == "sqlite":
+        search.drop(conn)
+        search.refill(conn)
+
+
+@migration(14, "lease for the background archiver")
+def _archive_lease(conn):
+    import archive
+
+    leases = models.Lease.__table__
+    leases.create(conn, checkfirst=True)
+    if conn.execute(select(leases.c.name).where(leases.c.name == archive.LEASE_NAME)).first() is None:
+        conn.execute(leases.insert().values(name=archive.LEASE_NAME, expiresAt=datetime.datetime(1970, 1, 1)))
+
+
+@migration(15, "sync sequence table instead of the sync_state counter")
+def _sync_sequence(conn):
+    state = models.SyncState.__table__
+    sequence = models.SyncSequence.__table__
+    sequence.create(conn, checkfirst=True)
+    last = conn.execute(select(state.c.seq).where(state.c.id == 1)).scalar() or 0
+    taken = conn.execute(select(func.max(sequence.c.seq))).scalar() or 0
+    if last > taken:
+        # New numbers carry on from the old counter, so existing tokens stay valid
+        conn.execute(sequence.insert().values(seq=last, takenAt=datetime.datetime.utcnow()))
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT setval(pg_get_serial_sequence('sync_sequence', 'seq'), :last)"), {"last": last})
+        logger.info("Sync sequence continues after %d", last)
+
+
+@migration(16, "transaction ids for the sync watermark")
+def _sync_sequence_xids(conn):
+    table = models.SyncSequence.__table__
+    _add_column(conn, table.name, "xid", "BIGINT")
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def applied_versions(conn):
+    if not inspect(conn).has_table("schema_migrations"):
+        return set()
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def pending(engine):
+    """[(version, name)] not applied yet. Read-only, safe at startup."""
+    with engine.connect() as conn:
+        done = applied_versions(conn)
+    return [(version, name) for version, name, _ in MIGRATIONS if version not in done]
+
+
+def upgrade(engine):
+    """Apply every pending migration; returns the versions applied."""
+    with engine.begin() as conn:
+        schema_migrations.create(conn, checkfirst=True)
+    applied = []
+    for version, name, fn in MIGRATIONS:
+        with engine.begin() as conn:
+            if version in applied_versions(conn):
+                continue
+            logger.info("Applying migration %d: %s", version, name)
+            fn(conn)
+            conn.execute(schema_migrations.insert().values(
+                version=version, name=name, applied_at=datetime.datetime.utcnow()
+            ))
+        applied.append(version)
+    return applied
+
+
+def drop_all(engine):
+    """Drop every table, the search index and the migration history."""
+    import search
+
+    with engine.begin() as conn:
+        search.drop(conn)
+    models.Base.metadata.drop_all(bind=engine)
+    schema_migrations.drop(engine, checkfirst=True)
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command == "upgrade":
+        applied = upgrade(engine)
+        print(f"Applied {len(applied)} migration(s)" if applied else "Database is up to date")
+    elif command == "status":
+        todo = dict(pending(engine))
+        for version, name, _ in MIGRATIONS:
+            print(f"{version:4}  {'pending' if version in todo else 'applied':8} {name}")
+    else:
+        print("usage: python migrations.py [upgrade|status]")
+        sys.exit(1)
@@ -1,14 +1,16 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, JSON, Boolean, Table
+from sqlalchemy import BigInteger, Column, Integer, String, Float, ForeignKey, DateTime, JSON, Boolean, Index, Table
 from sqlalchemy.orm import relationship
-from database import Base
+from sqlalchemy import event
+from database import ARCHIVE_SCHEMA, Base
 import datetime
+import geo
 
 # Association table for User-Badge relationship
 user_badges = Table(
     'user_badges',
     Base.metadata,
-    Column('user_id', String, ForeignKey('users.id')),
-    Column('badge_id', String, ForeignKey('badges.id'))
+    Column('user_id', String, ForeignKey('users.id'), index=True),
+    Column('badge_id', String, ForeignKey('badges.id'), index=True)
 )
 
 class User(Base):
@@ -20,32 +22,56 @@ class User(Base):
     password = Column(String)
     role = Column(String) # 'client', 'provider', 'admin'
     image = Column(String, nullable=True)
-    createdAt = Column(DateTime, default=datetime.datetime.utcnow)
+    # Keyset sort keys (see pagination.py) are never NULL
+    createdAt = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     
     # Provider specific fields
     type = Column(String, nullable=True) # 'electric', 'plumbing', etc.
-    rating = Column(Float, default=0.0)
-    jobs = Column(Integer, default=0)
+    rating = Column(Float, nullable=False, default=0.0) # Kept in sync from provider_stats, see stats.py
+    jobs = Column(Integer, nullable=False, default=0)
     latitude = Column(Float, nullable=True)
     longitude = Column(Float, nullable=True)
+    geohash = Column(String, nullable=True) # Derived from latitude/longitude, see geo.py
     about = Column(String, nullable=True)
     hourly_rate = Column(JSON, nullable=True) # {"min": 10, "max": 20}
     location_name = Column(String, nullable=True)
     phone = Column(String, nullable=True)
+    seq = Column(Integer, nullable=True) # Change sequence, see sync.py
+    updatedAt = Column(DateTime, nullable=True)
 
     # Relationships
     portfolio = relationship("PortfolioItem", back_populates="provider")
     reviews = relationship("Review", back_populates="provider", foreign_keys="Review.providerId")
     badges = relationship("Badge", secondary=user_badges, back_populates="users")
 
+    # Every listing filters on role first, then sorts or ranges on the rest
+    __table_args__ = (
+        Index("ix_users_role_created", "role", "createdAt", "id"),  # GET /providers
+        Index("ix_users_role_rating", "role", "rating", "id"),  # sort=rating
+        Index("ix_users_role_jobs", "role", "jobs", "id"),  # sort=jobs
+        Index("ix_users_role_geohash", "role", "geohash"),  # /providers/nearby
+        Index("ix_users_role_seq", "role", "seq"),  # GET /sync
+    )
+
+class ProviderStats(Base):
+    __tablename__ = "provider_stats"
+
+    providerId = Column(String, ForeignKey('users.id'), primary_key=True)
+    rating_sum = Column(Float, default=0.0)
+    rating_count = Column(Integer, default=0)
+    completed_jobs = Column(Integer, default=0)
+    last_active_at = Column(DateTime, nullable=True)
+
 class PortfolioItem(Base):
     __tablename__ = "portfolio"
 
     id = Column(String, primary_key=True, index=True)
-    providerId = Column(String, ForeignKey('users.id'))
+    providerId = Column(String, ForeignKey('users.id'), index=True)
     imageUrl = Column(String)
     title = Column(String)
     description = Column(String, nullable=True)
+    seq = Column(Integer, nullable=True, index=True)
+    updatedAt = Column(DateTime, nullable=True)
 
     provider = relationship("User", back_populates="portfolio")
 
@@ -53,7 +79,7 @@ class Review(Base):
     __tablename__ = "reviews"
 
     id = Column(String, primary_key=True, index=True)
-    providerId = Column(String, ForeignKey('users.id'))
+    providerId = Column(String, ForeignKey('users.id'), index=True)
     userId = Column(String) # The client who wrote it
     userName = Column(String)
     comment = Column(String)
@@ -68,6 +94,8 @@ class Badge(Base):
     id = Column(String, primary_key=True, index=True)
     name = Column(String)
     icon = Column(String)
+    seq = Column(Integer, nullable=True, index=True)
+    updatedAt = Column(DateTime, nullable=True)
 
     users = relationship("User", secondary=user_badges, back_populates="badges")
 
@@ -79,6 +107,8 @@ class Service(Base):
     slug = Column(String, unique=True) # For code reference, e.g., 'electric'
     icon = Column(String) # Icon name or identifier
     description = Column(String, nullable=True)
+    seq = Column(Integer, nullable=True, index=True)
+    updatedAt = Column(DateTime, nullable=True)
 
 class JobRequest(Base):
     __tablename__ = "job_requests"
@@ -93,14 +123,119 @@ class JobRequest(Base):
     budget_max = Column(Float)
     latitude = Column(Float)
     longitude = Column(Float)
+    geohash = Column(String, nullable=True) # Derived from latitude/longitude, see geo.py
     request_type = Column(String, default="open") # 'open' (map) or 'direct' (private)
     status = Column(String, default="pending")  # 'pending', 'accepted', 'rejected', 'in_process', 'completed', 'cancelled'
     images = Column(JSON, nullable=True) # List of image strings
-    candidates = Column(JSON, default=[]) # List of provider IDs who applied
     milestones = Column(JSON, default=[]) # List of {id, description, amount, status}
     proposal_status = Column(String, default="none") # 'none', 'sent', 'rejected', 'accepted'
     budget_final = Column(Float, nullable=True)
-    createdAt = Column(DateTime, default=datetime.datetime.utcnow)
+    createdAt = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1) # Optimistic lock, see job_states.py
+    seq = Column(Integer, nullable=True) # Change sequence, see sync.py
+    updatedAt = Column(DateTime, nullable=True)
+
+    __mapper_args__ = {"version_id_col": version}
+    __table_args__ = (
+        # The map: open + pending, optionally one type, newest first
+        Index("ix_job_requests_open_created", "request_type", "status", "createdAt", "id"),
+        Index("ix_job_requests_open_type_created", "request_type", "status", "type", "createdAt", "id"),
+        Index("ix_job_requests_open_geohash", "request_type", "status", "geohash"),  # map by area
+        # A user's jobs, newest first (GET /users/{user_id}/requests)
+        Index("ix_job_requests_client_created", "clientId", "createdAt", "id"),
+        Index("ix_job_requests_provider_created", "providerId", "createdAt", "id"),
+        # Open jobs changed since a sync token (GET /sync)
+        Index("ix_job_requests_open_seq", "request_type", "seq"),
+    )
 
     client = relationship("User", foreign_keys=[clientId])
     provider = relationship("User", foreign_keys=[providerId])
+    candidate_links = relationship(
+        "JobCandidate", cascade="all, delete-orphan", order_by="JobCandidate.appliedAt"
+    )
+
+    @property
+    def candidates(self):
+        # List of provider IDs who applied
+        return [link.providerId for link in self.candidate_links]
+
+class JobCandidate(Base):
+    __tablename__ = "job_candidates"
+
+    jobId = Column(String, ForeignKey('job_requests.id', ondelete="CASCADE"), primary_key=True)
+    providerId = Column(String, ForeignKey('users.id'), primary_key=True, index=True)
+    appliedAt = Column(DateTime, default=datetime.datetime.utcnow)
+
+class SyncState(Base):
+    """Single row (id 1) of sync bookkeeping, see sync.py."""
+    __tablename__ = "sync_state"
+
+    id = Column(Integer, primary_key=True)
+    seq = Column(Integer, nullable=False, default=0) # Counter before sync_sequence, no longer written
+    pruned_seq = Column(Integer, nullable=False, default=0) # Tombstones up to here were dropped
+
+class SyncSequence(Base):
+    """A change sequence number handed out to a writing transaction, see sync.py."""
+    __tablename__ = "sync_sequence"
+    __table_args__ = (
+        # The in-progress lookup of sync._watermark; SQLite doesn't store xids
+        Index("ix_sync_sequence_xid", "xid").ddl_if(dialect="postgresql"),
+        # Never reuse the numbers of pruned rows
+        {"sqlite_autoincrement": True},
+    )
+
+    seq = Column(Integer, primary_key=True, autoincrement=True) # SERIAL, i.e. nextval(), on Postgres
+    takenAt = Column(DateTime, nullable=False)
+    xid = Column(BigInteger, nullable=True) # Taking transaction's pg_current_xact_id(), Postgres only
+
+class Lease(Base):
+    """Named lease so only one process runs a background task at a time, see archive.py."""
+    __tablename__ = "leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=True)
+    expiresAt = Column(DateTime, nullable=False)
+
+class Tombstone(Base):
+    """A deleted row, kept so /sync can tell clients to drop it."""
+    __tablename__ = "tombstones"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    entity = Column(String, nullable=False) # Key of sync.ENTITIES, e.g. 'jobs'
+    entityId = Column(String, nullable=False)
+    seq = Column(Integer, nullable=False, index=True)
+    deletedAt = Column(DateTime, nullable=False)
+
+
+def _archive_columns(table):
+    # Same columns as the live table, minus foreign keys: the archive may sit
+    # in another database file (see database.ARCHIVE_DATABASE_PATH)
+    return [Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable) for c in table.columns]
+
+class ArchivedJobRequest(Base):
+    """Finished job moved out of job_requests by archive.py; read-only."""
+    __table__ = Table(
+        "job_requests_archive", Base.metadata,
+        *_archive_columns(JobRequest.__table__),
+        Column("archivedAt", DateTime, nullable=False),
+        # A user's history, same shape as the live indexes
+        Index("ix_job_requests_archive_client_created", "clientId", "createdAt", "id"),
+        Index("ix_job_requests_archive_provider_created", "providerId", "createdAt", "id"),
+        schema=ARCHIVE_SCHEMA,
+    )
+
+class ArchivedJobCandidate(Base):
+    __table__ = Table(
+        "job_candidates_archive", Base.metadata,
+        *_archive_columns(JobCandidate.__table__),
+        Index("ix_job_candidates_archive_providerId", "providerId"),
+        schema=ARCHIVE_SCHEMA,
+    )
+
+
+@event.listens_for(User, "before_insert")
+@event.listens_for(User, "before_update")
+@event.listens_for(JobRequest, "before_insert")
+@event.listens_for(JobRequest, "before_update")
+def _sync_geohash(mapper, connection, target):
+    target.geohash = geo.encode(target.latitude, target.longitude)
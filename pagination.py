@@ -0,0 +1,95 @@
+import base64
+import datetime
+import json
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+# Keyset (cursor) pagination helpers. A cursor is an opaque, URL-safe token
+# holding the sort key of the last row of the previous page; the next page is
+# fetched with a range condition on that key instead of OFFSET, so every page
+# is an index seek no matter how deep the client scrolls.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class HeaderSink:
+    """Stand-in for a Response when the page is serialized elsewhere (e.g. cached)."""
+
+    def __init__(self):
+        self.headers = {}
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(*values):
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _matches(value, column):
+    try:
+        expected = column.type.python_type
+    except NotImplementedError:
+        return True
+    if expected is float:
+        return type(value) in (int, float)
+    # Exact, so a bool doesn't pass for an int
+    return type(value) is expected
+
+
+def decode_cursor(cursor, size, columns=None):
+    """The ``size`` sort key values in ``cursor``; 400 unless they fit ``columns``' types."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError("wrong cursor size")
+        values = [_decode_value(v) for v in values]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if columns is not None and not all(_matches(v, c) for v, c in zip(values, columns)):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def after_cursor(columns, values, descending=False):
+    """Condition selecting rows strictly after ``values`` in ``columns`` order.
+
+    Expanded into ``(a > x) OR (a = x AND b > y) ...`` rather than a row-value
+    comparison so it works on every backend we run on.
+    """
+    clauses = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        step = column < value if descending else column > value
+        equal = [c == v for c, v in zip(columns[:i], values[:i])]
+        clauses.append(and_(*equal, step) if equal else step)
+    return or_(*clauses)
+
+
+def paginate(query, columns, cursor, limit, response, descending=False):
+    """Apply keyset pagination to ``query`` ordered by ``columns``.
+
+    Returns the page rows and sets the next cursor header on ``response``
+    when more rows are available.
+    """
+    if cursor:
+        query = query.filter(after_cursor(columns, decode_cursor(cursor, len(columns), columns), descending))
+    order = [c.desc() for c in columns] if descending else list(columns)
+    rows = query.order_by(*order).limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(*[getattr(last, c.key) for c in columns])
+    return rows
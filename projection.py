@@ -0,0 +1,59 @@
+from functools import lru_cache
+from typing import List
+from fastapi import HTTPException, Response
+from pydantic import ConfigDict, TypeAdapter, create_model
+
+# Sparse fieldsets for list endpoints: ``?fields=id,name,rating`` returns just
+# those keys per item. Only the requested attributes are read from the ORM
+# rows, so callers can also skip eager-loading relationships nobody asked for.
+
+
+def parse_fields(fields, schema):
+    """Turn a comma separated ``fields`` parameter into a frozenset, or None."""
+    if not fields:
+        return None
+    selected = frozenset(f.strip() for f in fields.split(",") if f.strip())
+    unknown = selected - set(schema.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return selected or None
+
+
+def wants(fields, name):
+    """Whether ``name`` is part of the response (all fields when not projecting)."""
+    return fields is None or name in fields
+
+
+@lru_cache(maxsize=128)
+def _list_adapter(schema, fields):
+    if fields is None:
+        return TypeAdapter(List[schema])
+    definitions = {
+        name: (schema.model_fields[name].annotation, schema.model_fields[name])
+        for name in schema.model_fields if name in fields
+    }
+    projected = create_model(
+        f"{schema.__name__}Projection",
+        __config__=ConfigDict(from_attributes=True),
+        **definitions
+    )
+    return TypeAdapter(List[projected])
+
+
+def dump(rows, schema, fields=None):
+    """JSON bytes for ``rows`` as a list of ``schema`` (optionally projected)."""
+    adapter = _list_adapter(schema, fields)
+    return adapter.dump_json(adapter.validate_python(rows, from_attributes=True))
+
+
+def project(rows, schema, fields, response=None):
+    """Serialize ``rows`` keeping only ``fields`` of ``schema``.
+
+    Headers already set on ``response`` (e.g. the next page cursor) are
+    carried over, since returning a Response bypasses FastAPI's merging.
+    """
+    body = dump(rows, schema, fields)
+    headers = dict(response.headers) if response is not None else None
+    if headers:
+        headers.pop("content-length", None)
+    return Response(content=body, media_type="application/json", headers=headers)
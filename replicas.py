@@ -0,0 +1,295 @@
+import contextvars
+import functools
+import itertools
+import logging
+import os
+import threading
+import time
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import event, exc, text
+from sqlalchemy.orm import Session, sessionmaker
+import cache
+import database
+
+# Read/write splitting over read replicas.
+#
+# Routes that only read take their session from ``get_read_db`` and are
+# wrapped in ``read_handler`` instead of ``database.db_handler``. Everything
+# else keeps using the primary through ``get_db``. Reads go round-robin to
+# the healthy replicas in DATABASE_REPLICA_URLS (comma separated, same URL
+# format as DATABASE_URL); with none configured they simply use the primary.
+#
+# Read-your-writes: when a request commits a write, its client (the token's
+# user, or without a token the READ_YOUR_WRITES_COOKIE session cookie) reads
+# from the primary for the next READ_YOUR_WRITES_SECONDS, so replication lag
+# never hides the change from whoever made it. Requests with neither aren't
+# pinned: an address can be shared by a whole office behind NAT or a proxy. The marker lives in the cache backend, so with
+# CACHE_BACKEND=redis it holds across workers.
+#
+# Health: every REPLICA_HEALTH_INTERVAL seconds, in a background thread, each
+# replica must answer, have applied the primary's latest migration, and on
+# Postgres replay no more than REPLICA_MAX_LAG_SECONDS behind. A replica
+# failing that, or raising a connection error mid-request, stops receiving
+# reads until a later check passes; the failed request is retried once on
+# the primary.
+#
+# Locally, copies of the SQLite file stand in for replicas, opened read-only
+# so a stray write fails loudly (copy after a checkpoint, so the WAL is in):
+#
+#   sqlite3 truber.db "PRAGMA wal_checkpoint(TRUNCATE)" && cp truber.db /tmp/replica1.db
+#   DATABASE_REPLICA_URLS="sqlite:///file:/tmp/replica1.db?mode=ro&uri=true" uvicorn main:app
+
+REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+READ_YOUR_WRITES_SECONDS = int(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+SESSION_COOKIE = os.getenv("READ_YOUR_WRITES_COOKIE", "session_id")
+HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "5"))
+MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "10"))
+
+logger = logging.getLogger(__name__)
+
+
+def is_connection_error(e):
+    """Whether ``e`` says the replica itself is unreachable.
+
+    Only connection-level failures count: the dialect's disconnect codes and
+    failures to connect at all (see ``_connect_failure_is_disconnect``). A
+    statement timeout or a bad query is the query's problem, not the
+    replica's, and must not take a healthy replica out of rotation.
+    """
+    return isinstance(e, exc.DBAPIError) and e.connection_invalidated
+
+
+def _connect_failure_is_disconnect(context):
+    # No connection yet means connecting failed; treat it like a dropped one
+    if context.connection is None:
+        context.is_disconnect = True
+
+_LATEST_VERSION = "SELECT max(version) FROM schema_migrations"
+_PG_LAG = (
+    "SELECT CASE WHEN pg_is_in_recovery() "
+    "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) ELSE 0 END"
+)
+
+
+class Replica:
+    def __init__(self, url):
+        self.url = url
+        self.engine = database.make_engine(url)
+        event.listen(self.engine, "handle_error", _connect_failure_is_disconnect)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.async_engine = None
+        self.AsyncSessionLocal = None
+        if database.ASYNC_DB:
+            from sqlalchemy.ext.asyncio import async_sessionmaker
+
+            self.async_engine = database.make_async_engine(url)
+            event.listen(self.async_engine.sync_engine, "handle_error", _connect_failure_is_disconnect)
+            self.AsyncSessionLocal = async_sessionmaker(self.async_engine, autoflush=False, expire_on_commit=False)
+        self.healthy = True
+        self.error = None
+        self.lag_seconds = None
+
+    @property
+    def name(self):
+        return self.engine.url.render_as_string(hide_password=True)
+
+    def check(self, primary_version):
+        """Probe the replica and update ``healthy``."""
+        try:
+            with self.engine.connect() as conn:
+                version = conn.execute(text(_LATEST_VERSION)).scalar()
+                lag = conn.execute(text(_PG_LAG)).scalar() if self.engine.dialect.name == "postgresql" else None
+        except exc.DBAPIError as e:
+            self.mark_down(f"unreachable: {e.orig}")
+            return
+        self.lag_seconds = float(lag) if lag is not None else None
+        if primary_version is not None and (version is None or version < primary_version):
+            self.mark_down(f"schema at migration {version}, primary at {primary_version}")
+        elif self.lag_seconds is not None and self.lag_seconds > MAX_LAG_SECONDS:
+            self.mark_down(f"{self.lag_seconds:.1f}s behind the primary")
+        else:
+            if not self.healthy:
+                logger.info("Replica %s is back in rotation", self.name)
+            self.healthy, self.error = True, None
+
+    def mark_down(self, reason):
+        if self.healthy:
+            logger.warning("Replica %s taken out of rotation: %s", self.name, reason)
+        self.healthy, self.error = False, str(reason)
+
+    def status(self):
+        return {"url": self.name, "healthy": self.healthy, "error": self.error, "lag_seconds": self.lag_seconds}
+
+
+replicas = [Replica(url) for url in REPLICA_URLS]
+_round_robin = itertools.count()
+_checked_at = 0.0
+_check_lock = threading.Lock()
+
+
+def _check_in_background():
+    global _checked_at
+    if not _check_lock.acquire(blocking=False):
+        return  # already checking
+    _checked_at = time.monotonic()
+
+    def run():
+        try:
+            try:
+                with database.engine.connect() as conn:
+                    primary_version = conn.execute(text(_LATEST_VERSION)).scalar()
+            except exc.DBAPIError:
+                primary_version = None  # judge the replicas on reachability alone
+            for replica in replicas:
+                replica.check(primary_version)
+        except Exception:
+            logger.exception("Checking the read replicas failed")
+        finally:
+            _check_lock.release()
+
+    threading.Thread(target=run, name="replica-health", daemon=True).start()
+
+
+def choose():
+    """A healthy replica, or None to read from the primary."""
+    if not replicas:
+        return None
+    if time.monotonic() - _checked_at >= HEALTH_INTERVAL:
+        _check_in_background()
+    healthy = [replica for replica in replicas if replica.healthy]
+    if not healthy:
+        return None
+    return healthy[next(_round_robin) % len(healthy)]
+
+
+def status():
+    return [replica.status() for replica in replicas]
+
+
+# --- read-your-writes -------------------------------------------------------
+
+_client = contextvars.ContextVar("replica_client", default=None)
+
+
+def _sticky_key(client):
+    return f"read-primary:{client}"
+
+
+async def track_client(request: Request):
+    """App-wide dependency naming the client, for read-your-writes.
+
+    Runs after ``auth.authenticate`` so the token's user is known.
+    """
+    user = getattr(request.state, "user", None)
+    session_id = request.cookies.get(SESSION_COOKIE)
+    if user:
+        client = f"user:{user['sub']}"
+    elif session_id:
+        client = f"session:{session_id}"
+    else:
+        client = None
+    _client.set(client)
+
+
+def wrote_recently():
+    client = _client.get()
+    return client is not None and cache.backend.get(_sticky_key(client)) is not None
+
+
+def _note_write():
+    client = _client.get()
+    if client is not None and replicas:
+        # Any value does; CachedResponse is what every backend can store
+        cache.backend.set(_sticky_key(client), cache.CachedResponse(b""), READ_YOUR_WRITES_SECONDS)
+
+
+@event.listens_for(Session, "after_flush")
+def _flag_write(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _flag_statement_write(orm_execute_state):
+    # Bulk and Core statements run through Session.execute skip the flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _stick_to_primary(session):
+    if session.info.pop("wrote", False):
+        _note_write()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_write(session, previous_transaction):
+    session.info.pop("wrote", None)
+
+
+@event.listens_for(Session, "before_flush")
+def _refuse_replica_writes(session, flush_context, instances):
+    if session.info.get("replica") is not None and (session.new or session.dirty or session.deleted):
+        raise RuntimeError("Read-only route tried to write through a replica session")
+
+
+# --- sessions ---------------------------------------------------------------
+
+def _read_target():
+    return None if wrote_recently() else choose()
+
+
+def get_read_db():
+    replica = _read_target()
+    db = replica.SessionLocal() if replica else database.SessionLocal()
+    db.info["replica"] = replica
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db():
+    replica = _read_target()
+    async with (replica.AsyncSessionLocal() if replica else database.AsyncSessionLocal()) as db:
+        db.info["replica"] = replica
+        yield db
+
+
+if database.ASYNC_DB:
+    get_read_db = get_async_read_db
+
+
+def _primary_session():
+    return database.AsyncSessionLocal() if database.ASYNC_DB else database.SessionLocal()
+
+
+async def _close(db):
+    if database.ASYNC_DB:
+        await db.close()
+    else:
+        await run_in_threadpool(db.close)
+
+
+def read_handler(fn):
+    """``database.db_handler`` for read-only routes taking ``db = Depends(get_read_db)``.
+
+    When the replica fails with a connection-level error, it is taken out of
+    rotation and the handler runs again on the primary.
+    """
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        db = kwargs.pop("db")
+        replica = db.info.get("replica")
+        try:
+            return await database.run_db(db, fn, *args, **kwargs)
+        except exc.DBAPIError as e:
+            if replica is None or not is_connection_error(e):
+                raise
+            replica.mark_down(e.orig)
+        primary = _primary_session()
+        try:
+            return await database.run_db(primary, fn, *args, **kwargs)
+        finally:
+            await _close(primary)
+    return wrapper
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional, Dict
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Literal, Optional, Dict
 from datetime import datetime
 
 class BadgeBase(BaseModel):
@@ -40,6 +40,12 @@ class ReviewBase(BaseModel):
     class Config:
         from_attributes = True
 
+class ReviewCreate(BaseModel):
+    userId: str
+    userName: str
+    comment: str
+    rating: float = Field(..., ge=1, le=5)
+
 class UserBase(BaseModel):
     id: str
     name: str
@@ -64,6 +70,11 @@ class ProviderUpdate(BaseModel):
 class PortfolioUpdate(BaseModel):
     portfolio: List[PortfolioBase]
 
+class PortfolioPatch(BaseModel):
+    imageUrl: Optional[str] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+
 class UserAuth(BaseModel):
     email: str
     password: str
@@ -72,7 +83,7 @@ class UserCreate(UserAuth):
     name: str
     role: str = "client"
 
-class UserProfile(UserBase):
+class UserDetails(UserBase):
     phone: Optional[str] = None
     about: Optional[str] = None
     type: Optional[str] = None
@@ -82,9 +93,19 @@ class UserProfile(UserBase):
     longitude: Optional[float] = None
     hourly_rate: Optional[Dict[str, int]] = None
     badges: List[BadgeBase] = []
+
+class UserProfile(UserDetails):
     portfolio: List[PortfolioBase] = []
     reviews: List[ReviewBase] = []
 
+class LoginResponse(UserProfile):
+    access_token: str
+    token_type: str = "bearer"
+    expires_in: int
+
+class NearbyProvider(UserProfile):
+    distance_km: float
+
 class JobRequestBase(BaseModel):
     id: Optional[str] = None
     clientId: str
@@ -123,8 +144,43 @@ class JobRequestCreate(BaseModel):
 class JobRequestResponse(JobRequestBase):
     client: Optional[UserBase] = None
     provider: Optional[UserBase] = None
+    distance_km: Optional[float] = None  # Only set by geo queries
+
+class JobBatchOperation(BaseModel):
+    job_id: str
+    # Same as PUT /job-requests/{job_id}/status, /assign and /accept
+    action: Literal["status", "assign", "accept"]
+    status: Optional[str] = None
+    provider_id: Optional[str] = None
+
+class JobBatchUpdate(BaseModel):
+    operations: List[JobBatchOperation] = Field(..., min_length=1, max_length=100)  # loaders.MAX_BATCH
+    # All or nothing: when any operation fails, none is applied
+    atomic: bool = False
+
+class JobBatchResult(BaseModel):
+    job_id: str
+    action: str
+    status_code: int
+    detail: str
 
 class ProposalUpdate(BaseModel):
     milestones: List[dict]
     budget_final: float
     proposal_status: str
+
+class SyncPortfolioItem(PortfolioBase):
+    providerId: str
+
+class SyncResponse(BaseModel):
+    # Pass as ?since= next time; ask again straight away while more is set
+    token: str
+    more: bool
+    jobs: List[JobRequestResponse] = []
+    # Portfolio and reviews come separately (portfolio) or from /providers/{id}
+    users: List[UserDetails] = []
+    portfolio: List[SyncPortfolioItem] = []
+    services: List[ServiceBase] = []
+    badges: List[BadgeBase] = []
+    # Ids removed since the token, by entity; apply before the rows above
+    deleted: Dict[str, List[str]] = {}
@@ -0,0 +1,364 @@
+import hashlib
+import re
+import sys
+import unicodedata
+from abc import ABC, abstractmethod
+from fastapi import HTTPException
+from sqlalchemy import bindparam, event, inspect, text
+from sqlalchemy.orm import Session
+import models
+
+# Full-text search over job requests (title, description) and providers
+# (name, about, portfolio titles and descriptions).
+#
+# Each dialect keeps its own inverted index next to the base tables, behind
+# the same small interface:
+#   - SQLite: FTS5 tables (unicode61 tokenizer with diacritics removed) holding
+#     the entity id, keyed by a hash of it, ranked by bm25
+#   - Postgres: tsvector columns in side tables with a GIN index, built with
+#     the 'spanish' configuration from accent-folded text, ranked by ts_rank_cd
+#
+# The index follows ORM writes through session hooks, in the same
+# transaction. Bulk statements that bypass the unit of work (portfolio diffs,
+# the seed loaders) call index_providers() / rebuild() themselves.
+#
+#   python search.py rebuild    # recreate and refill the index
+
+JOB_WEIGHTS = (4.0, 1.0)  # title, description
+PROVIDER_WEIGHTS = (4.0, 2.0, 1.0)  # name, about, portfolio
+
+_TOKEN = re.compile(r"\w+")
+
+
+def fold(value):
+    """Lowercase and strip accents, so 'Fontanería' matches 'fontaneria'."""
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def terms(q):
+    return _TOKEN.findall(fold(q))
+
+
+class SearchBackend(ABC):
+    """Interface for the dialect specific indexes."""
+
+    @abstractmethod
+    def create(self, connection):
+        ...
+
+    @abstractmethod
+    def clear(self, connection):
+        ...
+
+    @abstractmethod
+    def drop(self, connection):
+        ...
+
+    @abstractmethod
+    def index_jobs(self, connection, job_ids=None):
+        """(Re)index the given jobs, or every job when ``job_ids`` is None."""
+
+    @abstractmethod
+    def remove_jobs(self, connection, job_ids):
+        """Drop jobs from the index; called before their rows are deleted."""
+
+    @abstractmethod
+    def index_providers(self, connection, provider_ids=None):
+        ...
+
+    @abstractmethod
+    def search_jobs(self, connection, words, type=None, limit=20, offset=0):
+        """[(job_id, score)] of open, pending jobs, best match first."""
+
+    @abstractmethod
+    def search_providers(self, connection, words, type=None, limit=20, offset=0):
+        ...
+
+
+def _in_ids(column, ids):
+    """``column IN :ids`` fragment and its params, or an always-true one for None."""
+    if ids is None:
+        return "1 = 1", {}
+    return f"{column} IN :ids", {"ids": list(ids)}
+
+
+def _expanding(statement, params):
+    stmt = text(statement)
+    if "ids" in params:
+        stmt = stmt.bindparams(bindparam("ids", expanding=True))
+    return stmt
+
+
+class SQLiteSearch(SearchBackend):
+    # FTS5 rows need an integer rowid. The rowids of job_requests/users can't
+    # serve: those tables have string keys, so VACUUM may renumber them. The
+    # rowid here is a hash of the entity id instead, which never moves and
+    # lets a row be replaced or removed by rowid lookup; the id itself is
+    # stored (UNINDEXED) and searches join on it.
+
+    def create(self, connection):
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_jobs USING fts5("
+            "id UNINDEXED, title, description, tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_providers USING fts5("
+            "id UNINDEXED, name, about, portfolio, tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+
+    def clear(self, connection):
+        connection.execute(text("DELETE FROM search_jobs"))
+        connection.execute(text("DELETE FROM search_providers"))
+
+    def drop(self, connection):
+        connection.execute(text("DROP TABLE IF EXISTS search_jobs"))
+        connection.execute(text("DROP TABLE IF EXISTS search_providers"))
+
+    @staticmethod
+    def _key(entity_id):
+        return int.from_bytes(hashlib.blake2b(entity_id.encode(), digest_size=8).digest(), "big") >> 1
+
+    def _upsert(self, connection, table, columns, rows):
+        if not rows:
+            return
+        names = ", ".join(columns)
+        values = ", ".join(f":{c}" for c in columns)
+        connection.execute(text(f"INSERT OR REPLACE INTO {table} (rowid, id, {names}) VALUES (:key, :id, {values})"), [
+            {"key": self._key(row[0]), "id": row[0], **dict(zip(columns, row[1:]))} for row in rows
+        ])
+
+    def index_jobs(self, connection, job_ids=None):
+        where, params = _in_ids("id", job_ids)
+        rows = connection.execute(_expanding(
+            f"SELECT id, coalesce(title, ''), coalesce(description, '') FROM job_requests WHERE {where}", params
+        ), params).all()
+        self._upsert(connection, "search_jobs", ("title", "description"), rows)
+
+    def remove_jobs(self, connection, job_ids):
+        params = {"keys": [self._key(job_id) for job_id in job_ids]}
+        connection.execute(
+            text("DELETE FROM search_jobs WHERE rowid IN :keys").bindparams(bindparam("keys", expanding=True)),
+            params
+        )
+
+    def index_providers(self, connection, provider_ids=None):
+        where, params = _in_ids("u.id", provider_ids)
+        rows = connection.execute(_expanding(
+            "SELECT u.id, coalesce(u.name, ''), coalesce(u.about, ''), "
+            "coalesce((SELECT group_concat(coalesce(p.title, '') || ' ' || coalesce(p.description, ''), ' ') "
+            "FROM portfolio p WHERE p.\"providerId\" = u.id), '') "
+            f"FROM users u WHERE u.role = 'provider' AND {where}",
+            params
+        ), params).all()
+        self._upsert(connection, "search_providers", ("name", "about", "portfolio"), rows)
+
+    @staticmethod
+    def _match(words):
+        return " ".join(f'"{w}"*' for w in words)
+
+    def search_jobs(self, connection, words, type=None, limit=20, offset=0):
+        type_filter = "AND j.type = :type" if type else ""
+        rows = connection.execute(text(
+            f"SELECT j.id, bm25(search_jobs, {JOB_WEIGHTS[0]}, {JOB_WEIGHTS[1]}) AS score "
+            "FROM search_jobs JOIN job_requests j ON j.id = search_jobs.id "
+            "WHERE search_jobs MATCH :match AND j.request_type = 'open' AND j.status = 'pending' "
+            f"{type_filter} ORDER BY score, j.id LIMIT :limit OFFSET :offset"
+        ), {"match": self._match(words), "type": type, "limit": limit, "offset": offset}).all()
+        # bm25 is "lower is better"; flip it so higher scores rank first everywhere
+        return [(job_id, -score) for job_id, score in rows]
+
+    def search_providers(self, connection, words, type=None, limit=20, offset=0):
+        type_filter = "AND u.type = :type" if type else ""
+        weights = ", ".join(str(w) for w in PROVIDER_WEIGHTS)
+        rows = connection.execute(text(
+            f"SELECT u.id, bm25(search_providers, {weights}) AS score "
+            "FROM search_providers JOIN users u ON u.id = search_providers.id "
+            f"WHERE search_providers MATCH :match AND u.role = 'provider' {type_filter} "
+            "ORDER BY score, u.id LIMIT :limit OFFSET :offset"
+        ), {"match": self._match(words), "type": type, "limit": limit, "offset": offset}).all()
+        return [(user_id, -score) for user_id, score in rows]
+
+
+class PostgresSearch(SearchBackend):
+    CONFIG = "spanish"
+
+    def create(self, connection):
+        connection.execute(text("CREATE TABLE IF NOT EXISTS search_jobs (id VARCHAR PRIMARY KEY, document TSVECTOR)"))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_search_jobs_document ON search_jobs USING GIN (document)"))
+        connection.execute(text("CREATE TABLE IF NOT EXISTS search_providers (id VARCHAR PRIMARY KEY, document TSVECTOR)"))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_search_providers_document ON search_providers USING GIN (document)"
+        ))
+
+    def clear(self, connection):
+        connection.execute(text("TRUNCATE search_jobs, search_providers"))
+
+    def drop(self, connection):
+        connection.execute(text("DROP TABLE IF EXISTS search_jobs, search_providers"))
+
+    def _upsert(self, connection, table, rows, weights="AB"):
+        # Accents are folded here rather than with the unaccent extension,
+        # which needs superuser rights to install
+        if not rows:
+            return
+        parts = " || ".join(
+            f"setweight(to_tsvector('{self.CONFIG}', :f{i}), '{weight}')" for i, weight in enumerate(weights)
+        )
+        connection.execute(text(
+            f"INSERT INTO {table} (id, document) VALUES (:id, {parts}) "
+            "ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document"
+        ), [{"id": row[0], **{f"f{i}": fold(v) for i, v in enumerate(row[1:])}} for row in rows])
+
+    def index_jobs(self, connection, job_ids=None):
+        where, params = _in_ids("id", job_ids)
+        rows = connection.execute(_expanding(
+            f"SELECT id, title, description FROM job_requests WHERE {where}", params
+        ), params).all()
+        self._upsert(connection, "search_jobs", rows)
+
+    def remove_jobs(self, connection, job_ids):
+        params = {"ids": list(job_ids)}
+        connection.execute(_expanding("DELETE FROM search_jobs WHERE id IN :ids", params), params)
+
+    def index_providers(self, connection, provider_ids=None):
+        where, params = _in_ids("u.id", provider_ids)
+        rows = connection.execute(_expanding(
+            "SELECT u.id, u.name, u.about, "
+            "(SELECT string_agg(coalesce(p.title, '') || ' ' || coalesce(p.description, ''), ' ') "
+            "FROM portfolio p WHERE p.\"providerId\" = u.id) "
+            f"FROM users u WHERE u.role = 'provider' AND {where}",
+            params
+        ), params).all()
+        self._upsert(connection, "search_providers", rows, "ABC")
+
+    def _query(self, words):
+        return " & ".join(f"{w}:*" for w in words)
+
+    def search_jobs(self, connection, words, type=None, limit=20, offset=0):
+        type_filter = "AND j.type = :type" if type else ""
+        return [tuple(r) for r in connection.execute(text(
+            f"SELECT j.id, ts_rank_cd(s.document, q) AS score "
+            f"FROM search_jobs s JOIN job_requests j ON j.id = s.id, to_tsquery('{self.CONFIG}', :query) q "
+            "WHERE s.document @@ q AND j.request_type = 'open' AND j.status = 'pending' "
+            f"{type_filter} ORDER BY score DESC, j.id LIMIT :limit OFFSET :offset"
+        ), {"query": self._query(words), "type": type, "limit": limit, "offset": offset})]
+
+    def search_providers(self, connection, words, type=None, limit=20, offset=0):
+        type_filter = "AND u.type = :type" if type else ""
+        return [tuple(r) for r in connection.execute(text(
+            f"SELECT u.id, ts_rank_cd(s.document, q) AS score "
+            f"FROM search_providers s JOIN users u ON u.id = s.id, to_tsquery('{self.CONFIG}', :query) q "
+            f"WHERE s.document @@ q AND u.role = 'provider' {type_filter} "
+            "ORDER BY score DESC, u.id LIMIT :limit OFFSET :offset"
+        ), {"query": self._query(words), "type": type, "limit": limit, "offset": offset})]
+
+
+_BACKENDS = {"sqlite": SQLiteSearch(), "postgresql": PostgresSearch()}
+
+
+def backend_for(connection):
+    """The search backend for this connection's dialect, or None if unsupported."""
+    return _BACKENDS.get(connection.dialect.name)
+
+
+def refill(connection):
+    """Create the index if needed and reindex everything; False if unsupported."""
+    backend = backend_for(connection)
+    if backend is None:
+        return False
+    backend.create(connection)
+    backend.clear(connection)
+    backend.index_jobs(connection)
+    backend.index_providers(connection)
+    return True
+
+
+def rebuild(engine):
+    with engine.begin() as conn:
+        return refill(conn)
+
+
+def drop(connection):
+    backend = backend_for(connection)
+    if backend is not None:
+        backend.drop(connection)
+
+
+def search(db, kind, q, type=None, limit=20, offset=0):
+    """Ranked [(id, score)] for ``kind`` ('jobs' or 'providers')."""
+    words = terms(q)
+    if not words:
+        raise HTTPException(status_code=400, detail="Search needs at least one word")
+    connection = db.connection()
+    backend = backend_for(connection)
+    if backend is None:
+        raise HTTPException(status_code=501, detail="Search is not available on this database")
+    find = backend.search_jobs if kind == "jobs" else backend.search_providers
+    return find(connection, words, type, limit, offset)
+
+
+def index_providers(db, provider_ids):
+    """Reindex providers after writes that bypassed the session hooks."""
+    connection = db.connection()
+    backend = backend_for(connection)
+    if backend is not None and provider_ids:
+        backend.index_providers(connection, provider_ids)
+
+
+def _changed(obj, *attrs):
+    state = inspect(obj)
+    return any(state.attrs[a].history.has_changes() for a in attrs)
+
+
+@event.listens_for(Session, "before_flush")
+def _unindex_deleted(session, flush_context, instances):
+    job_ids = [obj.id for obj in session.deleted if isinstance(obj, models.JobRequest)]
+    if job_ids:
+        connection = session.connection()
+        backend = backend_for(connection)
+        if backend is not None:
+            backend.remove_jobs(connection, job_ids)
+
+
+@event.listens_for(Session, "after_flush")
+def _index_changes(session, flush_context):
+    job_ids, provider_ids = set(), set()
+    for obj in session.new:
+        if isinstance(obj, models.JobRequest):
+            job_ids.add(obj.id)
+        elif isinstance(obj, models.User) and obj.role == "provider":
+            provider_ids.add(obj.id)
+        elif isinstance(obj, models.PortfolioItem) and obj.providerId:
+            provider_ids.add(obj.providerId)
+    for obj in session.dirty:
+        if isinstance(obj, models.JobRequest) and _changed(obj, "title", "description"):
+            job_ids.add(obj.id)
+        elif isinstance(obj, models.User) and obj.role == "provider" and _changed(obj, "name", "about", "role"):
+            provider_ids.add(obj.id)
+        elif isinstance(obj, models.PortfolioItem) and _changed(obj, "title", "description", "providerId"):
+            provider_ids.update(p for p in inspect(obj).attrs["providerId"].history.sum() if p)
+    for obj in session.deleted:
+        if isinstance(obj, models.PortfolioItem) and obj.providerId:
+            provider_ids.add(obj.providerId)
+    if not (job_ids or provider_ids):
+        return
+    connection = session.connection()
+    backend = backend_for(connection)
+    if backend is None:
+        return
+    if job_ids:
+        backend.index_jobs(connection, job_ids)
+    if provider_ids:
+        backend.index_providers(connection, provider_ids)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("usage: python search.py rebuild")
+        sys.exit(1)
+    from database import engine
+    if rebuild(engine):
+        print("Search index rebuilt")
+    else:
+        print(f"Full-text search is not supported on {engine.dialect.name}")
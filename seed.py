@@ -1,23 +1,71 @@
+import itertools
 import json
 import os
-from sqlalchemy.orm import Session
+import sys
+from collections import defaultdict
+from sqlalchemy import select
 from database import SessionLocal, engine
+import auth
+import geo
+import migrations
 import models
+import search
+import stats
+import sync
 from datetime import datetime
 
 # Path to the data directory local to this backend
 DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "data"))
 
+# Rows per INSERT executemany; each batch commits on its own
+BATCH_SIZE = 5000
+
 def load_json(filename):
     with open(os.path.join(DATA_DIR, filename), 'r', encoding='utf-8') as f:
         return json.load(f)
 
-def seed_db():
-    # Create tables
-    models.Base.metadata.drop_all(bind=engine)
-    models.Base.metadata.create_all(bind=engine)
-    
-    db = SessionLocal()
+def insert_batches(table, rows, batch_size=BATCH_SIZE):
+    """Stream ``rows`` (an iterable of dicts) into ``table`` with Core executemany.
+
+    Bypasses the ORM, so nothing here fires the geohash or provider_stats
+    listeners: callers fill ``geohash`` themselves and refresh the stats.
+    Returns the number of rows inserted.
+    """
+    rows = iter(rows)
+    total = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return total
+        with engine.begin() as conn:
+            conn.execute(table.insert(), batch)
+        total += len(batch)
+
+def existing_ids(table, column="id"):
+    with engine.connect() as conn:
+        return set(conn.execute(select(table.c[column])).scalars())
+
+def _parse_date(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else datetime.utcnow()
+
+def seed_db(incremental=False):
+    """Load the fixtures in data/.
+
+    By default every table is dropped and the schema rebuilt by the
+    migrations first. With
+    ``incremental=True`` existing tables and rows are kept and only fixture
+    rows whose ids are not in the database yet are inserted.
+    """
+    if not incremental:
+        migrations.drop_all(engine)
+    migrations.upgrade(engine)
+
+    def missing(table, rows, key="id"):
+        if not incremental:
+            return rows
+        present = existing_ids(table, key)
+        return [r for r in rows if r[key] not in present]
+
     try:
         # Load data
         users_data = load_json('users.json')
@@ -28,89 +76,84 @@ def seed_db():
         services_data = load_json('services.json')
 
         # 1. Seed Services
-        for s in services_data:
-            service = models.Service(
-                id=s['id'],
-                name=s['name'],
-                slug=s['slug'],
-                icon=s['icon'],
-                description=s.get('description')
-            )
-            db.add(service)
-        db.commit()
+        insert_batches(models.Service.__table__, missing(models.Service.__table__, [{
+            "id": s['id'],
+            "name": s['name'],
+            "slug": s['slug'],
+            "icon": s['icon'],
+            "description": s.get('description')
+        } for s in services_data]))
 
         # 2. Seed Badges
-        badge_objs = {}
-        for b in badges_data:
-            badge = models.Badge(id=b['id'], name=b['name'], icon=b['icon'])
-            db.add(badge)
-            badge_objs[b['id']] = badge
-        db.commit()
+        insert_batches(models.Badge.__table__, missing(models.Badge.__table__, [
+            {"id": b['id'], "name": b['name'], "icon": b['icon']} for b in badges_data
+        ]))
 
         # 3. Seed Users
-        user_objs = {}
-        for u in users_data:
-            createdAt = datetime.fromisoformat(u['createdAt'].replace('Z', '+00:00')) if 'createdAt' in u else datetime.utcnow()
-            user = models.User(
-                id=u['id'],
-                name=u['name'],
-                email=u['email'],
-                password=u.get('password', '1234'), # Use actual password or mock
-                role=u['role'],
-                image=u.get('image'),
-                createdAt=createdAt,
-                type=u.get('type'),
-                rating=u.get('rating', 0.0),
-                jobs=u.get('jobs', 0),
-                latitude=u.get('latitude'),
-                longitude=u.get('longitude'),
-                about=u.get('about'),
-                hourly_rate=u.get('hourly_rate'),
-                location_name=u.get('location_name'),
-                phone=u.get('phone', '+58 424 0000000')
-            )
-            
-            # Link badges
-            ub_ids = [ub['badgeId'] for ub in user_badges_data if ub['userId'] == u['id']]
-            for b_id in ub_ids:
-                if b_id in badge_objs:
-                    user.badges.append(badge_objs[b_id])
-            
-            db.add(user)
-            user_objs[u['id']] = user
-        db.commit()
+        new_users = missing(models.User.__table__, [{
+            "id": u['id'],
+            "name": u['name'],
+            "email": u['email'],
+            "password": auth.fixture_hash(u.get('password', '1234')),
+            "role": u['role'],
+            "image": u.get('image'),
+            "createdAt": _parse_date(u.get('createdAt')),
+            "type": u.get('type'),
+            "rating": u.get('rating', 0.0),
+            "jobs": u.get('jobs', 0),
+            "latitude": u.get('latitude'),
+            "longitude": u.get('longitude'),
+            "geohash": geo.encode(u['latitude'], u['longitude']) if u.get('latitude') is not None and u.get('longitude') is not None else None,
+            "about": u.get('about'),
+            "hourly_rate": u.get('hourly_rate'),
+            "location_name": u.get('location_name'),
+            "phone": u.get('phone', '+58 424 0000000')
+        } for u in users_data])
+        insert_batches(models.User.__table__, new_users)
+
+        # Link badges of the users just inserted
+        badge_ids = {b['id'] for b in badges_data}
+        badges_by_user = defaultdict(list)
+        for ub in user_badges_data:
+            if ub['badgeId'] in badge_ids:
+                badges_by_user[ub['userId']].append(ub['badgeId'])
+        insert_batches(models.user_badges, [
+            {"user_id": u['id'], "badge_id": b_id} for u in new_users for b_id in badges_by_user[u['id']]
+        ])
 
         # 4. Seed Portfolio
-        for p in portfolio_data:
-            item = models.PortfolioItem(
-                id=p['id'],
-                providerId=p['providerId'],
-                imageUrl=p['imageUrl'],
-                title=p['title'],
-                description=p.get('description', '')
-            )
-            db.add(item)
-        
+        insert_batches(models.PortfolioItem.__table__, missing(models.PortfolioItem.__table__, [{
+            "id": p['id'],
+            "providerId": p['providerId'],
+            "imageUrl": p['imageUrl'],
+            "title": p['title'],
+            "description": p.get('description', '')
+        } for p in portfolio_data]))
+
         # 5. Seed Reviews
-        for r in reviews_data:
-            review = models.Review(
-                id=r['id'],
-                providerId=r['providerId'],
-                userId=r['userId'],
-                userName=r['userName'],
-                comment=r['comment'],
-                rating=r['rating'],
-                date=r['date']
-            )
-            db.add(review)
-        
-        db.commit()
+        new_reviews = insert_batches(models.Review.__table__, missing(models.Review.__table__, [{
+            "id": r['id'],
+            "providerId": r['providerId'],
+            "userId": r['userId'],
+            "userName": r['userName'],
+            "comment": r['comment'],
+            "rating": r['rating'],
+            "date": r['date']
+        } for r in reviews_data]))
+
+        # Core inserts skip the after_flush hook, so recompute the aggregates
+        if new_reviews or not incremental:
+            db = SessionLocal()
+            try:
+                stats.rebuild(db)
+            finally:
+                db.close()
+        search.rebuild(engine)
+        with engine.begin() as conn:
+            sync.backfill(conn)
         print("Database seeded successfully!")
     except Exception as e:
         print(f"Error seeding database: {e}")
-        db.rollback()
-    finally:
-        db.close()
 
 if __name__ == "__main__":
-    seed_db()
+    seed_db(incremental="--incremental" in sys.argv[1:])
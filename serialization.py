@@ -0,0 +1,121 @@
+import json
+from collections import defaultdict
+from fastapi import Response
+from sqlalchemy.orm import aliased
+import models, projection, schemas
+
+try:
+    import orjson
+except ImportError:  # Falls back to the stdlib encoder
+    orjson = None
+
+# Fast path for the hottest list endpoints (the job map and the per-user
+# inbox). Instead of loading JobRequest/User objects and validating them into
+# Pydantic models, the page is selected as plain column tuples (job columns
+# plus the client/provider summary through aliased joins), turned into dicts
+# in JobRequestResponse field order and encoded straight to bytes. The output
+# is the same JSON the response_model would produce.
+#
+# Everything else keeps the regular response_model path, which FastAPI already
+# serializes to bytes with Pydantic's dump_json.
+
+JOB_FIELDS = [name for name in schemas.JobRequestBase.model_fields if name != "candidates"]
+USER_FIELDS = list(schemas.UserBase.model_fields)
+RESPONSE_FIELDS = list(schemas.JobRequestResponse.model_fields)
+
+_Client = aliased(models.User, name="client")
+_Provider = aliased(models.User, name="provider")
+
+
+def _json_default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    """Encode ``value`` to JSON bytes (orjson when installed)."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def json_response(body, response=None):
+    """Response for pre-encoded ``body``, carrying headers set on ``response``.
+
+    Returning a Response bypasses FastAPI's header merging, so things like the
+    next page cursor are copied over here.
+    """
+    headers = dict(response.headers) if response is not None else None
+    if headers:
+        headers.pop("content-length", None)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _models(archived):
+    # (job, candidate) models of the live tables or of the archive (see archive.py)
+    if archived:
+        return models.ArchivedJobRequest, models.ArchivedJobCandidate
+    return models.JobRequest, models.JobCandidate
+
+
+def job_rows(db, fields=None, archived=False):
+    """Query of column tuples for JobRequestResponse rows, filterable like a JobRequest query.
+
+    The client/provider joins are skipped when ``fields`` leaves them out.
+    With ``archived`` the rows come from job_requests_archive instead.
+    """
+    job_model, _ = _models(archived)
+    columns = [getattr(job_model, name) for name in JOB_FIELDS]
+    joins = []
+    for name, alias, fk in (("client", _Client, job_model.clientId),
+                            ("provider", _Provider, job_model.providerId)):
+        if projection.wants(fields, name):
+            columns += [getattr(alias, f).label(f"{name}_{f}") for f in USER_FIELDS]
+            joins.append((alias, alias.id == fk))
+    query = db.query(*columns)
+    for alias, condition in joins:
+        query = query.outerjoin(alias, condition)
+    return query
+
+
+def _candidates(db, job_ids, archived=False):
+    _, candidate_model = _models(archived)
+    by_job = defaultdict(list)
+    if job_ids:
+        links = db.query(candidate_model.jobId, candidate_model.providerId).filter(
+            candidate_model.jobId.in_(job_ids)
+        ).order_by(candidate_model.appliedAt)
+        for job_id, provider_id in links:
+            by_job[job_id].append(provider_id)
+    return by_job
+
+
+def _user(row, prefix):
+    if getattr(row, f"{prefix}_id") is None:
+        return None
+    return {f: getattr(row, f"{prefix}_{f}") for f in USER_FIELDS}
+
+
+def job_dicts(db, rows, fields=None, distances=None, archived=False):
+    """Plain dicts in JobRequestResponse shape for rows from ``job_rows``."""
+    names = [n for n in RESPONSE_FIELDS if projection.wants(fields, n)]
+    candidates = _candidates(db, [row.id for row in rows], archived) if "candidates" in names else None
+    items = []
+    for row in rows:
+        item = {}
+        for name in names:
+            if name == "candidates":
+                item[name] = candidates.get(row.id, [])
+            elif name in ("client", "provider"):
+                item[name] = _user(row, name)
+            elif name == "distance_km":
+                item[name] = distances.get(row.id) if distances else None
+            else:
+                item[name] = getattr(row, name)
+        items.append(item)
+    return items
+
+
+def jobs_response(db, rows, response=None, fields=None, distances=None):
+    return json_response(dumps(job_dicts(db, rows, fields, distances)), response)
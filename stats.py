@@ -0,0 +1,213 @@
+import datetime
+import sys
+from collections import defaultdict
+from sqlalchemy import case, event, func, inspect, or_, select, update
+from sqlalchemy.orm import Session
+import models
+import sync
+
+# Incrementally maintained provider aggregates (provider_stats).
+#
+# Every flush that adds or removes a Review, moves a JobRequest in or out of
+# 'completed', or records an application is folded into per-provider deltas
+# and applied with a few statements per touched provider, on the flush's own
+# connection, so the aggregates commit or roll back with the change that
+# caused them. users.rating / users.jobs are kept in step so listings can sort
+# and filter on indexed columns of the users table without aggregating.
+#
+#   python stats.py rebuild    # recompute everything from reviews and jobs
+
+
+class _Delta:
+    __slots__ = ("rating_sum", "rating_count", "completed_jobs", "active_at")
+
+    def __init__(self):
+        self.rating_sum = 0.0
+        self.rating_count = 0
+        self.completed_jobs = 0
+        self.active_at = None
+
+    def touch(self, when):
+        if self.active_at is None or when > self.active_at:
+            self.active_at = when
+
+
+def _change(obj, attr):
+    """(old, new) values of ``attr`` within the current flush."""
+    history = inspect(obj).attrs[attr].history
+    if history.added:
+        new = history.added[0]
+        old = history.deleted[0] if history.deleted else None
+    else:
+        new = old = history.unchanged[0] if history.unchanged else getattr(obj, attr)
+    return old, new
+
+
+def collect_deltas(session):
+    deltas = defaultdict(_Delta)
+    now = datetime.datetime.utcnow()
+
+    for obj in session.new:
+        if isinstance(obj, models.Review) and obj.providerId:
+            d = deltas[obj.providerId]
+            d.rating_sum += obj.rating or 0.0
+            d.rating_count += 1
+        elif isinstance(obj, models.JobRequest) and obj.providerId and obj.status == "completed":
+            deltas[obj.providerId].completed_jobs += 1
+            deltas[obj.providerId].touch(now)
+        elif isinstance(obj, models.JobCandidate):
+            deltas[obj.providerId].touch(obj.appliedAt or now)
+
+    for obj in session.deleted:
+        if isinstance(obj, models.Review) and obj.providerId:
+            d = deltas[obj.providerId]
+            d.rating_sum -= obj.rating or 0.0
+            d.rating_count -= 1
+        elif isinstance(obj, models.JobRequest) and obj.providerId and obj.status == "completed":
+            deltas[obj.providerId].completed_jobs -= 1
+
+    for obj in session.dirty:
+        if not isinstance(obj, models.JobRequest):
+            continue
+        old_status, new_status = _change(obj, "status")
+        old_provider, new_provider = _change(obj, "providerId")
+        was_completed = old_status == "completed" and old_provider
+        is_completed = new_status == "completed" and new_provider
+        if was_completed and not (is_completed and old_provider == new_provider):
+            deltas[old_provider].completed_jobs -= 1
+        if is_completed and not (was_completed and old_provider == new_provider):
+            deltas[new_provider].completed_jobs += 1
+        if new_provider and (old_provider != new_provider or old_status != new_status):
+            deltas[new_provider].touch(now)
+
+    return deltas
+
+
+def _ensure_rows(connection, provider_ids):
+    # Insert-or-ignore, so two transactions meeting a new provider at once
+    # don't collide on the primary key
+    stats = models.ProviderStats.__table__
+    if connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    connection.execute(insert(stats).on_conflict_do_nothing(index_elements=[stats.c.providerId]), [
+        {"providerId": p, "rating_sum": 0.0, "rating_count": 0, "completed_jobs": 0}
+        for p in provider_ids
+    ])
+
+
+def apply_deltas(connection, deltas, stamp=None):
+    """Apply ``deltas``; ``stamp()`` gives extra values for the users rows it updates."""
+    stats = models.ProviderStats.__table__
+    users = models.User.__table__
+    deltas = {p: d for p, d in deltas.items()
+              if d.rating_count or d.rating_sum or d.completed_jobs or d.active_at}
+    if not deltas:
+        return
+    _ensure_rows(connection, list(deltas))
+
+    for provider_id, d in deltas.items():
+        values = {
+            "rating_sum": stats.c.rating_sum + d.rating_sum,
+            "rating_count": stats.c.rating_count + d.rating_count,
+            "completed_jobs": stats.c.completed_jobs + d.completed_jobs,
+        }
+        if d.active_at is not None:
+            last_active = stats.c.last_active_at
+            values["last_active_at"] = case(
+                (or_(last_active.is_(None), last_active < d.active_at), d.active_at),
+                else_=last_active
+            )
+        connection.execute(update(stats).where(stats.c.providerId == provider_id).values(**values))
+
+        user_values = {}
+        if d.rating_count or d.rating_sum:
+            rating_sum, rating_count = connection.execute(
+                select(stats.c.rating_sum, stats.c.rating_count).where(stats.c.providerId == provider_id)
+            ).one()
+            # Back to 0 when the last review goes
+            user_values["rating"] = round(rating_sum / rating_count, 2) if rating_count > 0 else 0.0
+        if d.completed_jobs:
+            jobs = func.coalesce(users.c.jobs, 0) + d.completed_jobs
+            user_values["jobs"] = case((jobs < 0, 0), else_=jobs)
+        if user_values:
+            if stamp is not None:
+                user_values.update(stamp())
+            connection.execute(update(users).where(users.c.id == provider_id).values(**user_values))
+
+
+@event.listens_for(Session, "after_flush")
+def _maintain_provider_stats(session, flush_context):
+    deltas = collect_deltas(session)
+    if deltas:
+        # The rating/jobs change is a change of the user for sync.py too
+        apply_deltas(session.connection(), deltas, stamp=lambda: sync.stamp(session))
+
+
+def rebuild(db):
+    """Recompute provider_stats from reviews, jobs and applications.
+
+    users.rating is refreshed for providers that have reviews. users.jobs is
+    left alone: it also counts work imported from before the platform, which
+    can't be recovered from job_requests.
+    """
+    stats = models.ProviderStats.__table__
+    reviews = db.execute(
+        select(models.Review.providerId, func.sum(models.Review.rating), func.count())
+        .group_by(models.Review.providerId)
+    ).all()
+    completed = defaultdict(int)
+    # Archived jobs (see archive.py) still count; the archive may not exist yet mid-migration
+    archive_table = models.ArchivedJobRequest.__table__
+    job_models = [models.JobRequest]
+    if inspect(db.connection()).has_table(archive_table.name, schema=archive_table.schema):
+        job_models.append(models.ArchivedJobRequest)
+    for job_model in job_models:
+        for provider_id, count in db.execute(
+            select(job_model.providerId, func.count())
+            .where(job_model.status == "completed", job_model.providerId.isnot(None))
+            .group_by(job_model.providerId)
+        ):
+            completed[provider_id] += count
+    applied = dict(db.execute(
+        select(models.JobCandidate.providerId, func.max(models.JobCandidate.appliedAt))
+        .group_by(models.JobCandidate.providerId)
+    ).all())
+
+    # Completions carry no timestamp of their own, so keep the activity seen so far
+    last_active = dict(db.execute(select(stats.c.providerId, stats.c.last_active_at)).all())
+
+    rows = defaultdict(lambda: {"rating_sum": 0.0, "rating_count": 0, "completed_jobs": 0, "last_active_at": None})
+    for provider_id, active_at in last_active.items():
+        rows[provider_id]["last_active_at"] = active_at
+    for provider_id, rating_sum, rating_count in reviews:
+        rows[provider_id].update(rating_sum=rating_sum or 0.0, rating_count=rating_count)
+    for provider_id, count in completed.items():
+        rows[provider_id]["completed_jobs"] = count
+    for provider_id, applied_at in applied.items():
+        previous = rows[provider_id]["last_active_at"]
+        rows[provider_id]["last_active_at"] = max(applied_at, previous) if previous else applied_at
+
+    db.execute(stats.delete())
+    if rows:
+        db.execute(stats.insert(), [{"providerId": p, **values} for p, values in rows.items()])
+    for provider_id, rating_sum, rating_count in reviews:
+        if rating_count:
+            db.execute(update(models.User.__table__)
+                       .where(models.User.id == provider_id)
+                       .values(rating=round(rating_sum / rating_count, 2)))
+    db.commit()
+    return len(rows)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("usage: python stats.py rebuild")
+        sys.exit(1)
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        print(f"Rebuilt stats for {rebuild(db)} providers")
+    finally:
+        db.close()
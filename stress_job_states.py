@@ -0,0 +1,118 @@
+import os
+import sys
+import tempfile
+import threading
+
+# Hammers the job state machine from many threads at once against a
+# throwaway SQLite file and checks that nothing is lost or double-granted:
+#   - N providers accept the same job: exactly one wins, the rest get 409
+#   - N providers apply to the same job: all N candidacies are recorded
+#   - N clients race conflicting status changes: exactly one transition lands
+#
+#   python stress_job_states.py [threads]
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "stress.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from fastapi import HTTPException
+from database import SessionLocal
+import models
+import seed
+import main
+
+THREADS = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+ROUNDS = 5
+
+
+def call(handler, **kwargs):
+    """Run a route's sync body with its own session, like one request would."""
+    db = SessionLocal()
+    try:
+        handler.__wrapped__(db=db, **kwargs)
+        return 200
+    except HTTPException as e:
+        return e.status_code
+    finally:
+        db.close()
+
+
+def race(fn, args_list):
+    barrier = threading.Barrier(len(args_list))
+    results = [None] * len(args_list)
+
+    def run(i, kwargs):
+        barrier.wait()
+        results[i] = fn(**kwargs)
+
+    threads = [threading.Thread(target=run, args=(i, kw)) for i, kw in enumerate(args_list)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def new_job(db, n):
+    job = models.JobRequest(
+        id=f"stress-{n}", clientId="c1", title="Stress", description="Stress",
+        type="electric", budget_min=1, budget_max=2, latitude=10.34, longitude=-67.04,
+    )
+    db.add(job)
+    db.commit()
+    return job.id
+
+
+def main_check():
+    seed.seed_db()
+    providers = [f"p{i}" for i in range(1, 51)]
+    failures = []
+    db = SessionLocal()
+    counter = 0
+
+    for round_no in range(ROUNDS):
+        # Accept race
+        counter += 1
+        job_id = new_job(db, counter)
+        contenders = [providers[i % len(providers)] for i in range(THREADS)]
+        contenders = list(dict.fromkeys(contenders))
+        codes = race(lambda provider_id: call(main.accept_job, job_id=job_id, provider_id=provider_id),
+                     [{"provider_id": p} for p in contenders])
+        winners = [p for p, code in zip(contenders, codes) if code == 200]
+        db.expire_all()
+        job = db.get(models.JobRequest, job_id)
+        if len(winners) != 1 or job.providerId != winners[0] or sorted(set(codes)) != [200, 409]:
+            failures.append(f"accept round {round_no}: winners={winners} stored={job.providerId} codes={sorted(set(codes))}")
+
+        # Apply race
+        counter += 1
+        job_id = new_job(db, counter)
+        appliers = providers[:min(THREADS, len(providers))]
+        codes = race(lambda provider_id: call(main.apply_to_job, job_id=job_id, provider_id=provider_id),
+                     [{"provider_id": p} for p in appliers])
+        stored = db.query(models.JobCandidate).filter(models.JobCandidate.jobId == job_id).count()
+        if stored != len(appliers) or set(codes) != {200}:
+            failures.append(f"apply round {round_no}: stored={stored}/{len(appliers)} codes={sorted(set(codes))}")
+
+        # Conflicting status changes from 'pending' (neither can follow the other)
+        counter += 1
+        job_id = new_job(db, counter)
+        targets = ["accepted", "rejected"] * (THREADS // 2 or 1)
+        codes = race(lambda status: call(main.update_job_status, job_id=job_id, status=status),
+                     [{"status": t} for t in targets])
+        db.expire_all()
+        job = db.get(models.JobRequest, job_id)
+        landed = [t for t, code in zip(targets, codes) if code == 200]
+        # Same-target repeats are no-ops, so every winner must agree with the stored state
+        if not landed or any(t != job.status for t in landed) or job.version != 2:
+            failures.append(f"status round {round_no}: landed={sorted(set(landed))} stored={job.status} v{job.version}")
+
+    db.close()
+    for failure in failures:
+        print("FAIL", failure)
+    if failures:
+        sys.exit(1)
+    print(f"{ROUNDS} rounds x {THREADS} threads: no lost or double-granted updates")
+
+
+if __name__ == "__main__":
+    main_check()
@@ -0,0 +1,279 @@
+import datetime
+import itertools
+import logging
+import os
+import sys
+from collections import defaultdict
+from fastapi import HTTPException
+from sqlalchemy import BigInteger, Text, bindparam, cast, event, func, or_, select, update
+from sqlalchemy.orm import Session, selectinload
+import models
+import pagination
+import serialization
+
+# Delta sync for offline-capable clients (GET /sync).
+#
+# Every row of the synced tables carries ``seq``, the change sequence of the
+# transaction that last wrote it, and ``updatedAt``. A writing transaction
+# takes its number on its first flush by inserting into sync_sequence, an
+# autoincrement table (a SERIAL, so nextval(), on Postgres), which leaves no
+# shared row for writers to queue on. Deletes leave a row in tombstones under
+# the same sequence.
+#
+# Numbers can commit out of order, so /sync only hands out tokens up to a
+# watermark below which every transaction has finished. On SQLite, where the
+# number is taken under the database write lock, that's simply the latest
+# one. On Postgres each number is stored with its transaction's id, and the
+# watermark stops right below the first number whose transaction may still
+# be running, i.e. isn't older than the xmin of the reader's snapshot. A
+# client holding token N has then seen everything up to N.
+#
+# ORM flushes are stamped by the hooks below. Statements that go around the
+# flush stamp themselves: the portfolio routes through ``stamp`` and
+# ``record_deletes``, the provider aggregates in stats.py, and bulk loads
+# (seed.py, synthetic.py, migration 11) through ``backfill`` afterwards.
+#
+# A client first calls /sync without a token, then with the token of the
+# last page; while ``more`` is set it asks again straight away. Per page it
+# drops the ``deleted`` ids first and then upserts the rows, which are always
+# the current version. Tombstones older than SYNC_TOMBSTONE_DAYS can be
+# pruned; tokens from before the pruned range get 410 and resync from scratch.
+#
+#   python sync.py backfill    # sequence rows written around the ORM
+#   python sync.py prune       # drop old tombstones and sequence numbers
+
+PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "500"))
+MAX_PAGE_SIZE = 2000
+TOMBSTONE_DAYS = float(os.getenv("SYNC_TOMBSTONE_DAYS", "30"))
+BACKFILL_BATCH_SIZE = 5000
+
+# Response key -> model
+ENTITIES = {
+    "jobs": models.JobRequest,
+    "users": models.User,
+    "portfolio": models.PortfolioItem,
+    "services": models.Service,
+    "badges": models.Badge,
+}
+_ENTITY_NAMES = {model: name for name, model in ENTITIES.items()}
+
+logger = logging.getLogger(__name__)
+
+state = models.SyncState.__table__
+sequence = models.SyncSequence.__table__
+tombstones = models.Tombstone.__table__
+
+# xid8 values as bigints, comparable with sync_sequence.xid
+_current_xid = cast(cast(func.pg_current_xact_id(), Text), BigInteger)
+_snapshot_xmin = cast(cast(func.pg_snapshot_xmin(func.pg_current_snapshot()), Text), BigInteger)
+
+
+def current_seq(session):
+    """Sequence number of ``session``'s transaction, taken on first use."""
+    seq = session.info.get("sync_seq")
+    if seq is None:
+        connection = session.connection()
+        values = {"takenAt": datetime.datetime.utcnow()}
+        if connection.dialect.name == "postgresql":
+            values["xid"] = _current_xid
+        taken = connection.execute(sequence.insert().values(**values))
+        seq = session.info["sync_seq"] = taken.inserted_primary_key[0]
+    return seq
+
+
+def stamp(session):
+    """``seq``/``updatedAt`` values for rows written with Core statements."""
+    return {"seq": current_seq(session), "updatedAt": datetime.datetime.utcnow()}
+
+
+def record_deletes(session, entity, ids):
+    """Tombstones for ``ids`` of ``entity`` deleted with Core statements."""
+    if ids:
+        values = stamp(session)
+        session.connection().execute(tombstones.insert(), [
+            {"entity": entity, "entityId": entity_id, "seq": values["seq"], "deletedAt": values["updatedAt"]}
+            for entity_id in ids
+        ])
+
+
+@event.listens_for(Session, "before_flush")
+def _stamp_changes(session, flush_context, instances):
+    if not session.info.get("sync", True):
+        return
+    changed = [obj for obj in session.new if type(obj) in _ENTITY_NAMES]
+    changed += [obj for obj in session.dirty if type(obj) in _ENTITY_NAMES and session.is_modified(obj)]
+    deleted = [obj for obj in session.deleted if type(obj) in _ENTITY_NAMES]
+    # Applying or withdrawing changes the job's candidates list
+    job_ids = {obj.jobId for obj in itertools.chain(session.new, session.deleted)
+               if isinstance(obj, models.JobCandidate)}
+    if not (changed or deleted or job_ids):
+        return
+
+    values = stamp(session)
+    for obj in changed:
+        obj.seq, obj.updatedAt = values["seq"], values["updatedAt"]
+    for obj in deleted:
+        session.add(models.Tombstone(entity=_ENTITY_NAMES[type(obj)], entityId=obj.id,
+                                     seq=values["seq"], deletedAt=values["updatedAt"]))
+    # Jobs the flush updates anyway get the stamp above
+    job_ids -= {obj.id for obj in changed if isinstance(obj, models.JobRequest)}
+    if job_ids:
+        # Core, so the job's optimistic lock version stays put
+        jobs = models.JobRequest.__table__
+        session.connection().execute(update(jobs).where(jobs.c.id.in_(job_ids)).values(**values))
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _forget_seq(session, transaction):
+    # Also on savepoints: a rolled back one may have taken the number back
+    session.info.pop("sync_seq", None)
+
+
+# --- reading ----------------------------------------------------------------
+
+def _watermark(db):
+    """Latest sequence number below which every transaction has finished."""
+    latest = select(func.max(sequence.c.seq)).scalar_subquery()
+    if db.get_bind().dialect.name != "postgresql":
+        return latest
+    # Transactions from the snapshot's xmin on may not have committed yet
+    running = select(func.min(sequence.c.seq)).where(sequence.c.xid >= _snapshot_xmin).scalar_subquery()
+    return func.coalesce(running - 1, latest)
+
+
+def decode_token(token):
+    (seq,) = pagination.decode_cursor(token, 1)
+    # bool is an int subclass, but [true] isn't a sequence number
+    if type(seq) is not int or seq < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return seq
+
+
+def _sources(db, user_id, with_deleted):
+    """{key: (query, seq column)} of what ``user_id`` gets to see."""
+    job, user, item = models.JobRequest, models.User, models.PortfolioItem
+    # Open jobs in any status, so clients notice them leaving the map, plus the user's own
+    visible_jobs = job.request_type == "open"
+    visible_users = user.role == "provider"
+    if user_id:
+        applied = select(models.JobCandidate.jobId).where(models.JobCandidate.providerId == user_id)
+        visible_jobs = or_(visible_jobs, job.clientId == user_id, job.providerId == user_id, job.id.in_(applied))
+        visible_users = or_(visible_users, user.id == user_id)
+    sources = {
+        "jobs": (serialization.job_rows(db).add_columns(job.seq).filter(visible_jobs), job.seq),
+        "users": (db.query(user).options(selectinload(user.badges)).filter(visible_users), user.seq),
+        "portfolio": (db.query(item), item.seq),
+        "services": (db.query(models.Service), models.Service.seq),
+        "badges": (db.query(models.Badge), models.Badge.seq),
+    }
+    if with_deleted:
+        sources["deleted"] = (db.query(models.Tombstone), models.Tombstone.seq)
+    return sources
+
+
+def changes(db, since=None, user_id=None, limit=PAGE_SIZE):
+    """SyncResponse dict of what changed after sequence ``since`` (None: everything).
+
+    Each table is read up to ``limit`` rows past ``since``. The page ends
+    right before the first sequence number a full table couldn't return, so
+    a transaction's changes never straddle two pages; a single transaction
+    bigger than ``limit`` comes whole.
+    """
+    pruned, latest = db.execute(select(state.c.pruned_seq, _watermark(db)).where(state.c.id == 1)).first() or (0, 0)
+    latest = latest or 0
+    if since is not None and since < pruned:
+        raise HTTPException(status_code=410, detail="Sync token expired, sync again without one")
+
+    after = since or 0
+    sources = _sources(db, user_id, with_deleted=since is not None)
+    pages = {
+        key: query.filter(column > after).order_by(column).limit(limit + 1).all()
+        for key, (query, column) in sources.items()
+    }
+    full = [key for key, rows in pages.items() if len(rows) > limit]
+    # Rows past ``latest`` were committed while reading or are above the
+    # watermark; they come next time
+    upto = min([latest] + [pages[key][limit].seq - 1 for key in full])
+    more = bool(full) or any(row.seq > upto for rows in pages.values() for row in rows)
+    if upto <= after and full:
+        upto = min(pages[key][limit].seq for key in full)
+        for key in full:
+            query, column = sources[key]
+            pages[key] = query.filter(column > after, column <= upto).order_by(column).all()
+
+    page = {key: [row for row in rows if row.seq <= upto] for key, rows in pages.items()}
+    deleted = defaultdict(list)
+    for tombstone in page.pop("deleted", []):
+        deleted[tombstone.entity].append(tombstone.entityId)
+    return {
+        "token": pagination.encode_cursor(max(upto, after)),
+        "more": more,
+        **page,
+        "jobs": serialization.job_dicts(db, page["jobs"]),
+        "deleted": deleted,
+    }
+
+
+# --- maintenance ------------------------------------------------------------
+
+def ensure_state(conn):
+    if conn.execute(select(state.c.id).where(state.c.id == 1)).first() is None:
+        conn.execute(state.insert().values(id=1, seq=0, pruned_seq=0))
+
+
+def backfill(conn):
+    """Give every synced row without a sequence number one; returns how many.
+
+    Rows get numbers of their own, oldest first, so a full sync of a large
+    table still comes in pages.
+    """
+    ensure_state(conn)
+    now = datetime.datetime.utcnow()
+    take = sequence.insert().returning(sequence.c.seq, sort_by_parameter_order=True)
+    total = 0
+    for model in ENTITIES.values():
+        table = model.__table__
+        created = table.c.get("createdAt")
+        order = [created, table.c.id] if created is not None else [table.c.id]
+        ids = conn.execute(select(table.c.id).where(table.c.seq.is_(None)).order_by(*order)).scalars().all()
+        stamped = update(table).where(table.c.id == bindparam("b_id")).values(
+            seq=bindparam("b_seq"),
+            updatedAt=func.coalesce(created, now) if created is not None else now,
+        )
+        for start in range(0, len(ids), BACKFILL_BATCH_SIZE):
+            batch = ids[start:start + BACKFILL_BATCH_SIZE]
+            seqs = conn.execute(take, [{"takenAt": now}] * len(batch)).scalars().all()
+            conn.execute(stamped, [{"b_id": row_id, "b_seq": seq} for row_id, seq in zip(batch, seqs)])
+        total += len(ids)
+    return total
+
+
+def prune(conn, older_than_days=TOMBSTONE_DAYS):
+    """Drop tombstones and sequence numbers older than ``older_than_days``; returns how many tombstones."""
+    before = datetime.datetime.utcnow() - datetime.timedelta(days=older_than_days)
+    # All but the latest number, which the watermark reads
+    newest = select(func.max(sequence.c.seq)).scalar_subquery()
+    conn.execute(sequence.delete().where(sequence.c.takenAt < before, sequence.c.seq < newest))
+    last = conn.execute(select(func.max(tombstones.c.seq)).where(tombstones.c.deletedAt < before)).scalar()
+    if last is None:
+        return 0
+    # Everything up to ``last`` goes, so the expired token range stays a prefix
+    removed = conn.execute(tombstones.delete().where(tombstones.c.seq <= last)).rowcount
+    conn.execute(update(state).where(state.c.id == 1, state.c.pruned_seq < last).values(pruned_seq=last))
+    return removed
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    command = sys.argv[1:]
+    if command == ["backfill"]:
+        with engine.begin() as conn:
+            print(f"Sequenced {backfill(conn)} rows")
+    elif command == ["prune"]:
+        with engine.begin() as conn:
+            print(f"Pruned {prune(conn)} tombstones")
+    else:
+        print("usage: python sync.py [backfill|prune]")
+        sys.exit(1)
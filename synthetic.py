@@ -0,0 +1,404 @@
+import argparse
+import datetime
+import math
+import random
+import statistics
+import time
+from collections import defaultdict
+from sqlalchemy import bindparam, select, update
+from database import engine
+import auth
+import geo
+import migrations
+import models
+import search
+import seed
+import stats
+import sync
+
+# Synthetic data for load-test databases: any number of clients, providers,
+# job requests, applications and reviews, spread around the cities the
+# fixture users live in. Rows are generated lazily and streamed into the
+# database in Core executemany batches, so memory stays flat no matter how
+# many rows are requested; only per-provider aggregates are kept in memory.
+#
+#   python synthetic.py --clients 20000 --providers 5000 --jobs 1000000
+#   python synthetic.py --clients 0 --providers 0 --jobs 50000 --incremental   # more jobs for existing users
+#
+# Without --incremental the database is reset and the fixtures in data/ are
+# loaded first. Every run tags its ids ("s<run>c12", "s<run>j345"...) so
+# incremental runs never collide with earlier ones. When a run generates no
+# clients or providers, jobs and reviews are attached to the ones already in
+# the database instead.
+
+TYPES = ["electric", "plumbing", "mechanic", "construction"]
+
+FIRST_NAMES = [
+    "Ana", "Carlos", "María", "José", "Luis", "Carmen", "Pedro", "Lucía", "Jorge", "Elena",
+    "Miguel", "Sofía", "Andrés", "Valentina", "Diego", "Gabriela", "Rafael", "Isabel", "Daniel", "Paula",
+]
+LAST_NAMES = [
+    "García", "Rodríguez", "Martínez", "Hernández", "López", "González", "Pérez", "Sánchez",
+    "Ramírez", "Torres", "Flores", "Rivera", "Gómez", "Díaz", "Morales", "Rojas", "Castillo", "Mendoza",
+]
+JOB_TITLES = {
+    "electric": ["Instalar tomacorrientes", "Revisar tablero eléctrico", "Cambiar lámparas", "Falla de breaker"],
+    "plumbing": ["Fuga en el baño", "Destapar cañería", "Instalar calentador", "Cambiar grifería"],
+    "mechanic": ["Cambio de aceite", "Revisión de frenos", "Falla de arranque", "Alineación y balanceo"],
+    "construction": ["Frisar pared", "Colocar cerámica", "Reparar techo", "Construir muro"],
+}
+ABOUT = {
+    "electric": "Electricista residencial y comercial.",
+    "plumbing": "Plomería general y emergencias.",
+    "mechanic": "Mecánica automotriz a domicilio.",
+    "construction": "Albañilería y remodelaciones.",
+}
+COMMENTS = [
+    "Excelente trabajo, muy puntual.", "Buen servicio, lo recomiendo.", "Trabajo limpio y rápido.",
+    "Cumplió con lo acordado.", "Llegó tarde pero resolvió el problema.", "No quedé satisfecho.",
+]
+# Weighted so the average lands around 4.2, like the fixtures
+RATINGS = [5, 5, 5, 5, 4, 4, 4, 3, 2, 1]
+# (status, providerId assigned?) for open requests
+OPEN_STATUSES = [("pending", False)] * 10 + [("accepted", True)] * 2 + [("in_process", True)] * 2 + \
+    [("completed", True)] * 4 + [("cancelled", False), ("rejected", False)]
+DIRECT_SHARE = 0.15
+
+
+def person_name(n):
+    return f"{FIRST_NAMES[n % len(FIRST_NAMES)]} {LAST_NAMES[(n // len(FIRST_NAMES)) % len(LAST_NAMES)]}"
+
+
+def load_cities(cell_degrees=0.1):
+    """(lat, lng, spread_deg, weight) for each cluster of fixture users."""
+    cells = defaultdict(list)
+    for u in seed.load_json('users.json'):
+        if u.get('latitude') is not None and u.get('longitude') is not None:
+            key = (round(u['latitude'] / cell_degrees), round(u['longitude'] / cell_degrees))
+            cells[key].append((u['latitude'], u['longitude']))
+    cities = []
+    for points in cells.values():
+        lats, lngs = [p[0] for p in points], [p[1] for p in points]
+        spread = max(statistics.pstdev(lats), statistics.pstdev(lngs), 0.01)
+        cities.append((statistics.fmean(lats), statistics.fmean(lngs), spread, len(points)))
+    return cities
+
+
+class _Ids:
+    """A sequence of generated ids (or items) computed from their index."""
+
+    def __init__(self, make, indices):
+        self.make = make
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        return self.make(self.indices[i])
+
+
+class Generator:
+    def __init__(self, run, seed_value=None, days=365, cities=None):
+        self.run = run
+        self.rng = random.Random(seed_value)
+        self.now = datetime.datetime.utcnow()
+        self.days = days
+        self.cities = cities or load_cities()
+        self.city_weights = [c[3] for c in self.cities]
+        self.deltas = defaultdict(stats._Delta)
+
+    # ids ---------------------------------------------------------------
+    def client_id(self, n):
+        return f"s{self.run}c{n}"
+
+    def is_new_provider(self, provider_id):
+        return provider_id.startswith(f"s{self.run}p")
+
+    def provider_id(self, n):
+        return f"s{self.run}p{n}"
+
+    def job_id(self, n):
+        return f"s{self.run}j{n}"
+
+    def review_id(self, n):
+        return f"s{self.run}r{n}"
+
+    # helpers -----------------------------------------------------------
+    def point(self):
+        lat, lng, spread, _ = self.rng.choices(self.cities, weights=self.city_weights)[0]
+        # Dense core with a long tail out to the suburbs
+        sigma = spread if self.rng.random() < 0.8 else spread * 4
+        lat = max(-90.0, min(90.0, self.rng.gauss(lat, sigma)))
+        lng = self.rng.gauss(lng, sigma / max(math.cos(math.radians(lat)), 0.01))
+        lng = (lng + 180.0) % 360.0 - 180.0
+        return round(lat, 6), round(lng, 6)
+
+    def moment(self):
+        return self.now - datetime.timedelta(seconds=self.rng.random() * self.days * 86400)
+
+    def _user(self, user_id, n, role, email, created_at):
+        lat, lng = self.point()
+        return {
+            "id": user_id,
+            "name": person_name(n),
+            "email": email,
+            "password": auth.fixture_hash("1234"),
+            "role": role,
+            "image": f"https://randomuser.me/api/portraits/{'women' if n % 2 else 'men'}/{n % 100}.jpg",
+            "createdAt": created_at,
+            "latitude": lat,
+            "longitude": lng,
+            "geohash": geo.encode(lat, lng),
+            "phone": f"+58 424 {self.rng.randint(0, 9999999):07d}",
+            # executemany needs the same keys on every row of a batch
+            "type": None,
+            "rating": 0.0,
+            "jobs": 0,
+            "about": None,
+            "hourly_rate": None,
+            "location_name": None,
+        }
+
+    # generators ----------------------------------------------------------
+    def clients(self, count):
+        for n in range(count):
+            yield self._user(self.client_id(n), n, "client",
+                             f"client{n}.{self.run}@synthetic.truber.test", self.moment())
+
+    def providers(self, count):
+        for n in range(count):
+            service = TYPES[n % len(TYPES)]
+            low = self.rng.randint(8, 25)
+            row = self._user(self.provider_id(n), n, "provider",
+                             f"provider{n}.{self.run}@synthetic.truber.test", self.moment())
+            row.update(
+                type=service,
+                rating=0.0,
+                jobs=self.rng.randint(0, 40),  # work done before joining the platform
+                about=ABOUT[service],
+                hourly_rate={"min": low, "max": low + self.rng.randint(5, 20)},
+            )
+            yield row
+
+    def provider_badges(self, count, badge_ids):
+        if not badge_ids:
+            return
+        for n in range(count):
+            for badge_id in self.rng.sample(badge_ids, k=self.rng.randint(0, min(2, len(badge_ids)))):
+                yield {"user_id": self.provider_id(n), "badge_id": badge_id}
+
+    def jobs(self, count, clients, providers, candidates_per_job):
+        """Job rows, interleaved with their candidate rows as (table, row) pairs."""
+        job_table = models.JobRequest.__table__
+        candidate_table = models.JobCandidate.__table__
+        for n in range(count):
+            service = self.rng.choice(TYPES)
+            pool = providers.get(service) or []
+            client_id, _ = clients[self.rng.randrange(len(clients))]
+            lat, lng = self.point()
+            created_at = self.moment()
+            direct = bool(pool) and self.rng.random() < DIRECT_SHARE
+            status, assigned = self.rng.choice(OPEN_STATUSES)
+            provider_id = None
+            if (assigned or direct) and pool:
+                provider_id = pool[self.rng.randrange(len(pool))]
+            elif assigned:
+                status = "pending"  # nobody of this trade to assign
+            low = self.rng.randint(5, 60)
+            row = {
+                "id": self.job_id(n),
+                "clientId": client_id,
+                "providerId": provider_id,
+                "title": self.rng.choice(JOB_TITLES[service]),
+                "description": f"{self.rng.choice(JOB_TITLES[service])}. Solicitud generada #{n}.",
+                "type": service,
+                "budget_min": float(low),
+                "budget_max": float(low + self.rng.randint(5, 80)),
+                "latitude": lat,
+                "longitude": lng,
+                "geohash": geo.encode(lat, lng),
+                "request_type": "direct" if direct else "open",
+                "status": status,
+                "images": None,
+                "milestones": [],
+                "proposal_status": "none",
+                "createdAt": created_at,
+            }
+            yield job_table, row
+            if provider_id and status == "completed":
+                self.deltas[provider_id].completed_jobs += 1
+                self.deltas[provider_id].touch(created_at)
+            if direct or status != "pending" or not pool:
+                continue
+            wanted = self.rng.randint(0, 2 * candidates_per_job) if candidates_per_job else 0
+            picks = set()
+            for _ in range(min(wanted, len(pool))):
+                picks.add(pool[self.rng.randrange(len(pool))])
+            for candidate in picks:
+                applied_at = created_at + datetime.timedelta(minutes=self.rng.randint(1, 72 * 60))
+                self.deltas[candidate].touch(applied_at)
+                yield candidate_table, {"jobId": row["id"], "providerId": candidate, "appliedAt": applied_at}
+
+    def reviews(self, count, clients, providers):
+        pools = [ids for ids in providers.values() if len(ids)]
+        if not pools:
+            return
+        for n in range(count):
+            ids = self.rng.choice(pools)
+            provider_id = ids[self.rng.randrange(len(ids))]
+            client_id, client_name = clients[self.rng.randrange(len(clients))]
+            rating = self.rng.choice(RATINGS)
+            self.deltas[provider_id].rating_sum += rating
+            self.deltas[provider_id].rating_count += 1
+            yield {
+                "id": self.review_id(n),
+                "providerId": provider_id,
+                "userId": client_id,
+                "userName": client_name,
+                "comment": self.rng.choice(COMMENTS),
+                "rating": float(rating),
+                "date": self.moment().date().isoformat(),
+            }
+
+
+class BatchWriter:
+    """Buffers rows per table and inserts them in batches, parents first."""
+
+    def __init__(self, tables, batch_size=seed.BATCH_SIZE):
+        self.tables = tables  # in foreign key order
+        self.batch_size = batch_size
+        self.buffers = {table: [] for table in tables}
+        self.counts = defaultdict(int)
+
+    def add(self, table, row):
+        buffer = self.buffers[table]
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            # Children reference rows that may still be buffered upstream
+            self.flush(upto=table)
+
+    def flush(self, upto=None):
+        for table in self.tables:
+            buffer = self.buffers[table]
+            if buffer:
+                with engine.begin() as conn:
+                    conn.execute(table.insert(), buffer)
+                self.counts[table.name] += len(buffer)
+                self.buffers[table] = []
+            if table is upto:
+                break
+
+
+def _existing_pools():
+    with engine.connect() as conn:
+        clients = conn.execute(
+            select(models.User.id, models.User.name).where(models.User.role == "client")
+        ).all()
+        providers = defaultdict(list)
+        for provider_id, service in conn.execute(
+            select(models.User.id, models.User.type).where(models.User.role == "provider")
+        ):
+            providers[service].append(provider_id)
+    return [tuple(c) for c in clients], dict(providers)
+
+
+def apply_stats(generator, batch_size=seed.BATCH_SIZE):
+    """Fold the run's per-provider deltas into provider_stats / users."""
+    new = {p: d for p, d in generator.deltas.items() if generator.is_new_provider(p)}
+    old = {p: d for p, d in generator.deltas.items() if not generator.is_new_provider(p)}
+
+    stats_rows = ({
+        "providerId": p,
+        "rating_sum": d.rating_sum,
+        "rating_count": d.rating_count,
+        "completed_jobs": d.completed_jobs,
+        "last_active_at": d.active_at,
+    } for p, d in new.items())
+    seed.insert_batches(models.ProviderStats.__table__, stats_rows, batch_size)
+
+    users = models.User.__table__
+    mirror = update(users).where(users.c.id == bindparam("b_id")).values(
+        rating=bindparam("b_rating"), jobs=users.c.jobs + bindparam("b_completed")
+    )
+    params = [
+        {"b_id": p, "b_rating": round(d.rating_sum / d.rating_count, 2) if d.rating_count else 0.0,
+         "b_completed": d.completed_jobs}
+        for p, d in new.items()
+    ]
+    for start in range(0, len(params), batch_size):
+        with engine.begin() as conn:
+            conn.execute(mirror, params[start:start + batch_size])
+
+    # Providers that were already there go through the regular delta path
+    if old:
+        with engine.begin() as conn:
+            # Cleared so sync.backfill numbers the changed users with the new rows
+            stats.apply_deltas(conn, old, stamp=lambda: {"seq": None})
+
+
+def load(clients=0, providers=0, jobs=0, candidates=2, reviews=0, incremental=False,
+         run=None, seed_value=None, batch_size=seed.BATCH_SIZE):
+    if not incremental:
+        seed.seed_db()
+    migrations.upgrade(engine)
+    run = run or format(int(time.time()), "x")
+    generator = Generator(run, seed_value)
+    started = time.perf_counter()
+
+    users = models.User.__table__
+    writer = BatchWriter([users, models.user_badges, models.JobRequest.__table__,
+                          models.JobCandidate.__table__, models.Review.__table__], batch_size)
+    for row in generator.providers(providers):
+        writer.add(users, row)
+    for row in generator.clients(clients):
+        writer.add(users, row)
+    badge_ids = sorted(seed.existing_ids(models.Badge.__table__))
+    for row in generator.provider_badges(providers, badge_ids):
+        writer.add(models.user_badges, row)
+    writer.flush()
+
+    existing_clients, existing_providers = _existing_pools() if not (clients and providers) else ([], {})
+    client_pool = _Ids(lambda n: (generator.client_id(n), person_name(n)), range(clients)) if clients else existing_clients
+    if providers:
+        provider_pool = {t: _Ids(generator.provider_id, range(i, providers, len(TYPES))) for i, t in enumerate(TYPES)}
+    else:
+        provider_pool = existing_providers
+    if (jobs or reviews) and not len(client_pool):
+        raise SystemExit("No clients to attach jobs and reviews to; pass --clients")
+
+    for table, row in generator.jobs(jobs, client_pool, provider_pool, candidates):
+        writer.add(table, row)
+    for row in generator.reviews(reviews, client_pool, provider_pool):
+        writer.add(models.Review.__table__, row)
+    writer.flush()
+    apply_stats(generator, batch_size)
+    search.rebuild(engine)
+    with engine.begin() as conn:
+        sync.backfill(conn)
+
+    elapsed = time.perf_counter() - started
+    total = sum(writer.counts.values())
+    summary = ", ".join(f"{count} {name}" for name, count in writer.counts.items())
+    print(f"Run {run}: inserted {summary} in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/s)")
+    return writer.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate and bulk-load synthetic data")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--providers", type=int, default=200)
+    parser.add_argument("--jobs", type=int, default=10000)
+    parser.add_argument("--candidates", type=int, default=2, help="average applications per open pending job")
+    parser.add_argument("--reviews", type=int, default=2000)
+    parser.add_argument("--incremental", action="store_true", help="keep existing data and add to it")
+    parser.add_argument("--run", help="id tag for this run (default: derived from the clock)")
+    parser.add_argument("--seed", type=int, help="random seed for reproducible data")
+    parser.add_argument("--batch-size", type=int, default=seed.BATCH_SIZE)
+    args = parser.parse_args()
+    load(args.clients, args.providers, args.jobs, args.candidates, args.reviews, args.incremental,
+         args.run, args.seed, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()